@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+SHAPE: nearest neighbors benchmark
+Created on Sunday October 18 2026
+@author: patricia-ternes
+
+Compare the "sorted" and "sklearn" backends of
+`EnrichingPopulation.get_neighbors` on synthetic propensity scores.
+
+Usage (from the repository root):
+
+    $ python benchmarks/neighbors.py --spenser 200000 --epc 150000
+"""
+from argparse import ArgumentParser
+import os
+import sys
+from time import perf_counter
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "shape"))
+from enriching_population import EnrichingPopulation  # noqa: E402
+
+
+def propensity_scores(n_rows, n_values, rng):
+    """Return propensity scores with `n_values` distinct values (many ties)."""
+    values = rng.random(n_values)
+    return pd.DataFrame({"ps": rng.choice(values, n_rows)})
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description=__doc__.split("\n\n")[1])
+    parser.add_argument("--spenser", type=int, default=200000)
+    parser.add_argument("--epc", type=int, default=150000)
+    parser.add_argument("--n-neighbors", type=int, default=200)
+    parser.add_argument("--distinct", type=int, default=5000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    df1 = propensity_scores(args.spenser, args.distinct, rng)
+    df2 = propensity_scores(args.epc, args.distinct, rng)
+
+    results = {}
+    for backend in ["sklearn", "sorted"]:
+        t0 = perf_counter()
+        results[backend] = EnrichingPopulation.get_neighbors(
+            df1, df2, args.n_neighbors, backend
+        )
+        print(f"{backend:>8}: {perf_counter() - t0:.2f} seconds")
+
+    same = np.array_equal(results["sklearn"][0], results["sorted"][0])
+    print(f"same distances: {same}")
+    same = np.array_equal(results["sklearn"][1], results["sorted"][1])
+    print(f"same neighbors: {same}")
@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+SHAPE: pipeline benchmark
+Created on Sunday October 18 2026
+@author: patricia-ternes
+
+Time and memory-profile each stage of `Epc`, `Spenser` and
+`EnrichingPopulation` offline, on synthetic inputs (see `shape/synthetic.py`).
+
+Every combination of the given neighbors backends and propensity score
+estimators runs all the Local Authorities; the stages are measured with the
+`instrumentation` module (wall time, peak RSS increase, rows in and out).
+
+Usage (from the repository root):
+
+    $ python benchmarks/pipeline.py --scale region --neighbors-backend sorted sklearn
+"""
+from argparse import ArgumentParser
+import os
+import shutil
+import sys
+import tempfile
+from time import perf_counter
+
+import pandas as pd
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, os.path.join(ROOT, "shape"))
+from data_preparation import Epc, Spenser, geo_lookup  # noqa: E402
+from enriching_population import EnrichingPopulation  # noqa: E402
+from instrumentation import RunReport, collect, measure, peak_rss  # noqa: E402
+from pipeline import run_lads  # noqa: E402
+from propensity import get_estimator  # noqa: E402
+from synthetic import SCALES, generate  # noqa: E402
+
+
+def summarise(table) -> pd.DataFrame:
+    """Return the totals of each stage (the peak RSS increase is the maximum).
+
+    :param table: stage records (see `instrumentation.RunReport.table`)
+    :type table: pandas.DataFrame
+    :rtype: pandas.DataFrame
+    """
+    return table.groupby("stage", sort=False).agg(
+        calls=("seconds", "size"),
+        seconds=("seconds", "sum"),
+        peak_rss_delta_mb=("peak_rss_delta_mb", "max"),
+        rows_in=("rows_in", "sum"),
+        rows_out=("rows_out", "sum"),
+    )
+
+
+def load_inputs(use_cache=False):
+    """Load the geographic lookups, SPENSER and EPC data (measured).
+
+    :param use_cache: use the cached data, defaults to False.
+    :type use_cache: bool, optional
+    :return: LAD codes, EPC, SPENSER and the load stage records
+    :rtype: list, data_preparation.Epc, data_preparation.Spenser, pandas.DataFrame
+    """
+    with collect("load") as records:
+        with measure("geo_lookup") as record:
+            lad_codes, ladnm, ladcd, oacd = geo_lookup(use_cache=use_cache)
+            record["rows_out"] = len(ladcd)
+        with measure("spenser_load") as record:
+            spenser = Spenser(ladnm, ladcd, use_cache=use_cache)
+            record["rows_out"] = len(spenser.df)
+        with measure("epc_load") as record:
+            epc = Epc(oacd, ladnm, ladcd, use_cache=use_cache)
+            record["rows_out"] = len(epc.df)
+
+    table = pd.DataFrame(records, columns=RunReport.COLUMNS[1:])
+    table.insert(0, "LADCD", "load")
+    return lad_codes, epc, spenser, table
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description=__doc__.split("\n\n")[1])
+    parser.add_argument("--scale", choices=list(SCALES), default="lad")
+    for name in SCALES["lad"]:
+        parser.add_argument("--" + name.replace("_", "-"), type=int)
+    parser.add_argument(
+        "--workdir", help="benchmark folder (default: a temporary folder)"
+    )
+    parser.add_argument(
+        "--reuse", action="store_true", help="reuse the inputs of --workdir"
+    )
+    parser.add_argument("--cache", action="store_true", help="use the data cache")
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument(
+        "--neighbors-backend", nargs="+", help="default: as in the configuration"
+    )
+    parser.add_argument(
+        "--propensity-estimator", nargs="+", help="default: as in the configuration"
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="save the stage totals as a CSV file")
+    args = parser.parse_args()
+
+    sizes = {
+        name: value if getattr(args, name) is None else getattr(args, name)
+        for name, value in SCALES[args.scale].items()
+    }
+    output = os.path.abspath(args.output) if args.output else None
+    workdir = args.workdir or tempfile.mkdtemp(prefix="shape-benchmark-")
+    os.makedirs(workdir, exist_ok=True)
+    shutil.copytree(
+        os.path.join(ROOT, "config"),
+        os.path.join(workdir, "config"),
+        dirs_exist_ok=True,
+    )
+    os.chdir(workdir)  # SHAPE reads "config/" and "data/" from here
+
+    if not args.reuse:
+        t0 = perf_counter()
+        generate("data/input/", **sizes, seed=args.seed)
+        print(f"Synthetic inputs ({sizes}): {perf_counter() - t0:.2f} seconds")
+
+    lad_codes, epc, spenser, load_table = load_inputs(args.cache)
+    psm = EnrichingPopulation()
+    psm.seed = args.seed
+    backends = args.neighbors_backend or [psm.neighbors_backend]
+    estimators = args.propensity_estimator or [None]
+
+    summaries = []
+    for backend in backends:
+        for estimator in estimators:
+            psm.neighbors_backend = backend
+            if estimator is not None:
+                psm.estimator = get_estimator(estimator)
+            report = RunReport()
+            t0 = perf_counter()
+            for lad_code, result in run_lads(
+                lad_codes, epc, spenser, psm, workers=args.workers, report=report
+            ):
+                if result is None:
+                    print(f"{lad_code} failed: {report.lads[lad_code]['error']}")
+            total = perf_counter() - t0
+
+            summary = summarise(pd.concat([load_table, report.table]))
+            estimator = estimator or "configured"
+            print(f"\nneighbors_backend={backend}, propensity_estimator={estimator}")
+            print(summary.to_string(float_format="{:.3f}".format))
+            print(f"Local Authorities: {total:.2f} seconds")
+            summaries.append(
+                summary.reset_index().assign(
+                    neighbors_backend=backend, propensity_estimator=estimator
+                )
+            )
+
+    print(f"\nPeak RSS: {peak_rss():.0f} MB")
+    if output is not None:
+        pd.concat(summaries).to_csv(output, index=False)
+    if args.workdir is None:
+        shutil.rmtree(workdir)
@@ -12,6 +12,9 @@ setuptools.setup(
     long_description=long_description,
     long_description_content_type="text/markdown",
     packages=setuptools.find_packages(),
+    entry_points={"console_scripts": ["shape = shape.cli:main"]},
+    # Parquet data cache, checkpoint and outputs (included in environment.yml)
+    extras_require={"parquet": ["pyarrow>=7.0.0"]},
     classifiers=[
         "Development Status :: 3 - Alpha",
         "Programming Language :: Python :: 3.9",
@@ -0,0 +1,439 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+SHAPE: on-demand Local Authority API
+Created on Sunday October 18 2026
+@author: patricia-ternes
+"""
+from collections import OrderedDict, defaultdict
+from http.server import BaseHTTPRequestHandler, HTTPServer
+import numpy as np
+import pandas as pd
+
+try:
+    from .cache import cache_key, zip_fingerprint
+    from .data_preparation import (
+        Epc,
+        LadPartition,
+        Spenser,
+        concat_categorical,
+        geo_lookup,
+    )
+    from .enriching_population import EnrichingPopulation
+    from .geography import encode
+    from .instrumentation import RunReport
+    from .pipeline import run_lads
+    from .settings import load_config
+    from .zip_reader import ZipCsvReader
+except ImportError:
+    from cache import cache_key, zip_fingerprint
+    from data_preparation import (
+        Epc,
+        LadPartition,
+        Spenser,
+        concat_categorical,
+        geo_lookup,
+    )
+    from enriching_population import EnrichingPopulation
+    from geography import encode
+    from instrumentation import RunReport
+    from pipeline import run_lads
+    from settings import load_config
+    from zip_reader import ZipCsvReader
+
+# Loader shared by the `run` calls of the process (see `get_loader`)
+_loader = {}
+
+
+class LadLoader:
+    """EPC and SPENSER data of a few Local Authorities, read on demand.
+
+    Only the input files that feed the requested Local Authorities are read:
+    their certificate folders (plus the unknown local authority and merged
+    folders with some of their postcodes) and their SPENSER households files.
+    These files are found with an index of the zip files, built once (it is
+    the only step that reads every certificate file, and only three of its
+    columns) and stored in the data cache:
+
+    - The Local Authorities fed by each certificate and households file.
+    - Whether each certificate is the latest one of its building in the
+      whole country (see `Epc.remove_duplicates`), one bit per certificate.
+
+    So each Local Authority has exactly the rows (and row order) of the
+    national dataframes. The prepared Local Authority frames are kept in a
+    least recently used cache, so repeated requests in the same process do
+    not read the zip files again.
+    """
+
+    def __init__(self, use_cache=True, maxsize=None) -> None:
+        """Initialise a LadLoader class.
+
+        :param use_cache: If True, the geographic lookups and the zip files
+            index are read from (or stored in) the data cache, defaults to
+            True.
+        :type use_cache: bool, optional
+        :param maxsize: Number of Local Authorities kept in memory, defaults
+            to `lad_cache_size` in "config/config.yaml".
+        :type maxsize: int, optional
+        """
+        parsed_config = load_config()
+        if maxsize is None:
+            maxsize = parsed_config.get("lad_cache_size", 32)
+        self.maxsize = maxsize
+        self.use_cache = use_cache
+
+        # Data preparation methods only: no national dataframe is loaded
+        self.lad_codes, ladnm_lookup, ladcd_lookup, oacd_lookup = geo_lookup(
+            use_cache=use_cache
+        )
+        self.epc = Epc(
+            oacd_lookup, ladnm_lookup, ladcd_lookup, stream=True, use_cache=use_cache
+        )
+        self.spenser = Spenser(
+            ladnm_lookup, ladcd_lookup, use_cache=use_cache, load=False
+        )
+        self.store = self.epc.area.store
+
+        self.index = None
+        self.frames = OrderedDict()
+
+    def get_index(self) -> dict:
+        """Return the index of the EPC and SPENSER zip files.
+
+        :return: "epc_files" and "spenser_files" (names), "epc_lads" and
+            "spenser_lads" (file position and Local Authority id pairs, see
+            `geography.GeoLookupStore`), "epc_offsets" (first certificate of
+            each file) and "epc_keep" (packed bits, see `numpy.packbits`).
+        :rtype: dict
+        """
+        if self.index is not None:
+            return self.index
+
+        key = cache_key(
+            zip_fingerprint(self.epc.path),
+            zip_fingerprint(self.spenser.path),
+            zip_fingerprint(self.epc.area_path),
+        )
+        arrays = None
+        if self.use_cache:
+            arrays = self.epc.cache.load_arrays("lad-index", key)
+        if arrays is None:
+            arrays = {**self.index_certificates(), **self.index_households()}
+            if self.use_cache:
+                self.epc.cache.save_arrays("lad-index", key, arrays)
+
+        self.index = dict(arrays)
+        for name in ["epc_files", "spenser_files"]:
+            self.index[name] = np.char.decode(arrays[name], "utf-8").tolist()
+        return self.index
+
+    def index_certificates(self) -> dict:
+        """Index the certificate files (see `get_index`).
+
+        :return: "epc_files", "epc_lads", "epc_offsets" and "epc_keep" arrays
+        :rtype: dict
+        """
+        reader = ZipCsvReader(self.epc.path)
+        files = self.epc.get_certificate_files(reader.zip_file)
+
+        columns = ["POSTCODE", "BUILDING_REFERENCE_NUMBER", "LODGEMENT_DATETIME"]
+        dtype = {
+            "POSTCODE": "category",
+            "BUILDING_REFERENCE_NUMBER": float,
+            "LODGEMENT_DATETIME": str,
+        }
+        parts, offsets = [], [0]
+        for df in reader.map(lambda file: reader.read(file, columns, dtype), files):
+            df["LODGEMENT_DATETIME"] = Epc.parse_dates(df["LODGEMENT_DATETIME"])
+            position = self.store.postcode_positions(df.pop("POSTCODE"))
+            df["ROW"] = np.arange(offsets[-1], offsets[-1] + len(df))
+            df["LAD"] = self.store.lad_positions(position)
+            # certificates with an unknown postcode are not in the national
+            # dataframe
+            parts.append(df[position >= 0])
+            offsets.append(offsets[-1] + len(df))
+
+        # Latest certificate of each building in the whole country
+        kept = Epc.remove_duplicates(pd.concat(parts))
+        keep = np.zeros(offsets[-1], dtype=bool)
+        keep[kept["ROW"].to_numpy()] = True
+
+        file_position = np.searchsorted(offsets, kept["ROW"], side="right") - 1
+        pairs = np.column_stack([file_position, kept["LAD"]])
+
+        return {
+            "epc_files": encode(files),
+            "epc_lads": np.unique(pairs[pairs[:, 1] >= 0], axis=0),
+            "epc_offsets": np.array(offsets, dtype=np.int64),
+            "epc_keep": np.packbits(keep),
+        }
+
+    def index_households(self) -> dict:
+        """Index the SPENSER households files (see `get_index`).
+
+        :return: "spenser_files" and "spenser_lads" arrays
+        :rtype: dict
+        """
+        reader = ZipCsvReader(self.spenser.path)
+        files = self.spenser.get_household_files(reader.zip_file)
+        lad_ids = {lad_code: lad for lad, lad_code in enumerate(self.store.lads())}
+
+        # The files named by Local Authority are not read
+        pairs = []
+        unnamed = []
+        for file_position, lad_code in enumerate(
+            self.spenser.get_household_lads(files)
+        ):
+            if lad_code is None:
+                unnamed.append(file_position)
+            else:
+                pairs.append((file_position, lad_ids[lad_code]))
+
+        areas = reader.map(
+            lambda i: reader.read(files[i], ["Area"], {"Area": "category"}), unnamed
+        )
+        for file_position, oas in zip(unnamed, (df.Area for df in areas)):
+            lads = np.unique(
+                self.store.lad_positions(self.store.oa_positions(oas.unique()))
+            )
+            pairs += [(file_position, lad) for lad in lads[lads >= 0]]
+
+        return {
+            "spenser_files": encode(files),
+            "spenser_lads": np.array(pairs, dtype=np.int64).reshape(-1, 2),
+        }
+
+    def get_files(self, name, lad_codes) -> list:
+        """Return the positions of the files that feed some Local Authorities.
+
+        :param name: "epc" or "spenser"
+        :type name: string
+        :param lad_codes: Local authority district codes.
+        :type lad_codes: list
+        :return: file positions, in the zip order
+        :rtype: list
+        """
+        pairs = self.get_index()[f"{name}_lads"]
+        lads = np.flatnonzero(np.isin(self.lad_codes, lad_codes))
+        return np.unique(pairs[np.isin(pairs[:, 1], lads), 0]).tolist()
+
+    def get_keep(self, file_position) -> np.ndarray:
+        """Return which certificates of a file are kept (see `get_index`).
+
+        :param file_position: position of the certificate file
+        :type file_position: int
+        :return: one boolean per certificate of the file
+        :rtype: numpy.ndarray
+        """
+        index = self.get_index()
+        start, stop = index["epc_offsets"][file_position : file_position + 2]
+        packed = index["epc_keep"][start // 8 : (stop + 7) // 8]
+        bits = np.unpackbits(packed)[start % 8 : start % 8 + stop - start]
+        return bits.astype(bool)
+
+    def read(self, lad_codes) -> dict:
+        """Read the EPC and SPENSER data of some Local Authorities.
+
+        :param lad_codes: Local authority district codes.
+        :type lad_codes: list
+        :return: raw EPC and SPENSER data of each Local Authority (`None`
+            when a Local Authority has no rows)
+        :rtype: dict
+        """
+        index = self.get_index()
+        requested = set(lad_codes)
+
+        epc_parts = defaultdict(list)
+        reader = ZipCsvReader(self.epc.path)
+        file_positions = self.get_files("epc", lad_codes)
+        dfs = reader.map(
+            lambda i: self.epc.read_certificates(reader, index["epc_files"][i]),
+            file_positions,
+        )
+        for file_position, df in zip(file_positions, dfs):
+            df = df.take(np.flatnonzero(self.get_keep(file_position)))
+            self.epc.area.apply_postcode(df)
+            df.drop(
+                columns=["BUILDING_REFERENCE_NUMBER", "LODGEMENT_DATETIME"],
+                inplace=True,
+            )
+            for lad_code, lad_df in df.groupby("LADCD", sort=False, observed=True):
+                if lad_code in requested:
+                    epc_parts[lad_code].append(lad_df)
+
+        spenser_parts = defaultdict(list)
+        reader = ZipCsvReader(self.spenser.path)
+        dfs = reader.map(
+            lambda i: self.spenser.read_households(reader, index["spenser_files"][i]),
+            self.get_files("spenser", lad_codes),
+        )
+        for df in dfs:
+            df = self.spenser.prepare(df)
+            for lad_code, lad_df in df.groupby("LADCD", sort=False, observed=True):
+                if lad_code in requested:
+                    spenser_parts[lad_code].append(lad_df)
+
+        frames = {}
+        for lad_code in lad_codes:
+            frames[lad_code] = tuple(
+                concat_categorical(parts[lad_code]).reset_index(drop=True)
+                if parts[lad_code]
+                else None
+                for parts in (epc_parts, spenser_parts)
+            )
+        return frames
+
+    def get(self, lad_codes) -> dict:
+        """Return the EPC and SPENSER data of some Local Authorities.
+
+        The Local Authorities that are not in memory are read together (see
+        `read`), and the least recently used ones are dropped.
+
+        :param lad_codes: Local authority district codes.
+        :type lad_codes: list
+        :return: raw EPC and SPENSER data of each Local Authority, do not
+            modify them (`None` when a Local Authority has no rows)
+        :rtype: dict
+        """
+        lad_codes = list(dict.fromkeys(lad_codes))
+        unknown = sorted(set(lad_codes) - set(self.lad_codes))
+        if unknown:
+            raise ValueError(f"Unknown Local Authorities: {', '.join(unknown)}")
+
+        missing = [lad_code for lad_code in lad_codes if lad_code not in self.frames]
+        if missing:
+            self.frames.update(self.read(missing))
+
+        frames = {}
+        for lad_code in lad_codes:
+            self.frames.move_to_end(lad_code)
+            frames[lad_code] = self.frames[lad_code]
+        while len(self.frames) > self.maxsize:
+            self.frames.popitem(last=False)
+        return frames
+
+    def load(self, lad_codes):
+        """Return EPC and SPENSER objects with some Local Authorities only.
+
+        Their `get_lad_dataframe` methods work as with the national data, so
+        they can be given to `pipeline.run_lads`.
+
+        :param lad_codes: Local authority district codes.
+        :type lad_codes: list
+        :return: EPC and SPENSER data and related methods
+        :rtype: data_preparation.Epc, data_preparation.Spenser
+        """
+        frames = self.get(lad_codes).values()
+        for i, data in enumerate([self.epc, self.spenser]):
+            # shallow copies: `concat_categorical` changes the column types
+            dfs = [
+                lad_dfs[i].copy(deep=False)
+                for lad_dfs in frames
+                if lad_dfs[i] is not None
+            ]
+            df = concat_categorical(dfs) if dfs else pd.DataFrame({"LADCD": []})
+            data.df, data.partition = LadPartition.sort(df.reset_index(drop=True))
+        return self.epc, self.spenser
+
+
+def get_loader(use_cache=True) -> LadLoader:
+    """Return the loader shared by the `run` calls of the process.
+
+    :param use_cache: see `LadLoader`, defaults to True.
+    :type use_cache: bool, optional
+    :rtype: LadLoader
+    """
+    if use_cache not in _loader:
+        _loader[use_cache] = LadLoader(use_cache=use_cache)
+    return _loader[use_cache]
+
+
+def run(lads, workers=1, loader=None, report=None) -> dict:
+    """Enrich the SPENSER population of some Local Authorities only.
+
+    Only the input files of the requested Local Authorities are read (see
+    `LadLoader`), and their prepared data is kept in memory for the next
+    calls. Run it from the folder with "config/" and "data/".
+
+    Example::
+
+        from shape.api import run
+        results = run(lads=["E06000001"])
+        shape_df = results["E06000001"]["shape"]
+
+    :param lads: Local authority district codes.
+    :type lads: list
+    :param workers: Number of worker processes, defaults to 1.
+    :type workers: int, optional
+    :param loader: Loader of the Local Authority data, defaults to the loader
+        shared by the process (see `get_loader`).
+    :type loader: LadLoader, optional
+    :param report: Run report where the telemetry of each Local Authority
+        (stages, errors) is added, defaults to None.
+    :type report: instrumentation.RunReport, optional
+    :return: results of each Local Authority, see `pipeline.run_lads`
+        (`None` if the Local Authority failed)
+    :rtype: dict
+    """
+    if loader is None:
+        loader = get_loader()
+    epc, spenser = loader.load(lads)
+    psm = EnrichingPopulation()
+
+    return dict(run_lads(lads, epc, spenser, psm, workers=workers, report=report))
+
+
+class LadRequestHandler(BaseHTTPRequestHandler):
+    """HTTP requests of `serve`.
+
+    - `GET /<LAD code>`: enriched population (CSV).
+    - `GET /<LAD code>/epc`: processed EPC data (CSV).
+    """
+
+    loader = None
+
+    def do_GET(self):
+        lad_code, _, name = self.path.strip("/").partition("/")
+        if name not in ["", "epc"]:
+            self.send_error(404, "Use /<LAD code> or /<LAD code>/epc")
+            return
+
+        report = RunReport()
+        try:
+            result = run([lad_code], loader=self.loader, report=report)[lad_code]
+        except ValueError as error:
+            self.send_error(404, str(error))
+            return
+        if result is None:
+            self.send_error(500, report.lads[lad_code]["error"]["message"])
+            return
+
+        body = result[name or "shape"].to_csv(index=False).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/csv; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def serve(port=8765, host="127.0.0.1", loader=None):
+    """Serve the Local Authorities over HTTP, keeping the data in memory.
+
+    Requests are answered one at a time (see `LadRequestHandler`), until the
+    process is interrupted.
+
+    :param port: port number, defaults to 8765.
+    :type port: int, optional
+    :param host: host name, defaults to "127.0.0.1" (local requests only).
+    :type host: string, optional
+    :param loader: Loader of the Local Authority data, defaults to the loader
+        shared by the process (see `get_loader`).
+    :type loader: LadLoader, optional
+    """
+    LadRequestHandler.loader = loader or get_loader()
+    with HTTPServer((host, port), LadRequestHandler) as server:
+        print(f"Serving SHAPE on http://{host}:{port}/<LAD code>")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
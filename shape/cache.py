@@ -0,0 +1,226 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+SHAPE: on-disk cache of parsed inputs
+Created on Sunday October 18 2026
+@author: patricia-ternes
+"""
+import glob
+import hashlib
+import json
+import os
+import shutil
+import warnings
+import zipfile
+import numpy as np
+import pandas as pd
+
+# Bump when the cached dataframes change for a reason the keys do not cover
+# (e.g. a change in the data preparation code).
+CACHE_VERSION = 3
+
+
+def zip_fingerprint(path) -> str:
+    """Return a hash of the content of a zip file.
+
+    The hash is computed from the zip central directory (name, CRC-32 and size
+    of every member), so it changes whenever any member changes but it does
+    not require reading the (multi-GB) compressed data.
+
+    :param path: zip file location
+    :type path: string
+    :return: hexadecimal hash
+    :rtype: string
+    """
+    digest = hashlib.sha256()
+    with zipfile.ZipFile(path) as zip_file:
+        for info in zip_file.infolist():
+            digest.update(f"{info.filename}:{info.CRC}:{info.file_size}\n".encode())
+    return digest.hexdigest()
+
+
+def cache_key(*parts) -> str:
+    """Return a hash of the given (JSON serialisable) key parts.
+
+    :return: hexadecimal hash
+    :rtype: string
+    """
+    text = json.dumps([CACHE_VERSION, *parts], sort_keys=True, default=str)
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+def has_parquet() -> bool:
+    """Return True if a Parquet engine (pyarrow) is available.
+
+    :rtype: bool
+    """
+    try:
+        import pyarrow.parquet  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+class DataCache:
+    """Columnar (Parquet) cache of parsed dataframes.
+
+    Each entry is stored as `<name>-<key>.parquet`, plus a `.json` file with
+    its metadata (or as a `<name>-<key>` folder of `.npy` files for arrays,
+    see `save_arrays`). The key is a hash of everything the dataframe depends on
+    (input files and configuration), so a changed input is never read from
+    the cache, and saving a new entry removes the stale ones with the same
+    name.
+
+    The cache needs pyarrow: without it, the cache is disabled (with a
+    warning) and every entry is built again.
+    """
+
+    def __init__(self, cache_dir="data/cache/") -> None:
+        """Initialise a DataCache class.
+
+        :param cache_dir: cache folder, defaults to "data/cache/".
+        :type cache_dir: string, optional
+        """
+        self.cache_dir = cache_dir
+        self.enabled = has_parquet()
+        if not self.enabled:
+            # shown once (same message and location)
+            warnings.warn(
+                f"pyarrow is not installed: the data cache ({cache_dir}) is "
+                "disabled and the input files are parsed at every run"
+            )
+
+    def path(self, name, key) -> str:
+        """Return the Parquet file location of an entry.
+
+        :param name: entry name (e.g. "epc")
+        :type name: string
+        :param key: entry key
+        :type key: string
+        :rtype: string
+        """
+        return os.path.join(self.cache_dir, f"{name}-{key[:16]}.parquet")
+
+    def load(self, name, key):
+        """Return a cached dataframe and its metadata.
+
+        The Parquet file is memory-mapped while it is read.
+
+        :param name: entry name (e.g. "epc")
+        :type name: string
+        :param key: entry key
+        :type key: string
+        :return: dataframe and metadata, or `None, None` if not cached
+        :rtype: pandas.DataFrame, dict
+        """
+        path = self.path(name, key)
+        if not (self.enabled and os.path.exists(path)):
+            return None, None
+
+        with open(path.replace(".parquet", ".json")) as infile:
+            metadata = json.load(infile)
+        if metadata.get("key") != key:
+            return None, None
+
+        df = pd.read_parquet(path, memory_map=True)
+        return df, metadata
+
+    def save(self, name, key, df, metadata=None):
+        """Store a dataframe in the cache (replacing the stale entries).
+
+        :param name: entry name (e.g. "epc")
+        :type name: string
+        :param key: entry key
+        :type key: string
+        :param df: dataframe to store
+        :type df: pandas.DataFrame
+        :param metadata: JSON serialisable information, defaults to None.
+        :type metadata: dict, optional
+        """
+        if not self.enabled:
+            return
+
+        self.remove(name)
+        path = self.path(name, key)
+        df.to_parquet(path + ".tmp", index=False)
+        with open(path.replace(".parquet", ".json"), "w") as outfile:
+            json.dump({**(metadata or {}), "key": key}, outfile)
+        os.replace(path + ".tmp", path)
+
+    def load_or_build(self, name, key, build):
+        """Return a cached dataframe, building (and caching) it if needed.
+
+        :param name: entry name (e.g. "epc")
+        :type name: string
+        :param key: entry key
+        :type key: string
+        :param build: function returning the dataframe and its metadata
+        :type build: callable
+        :return: dataframe and metadata
+        :rtype: pandas.DataFrame, dict
+        """
+        df, metadata = self.load(name, key)
+        if df is None:
+            df, metadata = build()
+            self.save(name, key, df, metadata)
+
+        return df, metadata
+
+    def remove(self, name):
+        """Remove all the entries with the given name.
+
+        :param name: entry name (e.g. "epc")
+        :type name: string
+        """
+        os.makedirs(self.cache_dir, exist_ok=True)
+        for stale in glob.glob(os.path.join(self.cache_dir, f"{name}-*")):
+            if os.path.isdir(stale):
+                shutil.rmtree(stale)
+            else:
+                os.remove(stale)
+
+    def load_arrays(self, name, key):
+        """Return cached arrays, memory-mapped (read only).
+
+        Arrays are stored as uncompressed `.npy` files, so they do not need
+        a Parquet engine.
+
+        :param name: entry name (e.g. "geo")
+        :type name: string
+        :param key: entry key
+        :type key: string
+        :return: arrays, or `None` if not cached
+        :rtype: dict
+        """
+        folder = self.path(name, key)[: -len(".parquet")]
+        try:
+            with open(os.path.join(folder, "metadata.json")) as infile:
+                metadata = json.load(infile)
+        except FileNotFoundError:
+            return None
+        if metadata.get("key") != key:
+            return None
+
+        return {
+            array: np.load(os.path.join(folder, f"{array}.npy"), mmap_mode="r")
+            for array in metadata["arrays"]
+        }
+
+    def save_arrays(self, name, key, arrays):
+        """Store arrays in the cache (replacing the stale entries).
+
+        :param name: entry name (e.g. "geo")
+        :type name: string
+        :param key: entry key
+        :type key: string
+        :param arrays: numpy arrays (no object arrays)
+        :type arrays: dict
+        """
+        self.remove(name)
+        folder = self.path(name, key)[: -len(".parquet")]
+        os.makedirs(folder + ".tmp")
+        for array, values in arrays.items():
+            np.save(os.path.join(folder + ".tmp", f"{array}.npy"), values)
+        with open(os.path.join(folder + ".tmp", "metadata.json"), "w") as outfile:
+            json.dump({"key": key, "arrays": list(arrays)}, outfile)
+        os.replace(folder + ".tmp", folder)
@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+SHAPE: checkpoint and resume of the per Local Authority results
+Created on Sunday October 18 2026
+@author: patricia-ternes
+"""
+import hashlib
+import json
+import os
+import shutil
+import pandas as pd
+
+try:
+    from .cache import cache_key, has_parquet
+    from .settings import load_config, load_lookups
+except ImportError:
+    from cache import cache_key, has_parquet
+    from settings import load_config, load_lookups
+
+# Configuration keys that do not change the results
+IGNORED_KEYS = ["cache_dir", "checkpoint_dir", "lad_cache_size", "read_workers"]
+IGNORED_PREFIXES = ["output_"]
+
+
+def frame_hash(df) -> str:
+    """Return a hash of the content of a dataframe (columns, dtypes and rows).
+
+    :param df: dataframe
+    :type df: pandas.DataFrame
+    :return: hexadecimal hash
+    :rtype: string
+    """
+    digest = hashlib.sha256()
+    digest.update(str(list(zip(df.columns, map(str, df.dtypes)))).encode())
+    digest.update(pd.util.hash_pandas_object(df, index=False).to_numpy().tobytes())
+    return digest.hexdigest()
+
+
+def config_hash() -> str:
+    """Return a hash of the configuration that changes the results.
+
+    "config/config.yaml" (except the cache, checkpoint and output keys) and
+    "config/lookups.yaml" are included.
+
+    :return: hexadecimal hash
+    :rtype: string
+    """
+    parsed_config = load_config()
+    parsed_lookup = load_lookups()
+
+    config = {
+        key: value
+        for key, value in parsed_config.items()
+        if key not in IGNORED_KEYS
+        and not any(key.startswith(prefix) for prefix in IGNORED_PREFIXES)
+    }
+    return cache_key(config, parsed_lookup)
+
+
+class Checkpoint:
+    """Results of the completed Local Authorities, saved as they complete.
+
+    Each Local Authority result (enriched population and processed EPC) is
+    saved as Parquet files in the checkpoint folder. The `manifest.json` file
+    records, for each completed Local Authority, the hash of its inputs
+    (its raw EPC and SPENSER rows and the configuration, see `get_key`) and
+    the number of EPC rows discarded by the lookups. A new run loads the
+    Local Authorities whose inputs did not change, and runs the failed,
+    missing or changed ones.
+
+    The manifest is only written by the main process (`record`), after the
+    Local Authority files are complete, so an interrupted run never leaves a
+    partial result in the manifest.
+    """
+
+    def __init__(self, checkpoint_dir=None, restart=False) -> None:
+        """Initialise a Checkpoint class.
+
+        :param checkpoint_dir: checkpoint folder, defaults to the
+            `checkpoint_dir` of "config/config.yaml".
+        :type checkpoint_dir: string, optional
+        :param restart: Discard the saved results, defaults to False.
+        :type restart: bool, optional
+        """
+        if checkpoint_dir is None:
+            parsed_config = load_config()
+            checkpoint_dir = parsed_config.get("checkpoint_dir", "data/checkpoint/")
+
+        self.checkpoint_dir = checkpoint_dir
+        self.manifest_path = os.path.join(checkpoint_dir, "manifest.json")
+        self.enabled = has_parquet()
+        self.config = config_hash()
+
+        if restart and os.path.exists(checkpoint_dir):
+            shutil.rmtree(checkpoint_dir)
+        os.makedirs(checkpoint_dir, exist_ok=True)
+
+        self.lads = {}
+        if os.path.exists(self.manifest_path):
+            with open(self.manifest_path) as infile:
+                self.lads = json.load(infile)["lads"]
+
+    def get_key(self, epc_lad_df, spenser_lad_df) -> str:
+        """Return the key of a Local Authority: hash of all its inputs.
+
+        :param epc_lad_df: raw EPC data of the Local Authority.
+        :type epc_lad_df: pandas.DataFrame
+        :param spenser_lad_df: raw SPENSER data of the Local Authority.
+        :type spenser_lad_df: pandas.DataFrame
+        :return: hexadecimal hash
+        :rtype: string
+        """
+        return cache_key(
+            self.config, frame_hash(epc_lad_df), frame_hash(spenser_lad_df)
+        )
+
+    def path(self, lad_code, name) -> str:
+        """Return the location of a Local Authority result file.
+
+        :param lad_code: Local authority district code.
+        :type lad_code: string
+        :param name: "shape" or "epc"
+        :type name: string
+        :rtype: string
+        """
+        return os.path.join(self.checkpoint_dir, f"{lad_code}_{name}.parquet")
+
+    def load(self, lad_code, key):
+        """Return the saved result of a Local Authority.
+
+        :param lad_code: Local authority district code.
+        :type lad_code: string
+        :param key: current key of the Local Authority (see `get_key`)
+        :type key: string
+        :return: result (see `pipeline.run_lads`), or `None` if the Local
+            Authority is not completed or its inputs changed
+        :rtype: dict
+        """
+        entry = self.lads.get(lad_code)
+        if not (self.enabled and entry and entry["key"] == key):
+            return None
+
+        try:
+            return {
+                "shape": pd.read_parquet(self.path(lad_code, "shape")),
+                "epc": pd.read_parquet(self.path(lad_code, "epc")),
+                "lookup_misses": entry["lookup_misses"],
+                "key": key,
+                "resumed": True,
+            }
+        except (OSError, ValueError):
+            return None
+
+    def save(self, lad_code, result):
+        """Save the result files of a Local Authority (see `record`).
+
+        :param lad_code: Local authority district code.
+        :type lad_code: string
+        :param result: result (see `pipeline.run_lads`)
+        :type result: dict
+        """
+        if not self.enabled:
+            return
+
+        for name in ["shape", "epc"]:
+            path = self.path(lad_code, name)
+            result[name].to_parquet(path + ".tmp", index=False)
+            os.replace(path + ".tmp", path)
+
+    def record(self, lad_code, result):
+        """Add a completed Local Authority to the manifest.
+
+        :param lad_code: Local authority district code.
+        :type lad_code: string
+        :param result: result (see `pipeline.run_lads`), `None` if the Local
+            Authority failed (it is removed from the manifest).
+        :type result: dict
+        """
+        if result is None or "key" not in result:
+            self.lads.pop(lad_code, None)
+        else:
+            self.lads[lad_code] = {
+                "key": result["key"],
+                "lookup_misses": result["lookup_misses"],
+            }
+
+        with open(self.manifest_path + ".tmp", "w") as outfile:
+            json.dump({"config": self.config, "lads": self.lads}, outfile, indent=1)
+        os.replace(self.manifest_path + ".tmp", self.manifest_path)
@@ -0,0 +1,371 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+SHAPE: command line interface
+Created on Sunday October 18 2026
+@author: patricia-ternes
+"""
+from argparse import ArgumentParser
+import importlib
+import sys
+from time import time
+
+# Subcommands ("all" is the default)
+COMMANDS = ["prepare", "match", "validate", "all", "serve"]
+
+HISTOGRAMS_PATH = "data/output/SHAPE_validation-histograms.csv"
+METRICS_PATH = "data/output/SHAPE_validation-metrics.csv"
+FIGURES_PATH = "data/output/SHAPE_distribution-images.zip"
+
+
+def load_module(name):
+    """Import a SHAPE module when a stage needs it.
+
+    The stages import the data, matching and plotting libraries on demand,
+    so the command line starts fast and each stage only pays for its own
+    libraries.
+
+    :param name: module name (e.g. "data_preparation")
+    :type name: string
+    :rtype: module
+    """
+    if __package__:
+        return importlib.import_module(f"{__package__}.{name}")
+    return importlib.import_module(name)
+
+
+def get_parser() -> ArgumentParser:
+    """Return the parser of the `shape` command and its subcommands.
+
+    :rtype: argparse.ArgumentParser
+    """
+    parser = ArgumentParser(prog="shape", description="Generate the SHAPE population.")
+    commands = parser.add_subparsers(dest="command", metavar="COMMAND")
+
+    # Options shared by the subcommands
+    data = ArgumentParser(add_help=False)
+    data.add_argument(
+        "--lads",
+        default="",
+        metavar="CODES",
+        help="comma-separated local authorities to run, reading only their data",
+    )
+    run = ArgumentParser(add_help=False)
+    run.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="number of worker processes used in the main loop (default: 1)",
+    )
+    run.add_argument(
+        "--stream-epc",
+        action="store_true",
+        help="read the EPC certificates one local authority at a time",
+    )
+    run.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="parse the EPC and SPENSER zip files even if they are cached",
+    )
+    run.add_argument(
+        "--profile",
+        default="",
+        metavar="STAGES",
+        help="comma-separated stages to profile with cProfile, or 'all'",
+    )
+    run.add_argument(
+        "--restart",
+        action="store_true",
+        help="discard the saved local authority results of previous runs",
+    )
+
+    commands.add_parser(
+        "prepare",
+        parents=[data],
+        help="parse the input files into the data cache",
+        description="Parse the geographic lookups, SPENSER and EPC zip files into "
+        "the data cache (with --lads: index the zip files by local authority).",
+    )
+    commands.add_parser(
+        "match",
+        parents=[data, run],
+        help="enrich the population and save the outputs and histograms",
+        description="Enrich the SPENSER population with the EPC data and save the "
+        "outputs and the validation histograms.",
+    )
+    validate = commands.add_parser(
+        "validate",
+        help="render the validation images from the saved histograms",
+        description="Render the validation images from the saved histograms.",
+    )
+    validate.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="number of worker processes rendering the images (default: 1)",
+    )
+    run_all = commands.add_parser(
+        "all",
+        parents=[data, run],
+        help="match and validate (default command)",
+        description="Enrich the SPENSER population, save the outputs and render "
+        "the validation images.",
+    )
+    run_all.add_argument(
+        "--no-figures",
+        action="store_true",
+        help="do not render the validation images (the histograms are saved)",
+    )
+    run_all.add_argument(
+        "--figures-only",
+        action="store_true",
+        help="only render the validation images (same as 'validate')",
+    )
+    run_all.add_argument(
+        "--serve",
+        type=int,
+        metavar="PORT",
+        help="serve single local authorities (same as 'serve PORT')",
+    )
+    serve = commands.add_parser(
+        "serve",
+        help="serve single local authorities over HTTP",
+        description="Serve single local authorities on "
+        "http://127.0.0.1:PORT/<LAD code>.",
+    )
+    serve.add_argument("port", type=int, metavar="PORT")
+    serve.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="parse the EPC and SPENSER zip files even if they are cached",
+    )
+    return parser
+
+
+def prepare(args):
+    """Parse the input files into the data cache (`prepare` subcommand).
+
+    :param args: parsed command line
+    :type args: argparse.Namespace
+    """
+    data_preparation = load_module("data_preparation")
+
+    if args.lads:
+        print("Indexing the zip files by local authority ...", end="\r")
+        load_module("api").LadLoader().get_index()
+        print("Indexing the zip files by local authority: Done")
+        return
+
+    print("Setting up Geographic Lookups ...", end="\r")
+    lookups = data_preparation.geo_lookup()
+    lad_codes, ladnm_lookup, ladcd_lookup, oacd_lookup = lookups
+    print("Setting up Geographic Lookups: Done")
+
+    print("Parsing the SPENSER population ...", end="\r")
+    spenser = data_preparation.Spenser(ladnm_lookup, ladcd_lookup)
+    print(f"Parsing the SPENSER population: {len(spenser.df)} households")
+
+    print("Parsing the EPC data ...", end="\r")
+    epc = data_preparation.Epc(oacd_lookup, ladnm_lookup, ladcd_lookup)
+    print(f"Parsing the EPC data: {len(epc.df)} certificates")
+
+
+def load_data(args):
+    """Return the Local Authorities to run and their EPC and SPENSER data.
+
+    :param args: parsed command line
+    :type args: argparse.Namespace
+    :return: LAD codes, EPC and SPENSER data and related methods
+    :rtype: list, data_preparation.Epc, data_preparation.Spenser
+    """
+    if args.lads:
+        # Only the input files of the requested Local Authorities are read
+        print("\nSetting up the requested local authorities ...", end="\r")
+        lad_codes = args.lads.split(",")
+        loader = load_module("api").LadLoader(use_cache=not args.no_cache)
+        epc, spenser = loader.load(lad_codes)
+        print("Setting up the requested local authorities: Done")
+        return lad_codes, epc, spenser
+
+    data_preparation = load_module("data_preparation")
+
+    # Get Geographic Lookup information
+    print("\nSetting up Geographic Lookups ...", end="\r")
+    lookups = data_preparation.geo_lookup(use_cache=not args.no_cache)
+    lad_codes, ladnm_lookup, ladcd_lookup, oacd_lookup = lookups
+    print("Setting up Geographic Lookups: Done")
+
+    # Initialise the SPENSER population and related methods
+    print("Setting up the SPENSER population and related methods ...", end="\r")
+    spenser = data_preparation.Spenser(
+        ladnm_lookup, ladcd_lookup, use_cache=not args.no_cache
+    )
+    print("Setting up the SPENSER population and related methods: Done")
+
+    # Initialise the EPC dataset and related methods
+    print("Setting up the EPC data and related methods ...", end="\r")
+    epc = data_preparation.Epc(
+        oacd_lookup,
+        ladnm_lookup,
+        ladcd_lookup,
+        stream=args.stream_epc,
+        use_cache=not args.no_cache,
+    )
+    print("Setting up the EPC data and related methods: Done")
+    if epc.files_read and epc.files_reused:
+        print(
+            f"EPC certificate files read: {epc.files_read} "
+            f"({epc.files_reused} unchanged files reused)"
+        )
+    return lad_codes, epc, spenser
+
+
+def match(args):
+    """Enrich the population and save the outputs (`match` subcommand).
+
+    :param args: parsed command line
+    :type args: argparse.Namespace
+    """
+    from collections import Counter
+    from tqdm import tqdm
+
+    lad_codes, epc, spenser = load_data(args)
+
+    # Initialise the Enriching population class
+    print("Setting up the Propensity Score Matching and related methods ...", end="\r")
+    psm = load_module("enriching_population").EnrichingPopulation()
+    print("Setting up the Propensity Score Matching and related methods: Done")
+
+    # Per stage telemetry (and optional cProfile files)
+    instrumentation = load_module("instrumentation")
+    report = instrumentation.RunReport()
+    instrumentation.set_profile([stage for stage in args.profile.split(",") if stage])
+
+    # Results of the completed Local Authorities (previous runs included)
+    checkpoint = load_module("checkpoint").Checkpoint(restart=args.restart)
+
+    # Create history variables
+    validation = load_module("validation")
+    histograms = validation.ValidationHistograms()
+    metrics = validation.ValidationMetrics()
+    error_lad = []
+    lookup_misses = Counter()
+    resumed = 0
+
+    print("Starting main loop")
+    epc_lads = epc.iter_lad_dataframes() if args.stream_epc and not args.lads else None
+    results = load_module("pipeline").run_lads(
+        lad_codes,
+        epc,
+        spenser,
+        psm,
+        workers=args.workers,
+        epc_lads=epc_lads,
+        checkpoint=checkpoint,
+        report=report,
+    )
+    # Enriched Population (SHAPE) and processed EPC are saved in
+    # "data/output/" as soon as each Local Authority is ready
+    output = load_module("output")
+    shape_output = output.OutputArchive(
+        "SHAPE_England", "_SHAPE.csv", report=report, index_column="OA"
+    )
+    epc_output = output.OutputArchive("EPC_England", "_EPC.csv", report=report)
+    with shape_output, epc_output:
+        for lad_code, result in tqdm(results, total=len(lad_codes)):
+            checkpoint.record(lad_code, result)
+            if result is None:
+                error_lad.append(lad_code)
+                continue
+            resumed += result["resumed"]
+
+            # Save Enriched Population and processed EPC
+            shape_output.write(lad_code, result["shape"])
+            epc_output.write(lad_code, result["epc"])
+
+            # Store the validation histograms and metrics
+            histograms.add(result["epc"], result["shape"])
+            metrics.add(result["epc"], result["shape"])
+
+            # Store EPC rows discarded by the lookups
+            lookup_misses.update(result["lookup_misses"])
+
+    print('Saving Outputs in "data/output/" ...', end="\r")
+    # Save Distribution Histograms and validation metrics
+    histograms.save(HISTOGRAMS_PATH)
+    metrics.save(METRICS_PATH)
+    # Save list of missing Local Authorities
+    with open("data/output/error_log.txt", "w") as outfile:
+        outfile.write("\n".join(error_lad))
+    # Save run report (stages telemetry and errors)
+    report.save("data/output/run_report.json", "data/output/run_stages.csv")
+    print('Saving Outputs in "data/output/": Done')
+
+    # The postcode lookup is applied while loading the EPC data
+    lookup_misses["postcode"] = epc.lookup_misses["postcode"]
+    print(
+        "EPC rows discarded by lookup: "
+        + ", ".join(f"{key} {value}" for key, value in sorted(lookup_misses.items()))
+    )
+
+    print(f"Local authorities loaded from the checkpoint: {resumed}")
+
+
+def validate(args):
+    """Render the validation images (`validate` subcommand).
+
+    :param args: parsed command line
+    :type args: argparse.Namespace
+    """
+    print("Saving Distribution Images ...", end="\r")
+    histograms = load_module("validation").ValidationHistograms.load(HISTOGRAMS_PATH)
+    histograms.save_figures(FIGURES_PATH, workers=args.workers)
+    print("Saving Distribution Images: Done")
+
+
+def serve(args):
+    """Serve single Local Authorities over HTTP (`serve` subcommand).
+
+    :param args: parsed command line
+    :type args: argparse.Namespace
+    """
+    api = load_module("api")
+    api.serve(args.port, loader=api.LadLoader(use_cache=not args.no_cache))
+
+
+def main(argv=None):
+    """Run the `shape` command (`all` when no subcommand is given).
+
+    :param argv: command line arguments, defaults to `sys.argv[1:]`.
+    :type argv: list, optional
+    """
+    t0 = time()
+    argv = sys.argv[1:] if argv is None else list(argv)
+    if argv[:1] not in [[command] for command in COMMANDS] + [["-h"], ["--help"]]:
+        argv = ["all"] + argv
+    args = get_parser().parse_args(argv)
+
+    # The configuration is parsed (and validated) once, before any stage
+    load_module("settings").load_config()
+
+    if args.command == "all" and args.figures_only:
+        args.command = "validate"
+    elif args.command == "all" and args.serve:
+        args.command, args.port = "serve", args.serve
+
+    if args.command == "prepare":
+        prepare(args)
+    elif args.command == "match":
+        match(args)
+    elif args.command == "validate":
+        validate(args)
+        return
+    elif args.command == "serve":
+        serve(args)
+        return
+    else:
+        match(args)
+        if not args.no_figures:
+            validate(args)
+
+    print("Total run time {} seconds".format(int(time() - t0)))
@@ -5,50 +5,56 @@ SHAPE: data wrangling
 Created on Thursday August 25 2022
 @author: patricia-ternes
 """
+from collections import Counter, defaultdict
+import os
+import re
 import numpy as np
-import yaml
 import pandas as pd
-import zipfile
 
+try:
+    from .cache import DataCache, cache_key, zip_fingerprint
+    from .geography import GeoLookupStore
+    from .instrumentation import instrumented
+    from .settings import load_config, load_lookups
+    from .zip_reader import ZipCsvReader
+except ImportError:
+    from cache import DataCache, cache_key, zip_fingerprint
+    from geography import GeoLookupStore
+    from instrumentation import instrumented
+    from settings import load_config, load_lookups
+    from zip_reader import ZipCsvReader
 
-def geo_lookup():
-    """Return geographic lookup dicts and local authority list.
 
-    Three lookup dictionaries are generated:
+def geo_lookup(use_cache=True):
+    """Return geographic lookups and local authority list.
+
+    Three lookups are generated:
     - From Postcodes to Output Areas (oacd_lookup).
     - From Output Areas to Local Authority names (ladnm_lookup).
     - From Output Areas to Local Authority codes (ladcd_lookup).
 
-    :return: local authority list, oacd_lookup, ladnm_lookup, ladcd_lookup
-    :rtype: list, dict, dict, dict
+    The lookups are read-only dictionary views of a `GeoLookupStore`, which
+    is built once from the postcode lookup file and then memory-mapped from
+    the data cache.
+
+    :param use_cache: If True, the lookup store is read from (or stored in)
+        the data cache, defaults to True.
+    :type use_cache: bool, optional
+    :return: local authority list, ladnm_lookup, ladcd_lookup, oacd_lookup
+    :rtype: list, geography.StoreLookup, geography.StoreLookup,
+        geography.StoreLookup
     """
 
     # Configure lookups from "config/lookups.yaml" file
-    lookup_yaml = open("config/lookups.yaml")
-    parsed_lookup = yaml.load(lookup_yaml, Loader=yaml.FullLoader)
+    parsed_lookup = load_lookups()
     lookup_path = parsed_lookup.get("area_path")
 
-    # Open file as Pandas DataFrame
-    area_lookup = pd.read_csv(
-        lookup_path,
-        compression="zip",
-        usecols=["ladnm", "ladcd", "oa11cd", "pcds"],
-        encoding="unicode_escape",
-        engine="python",
-    )
+    parsed_config = load_config()
+    cache = DataCache(parsed_config.get("cache_dir", "data/cache/"))
 
-    # Clean empty and non-England areas
-    area_lookup.dropna(subset=["ladcd"], inplace=True)
-    discard = ["S", "W", "N", "L", "M"]
-    area_lookup = area_lookup[~area_lookup.ladcd.str.contains("|".join(discard))]
-    lads = area_lookup.ladcd.unique()
+    store = GeoLookupStore.from_file(lookup_path, cache if use_cache else None)
 
-    # Make lookup dictionaries
-    oacd_lookup = area_lookup.set_index("pcds", drop=True).loc[:, "oa11cd"].to_dict()
-    ladnm_lookup = area_lookup.set_index("oa11cd", drop=True).loc[:, "ladnm"].to_dict()
-    ladcd_lookup = area_lookup.set_index("oa11cd", drop=True).loc[:, "ladcd"].to_dict()
-
-    return lads, ladnm_lookup, ladcd_lookup, oacd_lookup
+    return store.lads(), store.ladnm, store.ladcd, store.oacd
 
 
 def augment(x, lookup):
@@ -72,22 +78,410 @@ def augment(x, lookup):
         return
 
 
+def compact_codes(df, columns):
+    """Store code columns with the smallest integer type that holds them.
+
+    Vectorized replacement of `df[columns].applymap(np.int64)` (in place):
+    float codes are truncated and missing codes raise an error, as before,
+    but each column is then downcast (e.g. to `int8`).
+
+    :param df: The input dataframe.
+    :type df: pandas.DataFrame
+    :param columns: code columns
+    :type columns: list
+    """
+    for column in columns:
+        df[column] = pd.to_numeric(df[column].astype(np.int64), downcast="integer")
+
+
+def downcast_integers(df) -> pd.DataFrame:
+    """Downcast the integer columns to the smallest integer type (in place).
+
+    :param df: The input dataframe.
+    :type df: pandas.DataFrame
+    :return: the same dataframe
+    :rtype: pandas.DataFrame
+    """
+    for column in df.select_dtypes("integer").columns:
+        df[column] = pd.to_numeric(df[column], downcast="integer")
+    return df
+
+
+def concat_categorical(dfs) -> pd.DataFrame:
+    """Concatenate dataframes keeping their categorical columns categorical.
+
+    `pandas.concat` turns categorical columns with different categories into
+    object columns, so the categories of each column are unified first.
+
+    :param dfs: dataframes with the same columns
+    :type dfs: list
+    :return: concatenated dataframe
+    :rtype: pandas.DataFrame
+    """
+    if len(dfs) > 1:
+        for column in dfs[0].select_dtypes("category").columns:
+            categories = set().union(*(df[column].cat.categories for df in dfs))
+            dtype = pd.CategoricalDtype(sorted(categories))
+            for df in dfs:
+                df[column] = df[column].astype(dtype)
+    return pd.concat(dfs)
+
+
+class CategoricalLookup:
+    """Vectorized version of a dictionary lookup.
+
+    The dictionary keys are compiled into a hash table (`pandas.Index`) and
+    the values into an array, so a whole column is translated by a single
+    `get_indexer` call instead of one `augment` call per row. As with
+    `augment`, missing keys and `null` values give an empty value.
+    """
+
+    def __init__(self, lookup, keys=None) -> None:
+        """Initialise a CategoricalLookup class.
+
+        :param lookup: dictionary
+        :type lookup: dict
+        :param keys: Compiled keys, used to share the hash table between
+            lookups with the same keys, defaults to None.
+        :type keys: pandas.Index, optional
+        """
+        if keys is None:
+            keys = pd.Index([key for key, value in lookup.items() if value is not None])
+        self.keys = keys
+        self.values = pd.Series([lookup.get(key) for key in keys]).to_numpy()
+
+    def with_values(self, lookup):
+        """Return a lookup with the same keys (and hash table) but other values.
+
+        :param lookup: dictionary with the same keys
+        :type lookup: dict
+        :return: the new lookup
+        :rtype: CategoricalLookup
+        """
+        return CategoricalLookup(lookup, keys=self.keys)
+
+    def get_indexer(self, values) -> np.ndarray:
+        """Return the position of each value in the lookup keys (-1 if missing).
+
+        :param values: dictionary keys
+        :type values: array-like
+        :return: positions
+        :rtype: numpy.ndarray
+        """
+        if isinstance(getattr(values, "dtype", None), pd.CategoricalDtype):
+            # search the categories only (missing values, code -1, take -1)
+            values = pd.Series(values)
+            indexer = self.keys.get_indexer(values.cat.categories)
+            return np.append(indexer, -1).take(values.cat.codes.to_numpy())
+        return self.keys.get_indexer(values)
+
+    def take(self, indexer) -> np.ndarray:
+        """Return the lookup values at the given positions.
+
+        :param indexer: positions (-1 for missing values)
+        :type indexer: numpy.ndarray
+        :return: dictionary values (`NaN`/`None` for missing values)
+        :rtype: numpy.ndarray
+        """
+        values = self.values.take(indexer)
+        missing = indexer < 0
+        if missing.any():
+            if values.dtype.kind in "biu":
+                values = values.astype(float)
+            values[missing] = np.nan if values.dtype.kind == "f" else None
+
+        return values
+
+    def map(self, values) -> np.ndarray:
+        """Translate the values using the lookup.
+
+        :param values: dictionary keys
+        :type values: array-like
+        :return: dictionary values (`NaN`/`None` for missing keys)
+        :rtype: numpy.ndarray
+        """
+        return self.take(self.get_indexer(values))
+
+
+class BandLookup:
+    """Vectorized version of a numerical (band) lookup.
+
+    The bands are compiled into sorted edge arrays and each value finds its
+    band by binary search, instead of one boolean mask pass per band.
+    Values outside all bands are kept, as in `Epc.set_numerical_code`.
+    """
+
+    def __init__(self, lookup) -> None:
+        """Initialise a BandLookup class.
+
+        :param lookup: [[code, minimum (not included), maximum (included)], ...]
+        :type lookup: list
+        """
+        bands = sorted(lookup, key=lambda band: band[2])
+        self.codes = np.array([band[0] for band in bands], dtype=float)
+        self.lower = np.array([band[1] for band in bands], dtype=float)
+        self.upper = np.array([band[2] for band in bands], dtype=float)
+
+    def map(self, values) -> np.ndarray:
+        """Translate the values into band codes.
+
+        :param values: numerical values
+        :type values: array-like
+        :return: band codes (original value if outside all bands)
+        :rtype: numpy.ndarray
+        """
+        values = np.asarray(values, dtype=float)
+
+        # first band whose maximum is not below the value
+        position = np.searchsorted(self.upper, values, side="left")
+        inside = position < len(self.upper)
+        position[~inside] = 0
+        inside &= values > self.lower[position]
+
+        return np.where(inside, self.codes[position], values)
+
+
+class AreaLookup:
+    """Geographic lookups applied to whole columns.
+
+    Postcodes are translated into Output Area ids, and the Output Area ids
+    into Local Authority names and codes through the arrays of a
+    `GeoLookupStore`, so each distinct value is searched only once.
+    """
+
+    def __init__(self, ladnm_lookup, ladcd_lookup, oacd_lookup=None) -> None:
+        """Initialise an AreaLookup class.
+
+        :param ladnm_lookup: lookup from  Output Area to Local Authority name
+        :type ladnm_lookup: dict or geography.StoreLookup
+        :param ladcd_lookup: lookup from  Output Area to Local Authority code
+        :type ladcd_lookup: dict or geography.StoreLookup
+        :param oacd_lookup: lookup from postcode to Output Area (only needed
+            for `apply_postcode`), defaults to None.
+        :type oacd_lookup: dict or geography.StoreLookup, optional
+        """
+        self.store = GeoLookupStore.from_lookups(
+            ladnm_lookup, ladcd_lookup, oacd_lookup
+        )
+
+    def apply_postcode(self, df) -> dict:
+        """Replace "POSTCODE" by "OA" and add "LADNM" and "LADCD" columns.
+
+        Rows with an unknown postcode are removed (in place).
+
+        :param df: EPC data with a "POSTCODE" column.
+        :type df: pandas.DataFrame
+        :return: number of rows discarded by the lookup
+        :rtype: dict
+        """
+        position = self.store.postcode_positions(df["POSTCODE"])
+
+        df["POSTCODE"] = self.store.categorical(position, "oa")
+        df.rename({"POSTCODE": "OA"}, axis=1, inplace=True)
+        df["LADNM"] = self.store.categorical(position, "ladnm")
+        df["LADCD"] = self.store.categorical(position, "ladcd")
+        df.dropna(subset=["OA"], inplace=True)
+
+        return {"postcode": int((position < 0).sum())}
+
+    def apply_oa(self, df):
+        """Add "LADNM" and "LADCD" columns using the "OA" column.
+
+        The "OA" column becomes categorical (unknown Output Areas, which do
+        not belong to any Local Authority, become empty).
+
+        :param df: data with an "OA" column.
+        :type df: pandas.DataFrame
+        """
+        position = self.store.oa_positions(df["OA"])
+        df["OA"] = self.store.categorical(position, "oa")
+        df["LADNM"] = self.store.categorical(position, "ladnm")
+        df["LADCD"] = self.store.categorical(position, "ladcd")
+
+
+class LadPartition:
+    """Row offsets of each Local Authority in a dataframe sorted by LADCD.
+
+    The dataframe is sorted once (stable sort, so each Local Authority keeps
+    its row order), and each Local Authority is then a contiguous slice
+    instead of a boolean filter over the whole country.
+    """
+
+    def __init__(self, lad_codes) -> None:
+        """Initialise a LadPartition class.
+
+        :param lad_codes: Local Authority code of each row (rows without code
+            are placed at the end and do not belong to any slice).
+        :type lad_codes: pandas.Series
+        """
+        codes, uniques = pd.factorize(lad_codes)
+        codes[codes < 0] = len(uniques)
+        self.order = np.argsort(codes, kind="stable")
+
+        stops = np.cumsum(np.bincount(codes, minlength=len(uniques) + 1))
+        starts = stops - np.bincount(codes, minlength=len(uniques) + 1)
+        self.slices = {
+            lad_code: slice(start, stop)
+            for lad_code, start, stop in zip(uniques, starts, stops)
+        }
+
+    @classmethod
+    def sort(cls, df):
+        """Sort a dataframe by Local Authority and return its partition.
+
+        No copy is made if the dataframe is already sorted (e.g. when it is
+        read from the cache).
+
+        :param df: dataframe with a "LADCD" column
+        :type df: pandas.DataFrame
+        :return: sorted dataframe and its partition
+        :rtype: pandas.DataFrame, LadPartition
+        """
+        partition = cls(df["LADCD"])
+        if (np.diff(partition.order) < 0).any():
+            df = df.take(partition.order).reset_index(drop=True)
+            partition.order = np.arange(len(df))
+
+        return df, partition
+
+    def get(self, df, lad_code) -> pd.DataFrame:
+        """Return the rows of a Local Authority (a view of the sorted rows).
+
+        :param df: dataframe returned by `sort`
+        :type df: pandas.DataFrame
+        :param lad_code: Local authority district code.
+        :type lad_code: string
+        :return: Local Authority rows (empty if unknown)
+        :rtype: pandas.DataFrame
+        """
+        return df.iloc[self.slices.get(lad_code, slice(0, 0))]
+
+
+class LookupPlan:
+    """Compiled version of the EPC lookups in "config/lookups.yaml".
+
+    All the EPC recoding (tenure, accommodation type, construction age, gas
+    and floor area) is applied with vectorized lookups, and the rows
+    discarded by each lookup are counted.
+    """
+
+    def __init__(self, parsed_lookup) -> None:
+        """Initialise a LookupPlan class.
+
+        :param parsed_lookup: parsed "config/lookups.yaml" file
+        :type parsed_lookup: dict
+        """
+        self.tenure = CategoricalLookup(parsed_lookup.get("tenure"))
+        self.accommodation = CategoricalLookup(parsed_lookup.get("accommodation"))
+        self.age_categorical = CategoricalLookup(parsed_lookup.get("age_categorical"))
+        self.age_numerical = BandLookup(parsed_lookup.get("age_numerical"))
+        self.gas = CategoricalLookup(parsed_lookup.get("gas"))
+        self.floor_area = BandLookup(parsed_lookup.get("floor_area"))
+        self.area_max_lim = parsed_lookup.get("floor_area")[-1][2]
+
+    def apply(self, df) -> dict:
+        """Recode the EPC variables in a single pass (in place).
+
+        See `Epc.set_lookups`. Every lookup is applied to the complete
+        dataframe, and the rows with any empty code are removed at the end.
+
+        :param df: Dataframe with EPC information.
+        :type df: pandas.Dataframe
+        :return: number of rows discarded by each lookup
+        :rtype: dict
+        """
+        misses = {}
+
+        # Tenure
+        df["TENURE"] = self.tenure.map(df["TENURE"])
+        misses["tenure"] = int(df["TENURE"].isna().sum())
+
+        # Accommodation type
+        df["LC4402_C_TYPACCOM"] = self.accommodation.map(
+            df["PROPERTY_TYPE"].astype(object) + ": " + df["BUILT_FORM"].astype(object)
+        )
+        misses["accommodation"] = int(df["LC4402_C_TYPACCOM"].isna().sum())
+        df.pop("PROPERTY_TYPE")
+        df.pop("BUILT_FORM")
+
+        # Construction age band
+        age = self.age_categorical.map(df["CONSTRUCTION_AGE_BAND"])
+        df["CONSTRUCTION_AGE_BAND"] = self.age_numerical.map(age)
+        misses["age"] = int(df["CONSTRUCTION_AGE_BAND"].isna().sum())
+
+        # Main gas flag
+        df["MAINS_GAS_FLAG"] = self.gas.map(df["MAINS_GAS_FLAG"])
+        misses["gas"] = int(df["MAINS_GAS_FLAG"].isna().sum())
+
+        # Floor Area (areas above the last band are discarded)
+        area = df["TOTAL_FLOOR_AREA"].to_numpy(dtype=float)
+        area = np.where(area > self.area_max_lim, np.nan, area)
+        df["TOTAL_FLOOR_AREA"] = self.floor_area.map(area)
+        misses["floor_area"] = int(df["TOTAL_FLOOR_AREA"].isna().sum())
+
+        df.rename(
+            {
+                "TENURE": "tenure",
+                "CONSTRUCTION_AGE_BAND": "ACCOM_AGE",
+                "MAINS_GAS_FLAG": "GAS",
+                "TOTAL_FLOOR_AREA": "FLOOR_AREA",
+            },
+            axis=1,
+            inplace=True,
+        )
+        df.dropna(
+            subset=["tenure", "LC4402_C_TYPACCOM", "ACCOM_AGE", "GAS", "FLOOR_AREA"],
+            inplace=True,
+        )
+
+        return misses
+
+
 class Epc:
     """Class to represent the EPC data and related parameters/methods."""
 
-    def __init__(self, oacd_lookup, ladnm_lookup, ladcd_lookup) -> None:
-        """Initialise an EPC class."""
+    # Format of the "LODGEMENT_DATETIME" column
+    DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+    # EPC columns with a few distinct values, read as categorical columns
+    CATEGORICAL_HEADERS = [
+        "PROPERTY_TYPE",
+        "BUILT_FORM",
+        "CONSTRUCTION_AGE_BAND",
+        "TENURE",
+        "MAINS_GAS_FLAG",
+    ]
+
+    def __init__(
+        self, oacd_lookup, ladnm_lookup, ladcd_lookup, stream=False, use_cache=True
+    ) -> None:
+        """Initialise an EPC class.
+
+        :param oacd_lookup: lookup from postcode to Output Area
+        :type oacd_lookup: dict
+        :param ladnm_lookup: lookup from  Output Area to Local Authority name
+        :type ladnm_lookup: dict
+        :param ladcd_lookup: lookup from  Output Area to Local Authority code
+        :type ladcd_lookup: dict
+        :param stream: If True, the national EPC dataframe is not loaded and
+            the certificates must be read one Local Authority at a time with
+            `iter_lad_dataframes`, defaults to False.
+        :type stream: bool, optional
+        :param use_cache: If True, the parsed EPC dataframe is read from (or
+            stored in) the data cache, defaults to True.
+        :type use_cache: bool, optional
+        """
 
         # Configure epc api related parameters from "config/config.yaml"
-        epc_yaml = open("config/config.yaml")
-        parsed_epc = yaml.load(epc_yaml, Loader=yaml.FullLoader)
+        parsed_epc = load_config()
         self.path = parsed_epc.get("epc_path")
         self.desired_headers = parsed_epc.get("epc_headers")
+        self.cache = DataCache(parsed_epc.get("cache_dir", "data/cache/"))
 
         # Configure lookups
         ## Lookups from "config/lookups.yaml" file
-        lookup_yaml = open("config/lookups.yaml")
-        parsed_lookup = yaml.load(lookup_yaml, Loader=yaml.FullLoader)
+        parsed_lookup = load_lookups()
+        self.area_path = parsed_lookup.get("area_path")
         self.accommodation_lookup = parsed_lookup.get("accommodation")
         self.age_categorical_lookup = parsed_lookup.get("age_categorical")
         self.age_numerical_lookup = parsed_lookup.get("age_numerical")
@@ -95,11 +489,63 @@ class Epc:
         self.gas_lookup = parsed_lookup.get("gas")
         self.tenure_lookup = parsed_lookup.get("tenure")
 
-        # Get EPC data as DataFrame
-        self.df = self.get_epc_dataframe()
+        ## Compiled (vectorized) version of the lookups
+        self.plan = LookupPlan(parsed_lookup)
+        self.area = AreaLookup(ladnm_lookup, ladcd_lookup, oacd_lookup)
+
+        # Number of rows discarded by each lookup
+        self.lookup_misses = Counter()
+
+        # Number of certificate files read (and reused from the cache)
+        self.files_read = 0
+        self.files_reused = 0
+
+        # Geographic lookups, also used to route the streamed certificates
+        self.oacd_lookup = oacd_lookup
+        self.ladnm_lookup = ladnm_lookup
+        self.ladcd_lookup = ladcd_lookup
+
+        # Streaming mode: certificates are read per Local Authority later
+        if stream:
+            self.df = None
+            return
+
+        # Get EPC data as DataFrame with the LADNM, LADCD and OA columns,
+        # without duplicate certificates and sorted by Local Authority (see
+        # `get_lad_dataframe`), from the cache when the inputs did not change
+        def build():
+            # Only the new or changed certificate files are read (see
+            # `get_certificates`)
+            self.df = self.get_certificates(use_cache and self.cache.enabled)
+            self.df.pop("FILE")
+            # Latest certificate of each building in the whole country
+            self.df = self.remove_duplicates(self.df)
+            self.df, self.partition = LadPartition.sort(self.df)
+            return self.df, {"lookup_misses": dict(self.lookup_misses)}
+
+        if not (use_cache and self.cache.enabled):
+            build()
+            return
+
+        key = cache_key(
+            zip_fingerprint(self.path),
+            self.desired_headers,
+            zip_fingerprint(self.area_path),
+        )
+        self.df, metadata = self.cache.load_or_build("epc", key, build)
+        self.df, self.partition = LadPartition.sort(self.df)
+        self.lookup_misses = Counter(metadata["lookup_misses"])
+
+    def get_lad_dataframe(self, lad_code) -> pd.DataFrame:
+        """Return the EPC data of a Local Authority.
 
-        # Set LADNM, LADCD and OA columns
-        self.set_geo_lookups(oacd_lookup, ladnm_lookup, ladcd_lookup)
+        :param lad_code: Local authority district code.
+        :type lad_code: string
+        :return: EPC data of the Local Authority (a contiguous slice of the
+            national dataframe).
+        :rtype: pandas.DataFrame
+        """
+        return self.partition.get(self.df, lad_code)
 
     def get_epc_dataframe(self) -> pd.DataFrame:
         """Get EPC data for all available England Local Authorities.
@@ -123,8 +569,122 @@ class Epc:
         :return: A data frame with all England EPC collected data.
         :rtype: pandas.DataFrame
         """
-        epc_zip_file = zipfile.ZipFile(self.path)  # .zip file location
+        reader = ZipCsvReader(self.path)  # .zip file location
+        files = self.get_certificate_files(reader.zip_file)
+
+        # Create a dataframe for every England certificate file (read in
+        # parallel)
+        dfs = list(reader.map(lambda file: self.read_certificates(reader, file), files))
+
+        # Return a unique EPC dataframe
+        return concat_categorical(dfs)
+
+    def get_certificates(self, use_cache=True) -> pd.DataFrame:
+        """Return the England certificates with the geographic information.
+
+        Incremental ingest: the certificates (before the de-duplication) are
+        cached with the CRC-32 and size of their certificate file, in a
+        "FILE" column. With a new release of the EPC zip file, only the new
+        or changed certificate files are read; the certificates of the
+        unchanged files are reused and those of the removed files dropped.
+        The rows are in the zip order, as if the whole zip file was read.
+
+        :param use_cache: If True, the certificates are read from (and
+            stored in) the data cache, defaults to True.
+        :type use_cache: bool, optional
+        :return: certificates with the "OA", "LADNM", "LADCD" and "FILE"
+            columns (certificates with an unknown postcode are removed).
+        :rtype: pandas.DataFrame
+        """
+        reader = ZipCsvReader(self.path)
+        files = self.get_certificate_files(reader.zip_file)
+        infos = {info.filename: info for info in reader.zip_file.infolist()}
+        members = {file: [infos[file].CRC, infos[file].file_size] for file in files}
+
+        key = cache_key(self.desired_headers, zip_fingerprint(self.area_path))
+        cached, metadata = None, None
+        if use_cache:
+            cached, metadata = self.cache.load("certificates", key)
+
+        parts, misses = [], {}
+        if cached is not None:
+            unchanged = [
+                file for file in files if metadata["files"].get(file) == members[file]
+            ]
+            parts.append(cached.take(np.flatnonzero(cached["FILE"].isin(unchanged))))
+            misses = {file: metadata["postcode_misses"][file] for file in unchanged}
+            self.files_reused = len(unchanged)
+
+        new_files = [file for file in files if file not in misses]
+        new_dfs = reader.map(
+            lambda file: self.read_certificates(reader, file), new_files
+        )
+        for file, df in zip(new_files, new_dfs):
+            misses[file] = self.area.apply_postcode(df)["postcode"]
+            df["FILE"] = pd.Categorical.from_codes(
+                np.zeros(len(df), dtype=np.int8), categories=[file]
+            )
+            parts.append(df)
+            self.files_read += 1
+
+        df = concat_categorical(parts)
+        del parts, cached
+        df["FILE"] = df["FILE"].cat.remove_unused_categories()
+
+        # zip order (each file keeps its row order)
+        position = pd.Index(files).get_indexer(df["FILE"])
+        if (np.diff(position) < 0).any():
+            df = df.iloc[np.argsort(position, kind="stable")]
+        df.reset_index(drop=True, inplace=True)
+
+        self.lookup_misses.update({"postcode": sum(misses.values())})
+        if use_cache and members != (metadata or {}).get("files"):
+            self.cache.save(
+                "certificates",
+                key,
+                df,
+                {"files": members, "postcode_misses": misses},
+            )
+
+        return df
+
+    def read_certificates(self, reader, file) -> pd.DataFrame:
+        """Read the desired columns of a `certificates.csv` file.
+
+        The EPC categories (see `CATEGORICAL_HEADERS`) are read as categorical
+        columns, the integer columns are downcast and the lodgement dates are
+        parsed (see `parse_dates`). The types of the dates and building
+        references are not inferred, so that both CSV parsers (see
+        `zip_reader.ZipCsvReader`) return the same dataframe.
+
+        :param reader: EPC zipped dataset.
+        :type reader: zip_reader.ZipCsvReader
+        :param file: name/path of the certificate file
+        :type file: string
+        :return: certificates
+        :rtype: pandas.DataFrame
+        """
+        dtype = {header: "category" for header in self.CATEGORICAL_HEADERS}
+        dtype.update(POSTCODE="category", TOTAL_FLOOR_AREA=float)
+        # float: the building reference number can be empty
+        dtype.update(LODGEMENT_DATETIME=str, BUILDING_REFERENCE_NUMBER=float)
+        df = reader.read(file, self.desired_headers, dtype)
+        if "LODGEMENT_DATETIME" in df:
+            df["LODGEMENT_DATETIME"] = self.parse_dates(df["LODGEMENT_DATETIME"])
+        return downcast_integers(df)
+
+    @staticmethod
+    def get_certificate_files(epc_zip_file) -> list:
+        """Return the England `certificates.csv` files of the EPC zip.
 
+        The list also includes the unknown local authority certificates, i.e.
+        folders whose LAD code starts with "_".
+
+        :param epc_zip_file: EPC zipped dataset.
+        :type epc_zip_file: zipfile.ZipFile
+        :return: name/path of the certificate files, in the zip order.
+        :rtype: list
+        """
         # Get the name/path of all available `certificate` files
         files = [
             text_file.filename
@@ -140,16 +700,82 @@ class Epc:
             if folder.split("-")[1][0] == "E" or folder.split("-")[1][0] == "_"
         ]
 
-        # Create a dataframe for every England certificate file
-        dfs = [
-            pd.read_csv(
-                epc_zip_file.open(file), usecols=self.desired_headers, low_memory=False
-            )
-            for file in files
-        ]
+        return files
 
-        # Return a unique EPC dataframe
-        return pd.concat(dfs)
+    def get_lad_codes(self, postcodes) -> pd.Series:
+        """Return the Local Authority code of each postcode.
+
+        :param postcodes: EPC postcodes.
+        :type postcodes: pandas.Series
+        :return: Local Authority codes (`NaN` when the postcode is unknown or
+            outside England).
+        :rtype: pandas.Series
+        """
+        position = self.area.store.postcode_positions(postcodes)
+        return pd.Series(self.area.store.take_ladcd(position), index=postcodes.index)
+
+    def iter_lad_dataframes(self):
+        """Yield the EPC data one Local Authority at a time.
+
+        Streaming alternative to `get_epc_dataframe` + `set_geo_lookups`: the
+        memory used scales with the largest Local Authority instead of with
+        the whole country.
+
+        Certificates are routed to a Local Authority by postcode, as in the
+        national dataframe, so a certificate folder can feed more than one
+        Local Authority (e.g. unknown local authority certificates or
+        merged Local Authorities). For this reason the certificates are read
+        in two passes:
+
+        1. Only the postcodes are read, to find the last certificate folder
+           that feeds each Local Authority.
+        2. The complete certificate folders are read (unknown local authority
+           folders first) and each Local Authority is yielded as soon as its
+           last folder has been read.
+
+        Each Local Authority keeps the row order of `get_epc_dataframe`.
+
+        :return: For each Local Authority, the LAD code and the EPC data with
+            the "OA", "LADNM" and "LADCD" columns.
+        :rtype: generator
+        """
+        reader = ZipCsvReader(self.path)
+        files = self.get_certificate_files(reader.zip_file)
+
+        # Unknown local authority folders first: their certificates are spread
+        # over many Local Authorities.
+        order = sorted(
+            range(len(files)), key=lambda i: files[i].split("-")[1][0] != "_"
+        )
+
+        # First pass: last folder (in reading order) of each Local Authority
+        last_folder = {}
+        postcodes = reader.map(
+            lambda i: reader.read(files[i], ["POSTCODE"], {"POSTCODE": "category"})
+            .POSTCODE.drop_duplicates(),
+            order,
+        )
+        for position, postcodes in enumerate(postcodes):
+            for lad_code in self.get_lad_codes(postcodes).dropna().unique():
+                last_folder[lad_code] = position
+
+        lads_per_folder = defaultdict(list)
+        for lad_code, position in last_folder.items():
+            lads_per_folder[position].append(lad_code)
+
+        # Second pass: read and route the complete certificates
+        pending = defaultdict(list)
+        dfs = reader.map(lambda i: self.read_certificates(reader, files[i]), order)
+        for position, (i, df) in enumerate(zip(order, dfs)):
+            self.lookup_misses.update(self.area.apply_postcode(df))
+            for lad_code, lad_df in df.groupby("LADCD", sort=False, observed=True):
+                pending[lad_code].append((i, lad_df))
+            del df
+
+            for lad_code in lads_per_folder[position]:
+                # restore the zip order of the folders
+                parts = sorted(pending.pop(lad_code), key=lambda part: part[0])
+                yield lad_code, concat_categorical([part[1] for part in parts])
 
     def set_geo_lookups(self, oacd_lookup, ladnm_lookup, ladcd_lookup):
         """Add geographic information using postcode.
@@ -165,16 +791,13 @@ class Epc:
         :param ladcd_lookup: lookup from  Output Area to Local Authority code
         :type ladcd_lookup: dict
         """
-        # Area: change area from postcode to output area
-        self.set_categorical_code(self.df, "POSTCODE", oacd_lookup, rename="OA")
-
-        # Create new column: Local authority name
-        self.df["LADNM"] = self.df["OA"].apply(func=lambda x: augment(x, ladnm_lookup))
-
-        # Create new column: Local authority code
-        self.df["LADCD"] = self.df["OA"].apply(func=lambda x: augment(x, ladcd_lookup))
+        # The lookups given to `__init__` are already compiled
+        if oacd_lookup is not self.oacd_lookup:
+            self.area = AreaLookup(ladnm_lookup, ladcd_lookup, oacd_lookup)
+        self.lookup_misses.update(self.area.apply_postcode(self.df))
 
     @staticmethod
+    @instrumented("remove_duplicates")
     def remove_duplicates(df) -> pd.DataFrame:
         """Remove EPC Duplicate Certificates
 
@@ -187,22 +810,56 @@ class Epc:
         This function removing duplicates with the same BUILDING REFERENCE
         NUMBER by selecting the most recent record and discarding others.
 
+        It is applied once to the whole country when the EPC data is loaded
+        (so duplicates whose postcodes are in different Local Authorities
+        are also removed), or to each Local Authority when the certificates
+        are streamed. A single stable sort by building and lodgement date is
+        used: certificates lodged at the same time keep the last one in the
+        file order, and certificates without date are sorted after the dated
+        ones (as with `pandas.DataFrame.sort_values`), so they are kept. The
+        rows keep their original order.
+
         :param df: Raw EPC dataset.
         :type df: pandas.DataFrame
         :return: EPC dataset without duplicate Certificates.
         :rtype: pandas.DataFrame
         """
-        df["LODGEMENT_DATETIME"] = pd.to_datetime(df["LODGEMENT_DATETIME"])
-        df = df.sort_values(by=["BUILDING_REFERENCE_NUMBER", "LODGEMENT_DATETIME"])
-        df.drop_duplicates(
-            subset=["BUILDING_REFERENCE_NUMBER"], keep="last", inplace=True
-        )
-        df.sort_index(inplace=True)
-        df.reset_index(drop=True, inplace=True)
+        dates = Epc.parse_dates(df["LODGEMENT_DATETIME"])
+        dates = dates.to_numpy(dtype="datetime64[ns]")
+        # `NaT` (the smallest datetime64 integer) is sorted last
+        dates = np.where(np.isnat(dates), np.iinfo(np.int64).max, dates.view(np.int64))
+        buildings = pd.factorize(df["BUILDING_REFERENCE_NUMBER"])[0]
+
+        order = np.lexsort((dates, buildings))
+        last = np.ones(len(order), dtype=bool)
+        last[:-1] = buildings[order[1:]] != buildings[order[:-1]]
+        keep = np.sort(order[last])
+
         drop_list = ["BUILDING_REFERENCE_NUMBER", "LODGEMENT_DATETIME"]
-        df.drop(drop_list, axis=1, inplace=True)
+        columns = [column for column in df.columns if column not in drop_list]
+        df = df.iloc[keep, df.columns.get_indexer(columns)]
+        df.reset_index(drop=True, inplace=True)
         return df
 
+    @classmethod
+    def parse_dates(cls, values) -> pd.Series:
+        """Parse the lodgement dates with a fixed format.
+
+        Values that do not follow `DATE_FORMAT` fall back to the format
+        inference of `pandas.to_datetime` (unparseable values raise an error).
+
+        :param values: lodgement dates
+        :type values: pandas.Series
+        :return: lodgement dates
+        :rtype: pandas.Series
+        """
+        if pd.api.types.is_datetime64_any_dtype(values):
+            return values
+        try:
+            return pd.to_datetime(values, format=cls.DATE_FORMAT)
+        except ValueError:
+            return pd.to_datetime(values)
+
     @staticmethod
     def set_categorical_code(df, df_col, lookup, rename=False):
         """Apply the lookup to a categorical column.
@@ -224,7 +881,7 @@ class Epc:
         """
 
         # setting new values according the rename_dict
-        df[df_col] = df[df_col].apply(func=lambda x: augment(x, lookup))
+        df[df_col] = CategoricalLookup(lookup).map(df[df_col])
 
         # remove empty rows
         df.dropna(subset=[df_col], inplace=True)
@@ -257,8 +914,7 @@ class Epc:
             the current name), defaults to False.
         :type rename: bool, optional
         """
-        for band in lookup:
-            df.loc[(df[df_col] > band[1]) & (df[df_col] <= band[2]), df_col] = band[0]
+        df[df_col] = BandLookup(lookup).map(df[df_col])
 
         # remove out bound and empty rows
         df.dropna(subset=[df_col], inplace=True)
@@ -266,60 +922,45 @@ class Epc:
         if rename:
             df.rename({df_col: rename}, axis=1, inplace=True)
 
-    def set_lookups(self, df):
+    @instrumented("set_lookups")
+    def set_lookups(self, df) -> dict:
         """Update columns using the lookups dictionaries.
 
         Update the information related with `area`, `tenure`, `accommodation
         type`, `construction age band`, `main gas flag`, and `floor area`,
-        by using the lookup variables (`accommodation_lookup`,
-        `age_categorical_lookup`, `age_numerical_lookup`, `floor_area_lookup`,
-        `gas_lookup`, `tenure_lookup`, `area_lookup`) and the
-        `set_categorical_code` and `set_numerical_code` functions.
+        by using the compiled lookups (`plan`) built from the lookup variables
+        (`accommodation_lookup`, `age_categorical_lookup`,
+        `age_numerical_lookup`, `floor_area_lookup`, `gas_lookup`,
+        `tenure_lookup`):
+
+        - Tenure: change the tenure from EPC to SPENSER classification
+        - Accommodation type: combine "PROPERTY_TYPE" and "BUILT_FORM", change
+          it from EPC to SPENSER classification and discard the two columns
+        - Construction age band: convert the categorical values into absolute
+          ages and group the absolute ages into bands
+        - Main gas flag: change the values (N, Y) to numerical codes
+        - Floor Area: group the absolute area into bands (areas above the
+          last band are discarded)
+
+        Rows with any empty code are removed.
 
         :param df: Dataframe with EPC information.
         :type df: pandas.Dataframe
+        :return: number of rows discarded by each lookup
+        :rtype: dict
         """
+        misses = self.plan.apply(df)
+        self.lookup_misses.update(misses)
 
-        # Tenure: change the tenure from EPC to SPENSER classification
-        self.set_categorical_code(df, "TENURE", self.tenure_lookup, rename="tenure")
-
-        # Accommodation type:
-        # - create an EPC accommodation type by combining "PROPERTY_TYPE" and "BUILT_FORM"
-        # - change the accommodation type from EPC to SPENSER classification
-        # - discard "PROPERTY_TYPE" and "BUILT_FORM" columns
-        df["LC4402_C_TYPACCOM"] = df["PROPERTY_TYPE"] + ": " + df["BUILT_FORM"]
-        self.set_categorical_code(df, "LC4402_C_TYPACCOM", self.accommodation_lookup)
-        df.pop("PROPERTY_TYPE")
-        df.pop("BUILT_FORM")
-
-        # Construction age band:
-        # - initially is a combination of categorical and numeric values
-        # - convert all categorical values into absolute ages
-        # - groups the absolute build age into bands
-        self.set_categorical_code(
-            df,
-            "CONSTRUCTION_AGE_BAND",
-            self.age_categorical_lookup,
-            rename="ACCOM_AGE",
-        )
-        df["ACCOM_AGE"] = df["ACCOM_AGE"].apply(pd.to_numeric)
-        self.set_numerical_code(df, "ACCOM_AGE", self.age_numerical_lookup)
-
-        # Main gas flag: change the values (N, Y) to numerical codes
-        self.set_categorical_code(df, "MAINS_GAS_FLAG", self.gas_lookup, rename="GAS")
-
-        # Floor Area: groups the absolute area into bands
-        area_max_lim = self.floor_area_lookup[-1][2]
-        df.rename({"TOTAL_FLOOR_AREA": "FLOOR_AREA"}, axis=1, inplace=True)
-        df.drop(df[df.FLOOR_AREA > area_max_lim].index, inplace=True)
-        self.set_numerical_code(df, "FLOOR_AREA", self.floor_area_lookup)
+        return misses
 
     def step(self, df) -> pd.DataFrame:
         """EPC data preparation main step.
 
         This function return a processed EPC dataset by:
 
-        1. Removing EPC Duplicate Certificates
+        1. Removing EPC Duplicate Certificates (only for streamed
+           certificates: the national data is de-duplicated when loaded)
         2. Performing variables re-categorisation
 
         :param df: EPC DataFrame per Local Authority
@@ -328,14 +969,15 @@ class Epc:
         :rtype: pandas.DataFrame
         """
 
-        df = self.remove_duplicates(df)
+        if "BUILDING_REFERENCE_NUMBER" in df:
+            df = self.remove_duplicates(df)
 
         # Apply all lookups
         self.set_lookups(df)
 
-        # Change selected columns to integer values
+        # Change selected columns to (compact) integer values
         cols = ["FLOOR_AREA", "ACCOM_AGE", "GAS", "tenure", "LC4402_C_TYPACCOM"]
-        df[cols] = df[cols].applymap(np.int64)
+        compact_codes(df, cols)
 
         return df
 
@@ -343,25 +985,37 @@ class Epc:
 class Spenser:
     """Class to represent the SPENSER data and related parameters/methods."""
 
-    def __init__(self, ladnm_lookup, ladcd_lookup) -> None:
-        """Initialise a Spenser class."""
+    def __init__(
+        self, ladnm_lookup, ladcd_lookup, use_cache=True, load=True, lad_codes=None
+    ) -> None:
+        """Initialise a Spenser class.
+
+        :param ladnm_lookup: lookup from  Output Area to Local Authority name
+        :type ladnm_lookup: dict
+        :param ladcd_lookup: lookup from  Output Area to Local Authority code
+        :type ladcd_lookup: dict
+        :param use_cache: If True, the parsed SPENSER dataframe is read from
+            (or stored in) the data cache, defaults to True.
+        :type use_cache: bool, optional
+        :param load: If False, the national SPENSER dataframe is not loaded
+            (the households files are read with `prepare` later, see
+            `api.LadLoader`), defaults to True.
+        :type load: bool, optional
+        :param lad_codes: If given, only the households of these Local
+            Authorities are loaded, reading only their Household files (see
+            `get_household_lads`); the data cache is not used. Defaults to
+            None (all Local Authorities).
+        :type lad_codes: list, optional
+        """
         # Configure SPENSER related parameters from "config/config.yaml"
-        spenser_yaml = open("config/config.yaml")
-        parsed_spenser = yaml.load(spenser_yaml, Loader=yaml.FullLoader)
+        parsed_spenser = load_config()
         self.path = parsed_spenser.get("spenser_path")
-        drop_list = parsed_spenser.get("drop_list")
-
-        # Create SPENSER dataframe
-        self.df = self.get_spenser_dataframe()
-
-        # Set Local Autority code and name columns
-        self.set_geo_lookups(ladnm_lookup, ladcd_lookup)
-
-        # Drop unnecessary columns
-        self.df.drop(drop_list, axis=1, inplace=True)
+        self.drop_list = parsed_spenser.get("drop_list")
+        self.cache = DataCache(parsed_spenser.get("cache_dir", "data/cache/"))
+        self.area = AreaLookup(ladnm_lookup, ladcd_lookup)
 
         # Sort Columns: aesthetic purpose only
-        column_sort = [
+        self.column_sort = [
             "HID",
             "LADNM",
             "LADCD",
@@ -377,27 +1031,151 @@ class Spenser:
             "LC4202_C_ETHHUK11",
             "LC4202_C_CARSNO",
         ]
-        self.df = self.df[column_sort]
 
-    def get_spenser_dataframe(self) -> pd.DataFrame:
-        """Get EPC data for all available local authorities.
+        # Households files are read on demand
+        if not load:
+            self.df = None
+            return
+
+        def build():
+            # Create SPENSER dataframe, with the Local Autority code and name
+            # columns and without the unnecessary columns
+            self.df = self.prepare(self.get_spenser_dataframe(lad_codes))
+            if lad_codes is not None:
+                self.df = self.df[self.df["LADCD"].isin(lad_codes)]
+                self.df = self.df.reset_index(drop=True)
+
+            # Sort rows by Local Authority (see `get_lad_dataframe`)
+            self.df, self.partition = LadPartition.sort(self.df)
+            return self.df, {}
+
+        # Read the dataframe from the cache when the inputs did not change
+        if not (use_cache and self.cache.enabled) or lad_codes is not None:
+            build()
+            return
+
+        area_path = load_lookups().get("area_path")
+        key = cache_key(
+            zip_fingerprint(self.path),
+            self.drop_list,
+            self.column_sort,
+            zip_fingerprint(area_path),
+        )
+        self.df, _ = self.cache.load_or_build("spenser", key, build)
+        self.df, self.partition = LadPartition.sort(self.df)
 
-        Note 1: You need a valid EPC zipped dataset
+    def get_lad_dataframe(self, lad_code) -> pd.DataFrame:
+        """Return the SPENSER data of a Local Authority.
 
-        :return: A data frame with all England EPC collected data.
+        :param lad_code: Local authority district code.
+        :type lad_code: string
+        :return: SPENSER data of the Local Authority (a contiguous slice of
+            the national dataframe).
         :rtype: pandas.DataFrame
         """
+        return self.partition.get(self.df, lad_code)
+
+    def get_spenser_dataframe(self, lad_codes=None) -> pd.DataFrame:
+        """Get SPENSER data for all available local authorities.
+
+        Note 1: You need a valid SPENSER zipped dataset
 
-        spenser_zip_file = zipfile.ZipFile(self.path)
-        # Create a dataframe for every Household SPENSER file
+        :param lad_codes: If given, only the Household files that may contain
+            these Local Authorities are read (see `get_household_lads`),
+            defaults to None.
+        :type lad_codes: list, optional
+        :return: A data frame with all England SPENSER households.
+        :rtype: pandas.DataFrame
+        """
+
+        reader = ZipCsvReader(self.path)
+        files = self.get_household_files(reader.zip_file)
+        if lad_codes is not None:
+            files = [
+                file
+                for file, lad_code in zip(files, self.get_household_lads(files))
+                if lad_code is None or lad_code in lad_codes
+            ]
+        # Create a dataframe for every Household SPENSER file (read in
+        # parallel, without the unnecessary columns)
+        dfs = reader.map(lambda file: self.read_households(reader, file), files)
+        # Return a unique SPENSER dataframe
+        return concat_categorical(list(dfs)).reset_index(drop=True)
+
+    def read_households(self, reader, file) -> pd.DataFrame:
+        """Read a Household file, without the `drop_list` columns.
+
+        The integer columns are downcast.
+
+        :param reader: SPENSER zipped dataset.
+        :type reader: zip_reader.ZipCsvReader
+        :param file: name/path of the Household file
+        :type file: string
+        :return: households
+        :rtype: pandas.DataFrame
+        """
+        df = reader.read(
+            file, lambda column: column not in self.drop_list, {"Area": "category"}
+        )
+        return downcast_integers(df)
+
+    @staticmethod
+    def get_household_files(spenser_zip_file) -> list:
+        """Return the Household files of the SPENSER zip.
+
+        :param spenser_zip_file: SPENSER zipped dataset.
+        :type spenser_zip_file: zipfile.ZipFile
+        :return: name/path of the Household files, in the zip order.
+        :rtype: list
+        """
         ## TIP: Household files finish with "_OA11_2020.csv"
-        dfs = [
-            pd.read_csv(spenser_zip_file.open(file))
+        return [
+            file
             for file in spenser_zip_file.namelist()
             if file.endswith("_OA11_2020.csv")
         ]
-        # Return a unique SPENSER dataframe
-        return pd.concat(dfs)
+
+    def get_household_lads(self, files) -> list:
+        """Return the Local Authority of each Household file, from its name.
+
+        The Household files are split by Local Authority and named by its
+        code (e.g. "ass_hh_E06000001_OA11_2020.csv"), so the files of a Local
+        Authority are found without reading them. Files whose name does not
+        hold a single known Local Authority code (e.g. a former Local
+        Authority) get None: their households may belong to any Local
+        Authority.
+
+        :param files: name/path of the Household files
+        :type files: list
+        :return: Local authority district code of each file (or None)
+        :rtype: list
+        """
+        known = set(self.area.store.lads())
+        pattern = re.compile(r"(?:^|_)([A-Z]\d{8})_OA11_2020\.csv$")
+        lad_codes = []
+        for file in files:
+            match = pattern.search(os.path.basename(file))
+            lad_code = match.group(1) if match else None
+            lad_codes.append(lad_code if lad_code in known else None)
+        return lad_codes
+
+    def prepare(self, df) -> pd.DataFrame:
+        """Add the geographic information and select the SPENSER columns.
+
+        1. Rename "Area" to "OA"
+        2. Create the "LADNM" and "LADCD" columns (see `AreaLookup.apply_oa`)
+        3. Drop the unnecessary columns (`drop_list`) and sort the columns
+
+        :param df: households data, e.g. from `get_spenser_dataframe`
+        :type df: pandas.DataFrame
+        :return: SPENSER data
+        :rtype: pandas.DataFrame
+        """
+        df.rename({"Area": "OA"}, axis=1, inplace=True)
+        self.area.apply_oa(df)
+        # (the Household files are read without them, see `read_households`)
+        df.drop(self.drop_list, axis=1, inplace=True, errors="ignore")
+        return df[self.column_sort]
 
     def set_geo_lookups(self, ladnm_lookup, ladcd_lookup):
         """Add geographic information using Output Area.
@@ -414,11 +1192,8 @@ class Spenser:
 
         self.df.rename({"Area": "OA"}, axis=1, inplace=True)
 
-        # Local authority name
-        self.df["LADNM"] = self.df["OA"].apply(func=lambda x: augment(x, ladnm_lookup))
-
-        # Local authority code
-        self.df["LADCD"] = self.df["OA"].apply(func=lambda x: augment(x, ladcd_lookup))
+        # Local authority name and code
+        AreaLookup(ladnm_lookup, ladcd_lookup).apply_oa(self.df)
 
     def set_new_tenure(self, df) -> pd.DataFrame:
         """Create new temporary tenure column
@@ -440,6 +1215,7 @@ class Spenser:
 
         return df
 
+    @instrumented("spenser_step")
     def step(self, df) -> pd.DataFrame:
         """SPENSER data preparation main step.
 
@@ -465,7 +1241,7 @@ class Spenser:
         # Create new tenure
         df = self.set_new_tenure(df)
 
-        # Change selected columns to integer values
+        # Change selected columns to (compact) integer values
         cols = [
             "LC4402_C_TYPACCOM",
             "LC4402_C_TENHUK11",
@@ -479,6 +1255,6 @@ class Spenser:
             "LC4202_C_CARSNO",
             "tenure",
         ]
-        df[cols] = df[cols].applymap(np.int64)
+        compact_codes(df, cols)
 
         return df
@@ -5,18 +5,22 @@ SHAPE: PSM step
 Created on Thursday August 25 2022
 @author: patricia-ternes
 """
-from random import choices
 import zipfile
-from causalinference import CausalModel
+import zlib
 import numpy as np
 import pandas as pd
-from sklearn.neighbors import NearestNeighbors
-import yaml
-import seaborn as sns
-import matplotlib.pyplot as plt
 import os
-import io
-from matplotlib.ticker import MaxNLocator
+
+try:
+    from .instrumentation import instrumented
+    from .propensity import get_estimator
+    from .settings import load_config
+    from .validation import ValidationHistograms
+except ImportError:
+    from instrumentation import instrumented
+    from propensity import get_estimator
+    from settings import load_config
+    from validation import ValidationHistograms
 
 
 class EnrichingPopulation:
@@ -29,12 +33,41 @@ class EnrichingPopulation:
     def __init__(self) -> None:
         """Initialise an EnrichingPopulation class."""
         # Configure PSM related parameters from "config/config.yaml"
-        psm_yaml = open("config/config.yaml")
-        parsed_psm = yaml.load(psm_yaml, Loader=yaml.FullLoader)
+        parsed_psm = load_config()
         self.n_neighbors = parsed_psm.get("n_neighbors")
+        self.n_realisations = parsed_psm.get("n_realisations", 1)
+        self.neighbors_backend = parsed_psm.get("neighbors_backend", "sorted")
+        self.match_cells = parsed_psm.get("match_cells", True)
         self.overlap_columns = parsed_psm.get("overlap_columns")
         self.matches_columns = parsed_psm.get("matches_columns")
 
+        # Propensity score estimator
+        self.estimator = get_estimator(
+            parsed_psm.get("propensity_estimator", "causalinference"),
+            parsed_psm.get("propensity_categorical"),
+        )
+
+        # Random number generation (`None` means a fresh, unpredictable seed)
+        self.seed = parsed_psm.get("seed")
+        self.rng = np.random.default_rng(self.seed)
+
+    def get_rng(self, lad_code) -> np.random.Generator:
+        """Return the random number generator of a Local Authority.
+
+        Each Local Authority gets an independent stream derived from the
+        configured seed and the LAD code, so results are repeatable whatever
+        the order (or the worker process) in which the Local Authorities run.
+
+        :param lad_code: Local authority district code.
+        :type lad_code: string
+        :return: random number generator
+        :rtype: numpy.random.Generator
+        """
+        seed_sequence = np.random.SeedSequence(
+            self.seed, spawn_key=(zlib.crc32(lad_code.encode()),)
+        )
+        return np.random.default_rng(seed_sequence)
+
     @staticmethod
     def set_treatment(df0, df1):
         """Create a "Treatment" column in each dataframe.
@@ -69,7 +102,8 @@ class EnrichingPopulation:
         return df
 
     @staticmethod
-    def get_propensity_score(df, overlap_columns):
+    @instrumented("get_propensity_score")
+    def get_propensity_score(df, overlap_columns, estimator=None):
         """Return the propensity score values.
 
         :param df: complete dataframe
@@ -77,30 +111,33 @@ class EnrichingPopulation:
         :param overlap_columns: list of columns names that are present in both
             datasets (EPC and SPENSER).
         :type overlap_columns: list
+        :param estimator: Propensity score estimator (see
+            `propensity.get_estimator`); if `None`, `causalinference` is used,
+            defaults to None.
+        :type estimator: object, optional
         :return: list of propensity score for all rows.
         :rtype: numpy.ndarray
         """
+        if estimator is None:
+            estimator = get_estimator("causalinference")
 
-        ## Isolate the Y, X and the covariates
-        Y = df["Treatment"].copy()  # 1-Dimension outcome - arbitrary values
-        X = df["Treatment"].copy()  # 1-Dimension treatment
-        C = df[overlap_columns].copy()  # n-Dimension covariates
+        return estimator.fit_predict(df, overlap_columns)
 
-        # Transform pandas dataframe into numpy.ndarray (CausalModel requisite)
-        Y = Y.values
-        X = X.values
-        C = C.values
+    @staticmethod
+    @instrumented("get_neighbors")
+    def get_neighbors(df1, df2, n_neighbors, backend="sorted"):
+        """For each SPENSER row get a list of EPC rows with the closest propensity score values.
 
-        # Create the Causal Model
-        model = CausalModel(Y, X, C)
+        Two backends are available:
 
-        # Propensity score calculation
-        model.est_propensity_s()
-        return model.propensity["fitted"]
+        - "sorted": `sorted_neighbors`, specialised in one-dimensional values.
+        - "sklearn": `sklearn_neighbors`, based on
+          `sklearn.neighbors.NearestNeighbors`.
 
-    @staticmethod
-    def get_neighbors(df1, df2, n_neighbors):
-        """For each SPENSER row get a list of EPC rows with the closest propensity score values.
+        Both return the same neighbors: the EPC rows sorted by distance and
+        then by row index, so the EPC rows tied at the distance of the last
+        neighbor (frequent, as propensity scores take one value per
+        covariate cell) are always the ones with the lowest indices.
 
         :param df1: SPENSER dataset
         :type df1: pandas.DataFrame
@@ -108,47 +145,293 @@ class EnrichingPopulation:
         :type df2: pandas.DataFrame
         :param n_neighbors: Number of neighbors.
         :type n_neighbors: integer
+        :param backend: "sorted" or "sklearn", defaults to "sorted".
+        :type backend: string, optional
         :return: The propensity score difference and the indices of the closest neighbors.
-        :rtype: list, list
+        :rtype: numpy.ndarray, numpy.ndarray
         """
-        # create the neighbors object (p=2 means Euclidean distance)
-        knn = NearestNeighbors(n_neighbors=n_neighbors, p=2).fit(df2[["ps"]])
+        if backend == "sorted":
+            search = EnrichingPopulation.sorted_neighbors
+        elif backend == "sklearn":
+            search = EnrichingPopulation.sklearn_neighbors
+        else:
+            raise ValueError(f"Unknown neighbors backend: {backend}")
+        return search(df1["ps"].to_numpy(), df2["ps"].to_numpy(), n_neighbors)
+
+    @staticmethod
+    def get_cell_neighbors(df1, df2, n_neighbors, backend="sorted"):
+        """For each SPENSER cell get the EPC rows with the closest propensity scores.
+
+        The propensity score only depends on the covariates, which are small
+        discrete codes, so the SPENSER rows fall in a few cells of equal
+        propensity score. The neighbors (candidate pool) of each cell are
+        searched once (see `get_neighbors`), instead of once per row.
+
+        :param df1: SPENSER dataset
+        :type df1: pandas.DataFrame
+        :param df2: EPC dataset
+        :type df2: pandas.DataFrame
+        :param n_neighbors: Number of neighbors.
+        :type n_neighbors: integer
+        :param backend: "sorted" or "sklearn", defaults to "sorted".
+        :type backend: string, optional
+        :return: The propensity score difference and the indices of the
+            closest neighbors of each cell, and the cell of each SPENSER row.
+        :rtype: numpy.ndarray, numpy.ndarray, numpy.ndarray
+        """
+        cell_ps, cells = np.unique(df1["ps"].to_numpy(), return_inverse=True)
+        distances, indices = EnrichingPopulation.get_neighbors(
+            pd.DataFrame({"ps": cell_ps}), df2, n_neighbors, backend
+        )
+        return distances, indices, cells.reshape(-1)
+
+    @staticmethod
+    def check_n_neighbors(n_neighbors, n_values):
+        """Raise the scikit-learn error when there are too few candidates.
+
+        :param n_neighbors: Number of neighbors.
+        :type n_neighbors: integer
+        :param n_values: Number of candidate values.
+        :type n_values: integer
+        :raises ValueError: `n_neighbors` greater than `n_values`
+        """
+        if n_neighbors > n_values:
+            raise ValueError(
+                f"Expected n_neighbors <= n_samples_fit, but n_neighbors = "
+                f"{n_neighbors}, n_samples_fit = {n_values}"
+            )
+
+    @staticmethod
+    def sorted_neighbors(query, values, n_neighbors, chunk_size=65536):
+        """Return the closest `values` of each `query` value (one dimension).
+
+        The values are sorted once. For each query value, the insertion
+        point is found by binary search, and the closest values are
+        collected by a two-pointer expansion around it, vectorized over all
+        query values. The neighbors are taken by distance and then by index:
+        equal values are visited in index order on both sides, and a smaller
+        and a larger value at the same distance are taken in index order.
+        Propensity scores take few distinct values, so the search runs once
+        per distinct query value.
+
+        :param query: Query values (SPENSER propensity scores).
+        :type query: numpy.ndarray
+        :param values: Candidate values (EPC propensity scores).
+        :type values: numpy.ndarray
+        :param n_neighbors: Number of neighbors.
+        :type n_neighbors: integer
+        :param chunk_size: Number of query values processed at once,
+            defaults to 65536.
+        :type chunk_size: int, optional
+        :return: For each query value, the distances to the closest values
+            (in increasing order) and their indices in `values`.
+        :rtype: numpy.ndarray, numpy.ndarray
+        """
+        query = np.asarray(query, dtype=float)
+        values = np.asarray(values, dtype=float)
+        n_values = len(values)
+        EnrichingPopulation.check_n_neighbors(n_neighbors, n_values)
+
+        # Equal values in increasing index order when walking to the right
+        # (larger values) and to the left (smaller values)
+        index = np.arange(n_values)
+        right_order = np.lexsort((index, values))
+        left_order = np.lexsort((-index, values))
+        # sentinels: the pointers never cross the array limits
+        sorted_values = np.concatenate([[-np.inf], values[right_order], [np.inf]])
+        right_index = np.concatenate([[n_values], right_order, [n_values]])
+        left_index = np.concatenate([[n_values], left_order, [n_values]])
+
+        unique_query, inverse = np.unique(query, return_inverse=True)
+        distances = np.empty((len(unique_query), n_neighbors))
+        indices = np.empty((len(unique_query), n_neighbors), dtype=np.int64)
+        for start in range(0, len(unique_query), chunk_size):
+            q = unique_query[start : start + chunk_size]
+
+            # pointers to the next smaller (left) and larger (right) values
+            right = np.searchsorted(sorted_values, q)
+            left = right - 1
+
+            distance = np.empty((n_neighbors, len(q)))
+            neighbor = np.empty((n_neighbors, len(q)), dtype=np.int64)
+            for j in range(n_neighbors):
+                left_distance = q - sorted_values[left]
+                right_distance = sorted_values[right] - q
+                take_left = (left_distance < right_distance) | (
+                    (left_distance == right_distance)
+                    & (left_index[left] < right_index[right])
+                )
+
+                distance[j] = np.where(take_left, left_distance, right_distance)
+                neighbor[j] = np.where(take_left, left_index[left], right_index[right])
+                left -= take_left
+                right += ~take_left
+
+            distances[start : start + chunk_size] = distance.T
+            indices[start : start + chunk_size] = neighbor.T
+
+        return distances[inverse], indices[inverse]
+
+    @staticmethod
+    def sklearn_neighbors(query, values, n_neighbors, margin=1e-6):
+        """Return the closest `values` of each `query` value, with scikit-learn.
+
+        Same neighbors as `sorted_neighbors` (by distance and then by index).
+        `sklearn.neighbors.NearestNeighbors` searches more neighbors than
+        needed for each distinct query value, and they are sorted by their
+        exact distance and index. While the next neighbor is within `margin`
+        of the last one (rounding of the scikit-learn distances included),
+        other values may be tied with the last neighbor, and the search is
+        repeated for these query values with twice as many neighbors.
+
+        :param query: Query values (SPENSER propensity scores).
+        :type query: numpy.ndarray
+        :param values: Candidate values (EPC propensity scores).
+        :type values: numpy.ndarray
+        :param n_neighbors: Number of neighbors.
+        :type n_neighbors: integer
+        :param margin: Distance below which two neighbors may be tied,
+            defaults to 1e-6.
+        :type margin: float, optional
+        :return: For each query value, the distances to the closest values
+            (in increasing order) and their indices in `values`.
+        :rtype: numpy.ndarray, numpy.ndarray
+        """
+        from sklearn.neighbors import NearestNeighbors
+
+        query = np.asarray(query, dtype=float)
+        values = np.asarray(values, dtype=float)
+        n_values = len(values)
+        EnrichingPopulation.check_n_neighbors(n_neighbors, n_values)
 
-        # for each household in df1 dataframe, find the nearest df2 neighbors
-        distances, indices = knn.kneighbors(df1[["ps"]])
-        return distances, indices
+        # create the neighbors object (p=2 means Euclidean distance)
+        knn = NearestNeighbors(p=2).fit(values.reshape(-1, 1))
+
+        unique_query, inverse = np.unique(query, return_inverse=True)
+        distances = np.empty((len(unique_query), n_neighbors))
+        indices = np.empty((len(unique_query), n_neighbors), dtype=np.int64)
+        pending = np.arange(len(unique_query))
+        n_search = min(n_neighbors + 1, n_values)
+        while len(pending):
+            q = unique_query[pending, None]
+            found = knn.kneighbors(q, n_search, return_distance=False)
+            distance = np.abs(values[found] - q)
+
+            # neighbors sorted by (exact) distance and index
+            order = np.lexsort((found, distance), axis=1)
+            found = np.take_along_axis(found, order, axis=1)
+            distance = np.take_along_axis(distance, order, axis=1)
+
+            done = np.full(len(pending), n_search == n_values)
+            if n_search > n_neighbors:
+                gap = distance[:, -1] - distance[:, n_neighbors - 1]
+                done |= gap > margin
+            distances[pending[done]] = distance[done, :n_neighbors]
+            indices[pending[done]] = found[done, :n_neighbors]
+
+            pending = pending[~done]
+            n_search = min(2 * n_search, n_values)
+
+        return distances[inverse], indices[inverse]
 
     @staticmethod
-    def get_matches(distances, indices, n_neighbors):
+    @instrumented("get_matches")
+    def get_matches(
+        distances, indices, n_neighbors, rng=None, chunk_size=65536, cells=None
+    ):
         """From the neighbors list get one match for each SPENSER row.
 
         EPC rows with the same propensity score value have the same probability
         of being matched with a SPENSER row. The greater the difference between
         the propensity score values, the lower the probability of being drawn.
-        The weight function used, is a step function.
-
-        :param distances: List of propensity score difference between the closest neighbors.
-        :type distances: list
-        :param indices: List of the closest neighbors indices.
-        :type indices: list
+        The weight function used, is a step function:
+        `100 - distance / max_distance * 95`. When all the neighbors have the
+        same propensity score value as the SPENSER row, they are drawn
+        uniformly.
+
+        All rows are drawn at once (by blocks of `chunk_size` rows), by
+        inverting the cumulative weights of each row. With `cells`, the
+        cumulative weights are computed once per cell, and the rows of each
+        cell are drawn from the candidate pool of their cell (same draws as
+        with the neighbors of each row).
+
+        :param distances: Propensity score difference between the closest
+            neighbors, sorted by distance.
+        :type distances: numpy.ndarray
+        :param indices: Indices of the closest neighbors.
+        :type indices: numpy.ndarray
         :param n_neighbors: Number of neighbors.
         :type n_neighbors: integer
-        :return: List of assigned pairs.
-        :rtype: list
+        :param rng: Seed or random number generator, defaults to None.
+        :type rng: int or numpy.random.Generator, optional
+        :param chunk_size: Number of rows drawn at once, defaults to 65536.
+        :type chunk_size: int, optional
+        :param cells: Cell of each SPENSER row, when the neighbors are given
+            per cell (see `get_cell_neighbors`), defaults to None.
+        :type cells: numpy.ndarray, optional
+        :return: Assigned pairs (SPENSER row, EPC row).
+        :rtype: numpy.ndarray
         """
-        pairs = []
-        for index1, candidates2 in enumerate(indices):
-            is_zero = np.flatnonzero(distances[index1] == 0)
-            if is_zero.size < n_neighbors:
-                weight = 100 - (distances[index1] / distances[index1][-1] * 95)
-                index2 = choices(candidates2, weights=weight)[0]
-            else:
-                index2 = choices(candidates2)[0]
-            pairs.append([index1, index2])
-
-        return pairs
+        rng = np.random.default_rng(rng)
+        distances = np.asarray(distances)
+        indices = np.asarray(indices)
+
+        if cells is not None:
+            cumulative = EnrichingPopulation.get_cumulative_weights(
+                distances[:, :n_neighbors]
+            )
+            draw = rng.random(len(cells)) * cumulative[cells, -1]
+
+            # rows of each cell: one search in the weights of the cell
+            order = np.argsort(cells, kind="stable")
+            stops = np.cumsum(np.bincount(cells, minlength=len(cumulative)))
+            choice = np.empty(len(cells), dtype=np.int64)
+            for cell, start in enumerate(stops - np.diff(stops, prepend=0)):
+                rows = order[start : stops[cell]]
+                choice[rows] = np.searchsorted(
+                    cumulative[cell], draw[rows], side="right"
+                )
+            choice = np.minimum(choice, cumulative.shape[1] - 1)
+
+            return np.column_stack([np.arange(len(cells)), indices[cells, choice]])
+
+        n_rows = len(indices)
+        index2 = np.empty(n_rows, dtype=indices.dtype)
+        for start in range(0, n_rows, chunk_size):
+            stop = min(start + chunk_size, n_rows)
+            cumulative = EnrichingPopulation.get_cumulative_weights(
+                distances[start:stop, :n_neighbors]
+            )
+
+            # draw the first neighbor whose cumulative weight exceeds a
+            # uniform number in [0, total weight)
+            draw = rng.random(stop - start) * cumulative[:, -1]
+            choice = (cumulative <= draw[:, None]).sum(axis=1)
+            choice = np.minimum(choice, cumulative.shape[1] - 1)
+
+            index2[start:stop] = indices[np.arange(start, stop), choice]
+
+        return np.column_stack([np.arange(n_rows), index2])
 
     @staticmethod
+    def get_cumulative_weights(distance) -> np.ndarray:
+        """Return the cumulative matching weights of the neighbors.
+
+        :param distance: Propensity score difference between the closest
+            neighbors, sorted by distance (one row per SPENSER row or cell).
+        :type distance: numpy.ndarray
+        :return: cumulative weights (see `get_matches`)
+        :rtype: numpy.ndarray
+        """
+        # all neighbors with zero distance: uniform weights
+        max_distance = distance[:, -1:]
+        uniform = max_distance[:, 0] == 0
+        weight = 100 - distance / np.where(uniform[:, None], 1, max_distance) * 95
+        weight[uniform] = 1
+        return np.cumsum(weight, axis=1)
+
+    @staticmethod
+    @instrumented("get_enriched_pop")
     def get_enriched_pop(pairs, df1, df2, matches_columns):
         """Returns the SPENSER enriched population.
 
@@ -156,8 +439,8 @@ class EnrichingPopulation:
         synthetic population. To combine the datasets, the propensity score
         matching method is used.
 
-        :param pairs: List of assigned pairs.
-        :type pairs: list
+        :param pairs: Assigned pairs (SPENSER row, EPC row).
+        :type pairs: numpy.ndarray
         :param df1: SPENSER dataset.
         :type df1: pandas.DataFrame
         :param df2: EPC dataset.
@@ -215,76 +498,40 @@ class EnrichingPopulation:
                 )
 
     @staticmethod
-    def save_validation_fig(SHAPE, EPC):
+    def save_validation_fig(SHAPE, EPC, workers=1):
         """Save the internal validation image.
 
         Floor Area distribution and Accommodation age codes distribution
         comparison between original EPC data and SHAPE population.
 
-        :param df1: SHAPE dataset list.
-        :type df1: list of pandas.DataFrame
-        :param df2: EPC dataset list.
-        :type df2: list of pandas.DataFrame
+        :param SHAPE: SHAPE dataset list.
+        :type SHAPE: list of pandas.DataFrame
+        :param EPC: EPC dataset list.
+        :type EPC: list of pandas.DataFrame
+        :param workers: Number of worker processes, defaults to 1.
+        :type workers: int, optional
         """
-        bins1 = [
-            [0, 1, 2, 3, 4, 5, 6, 7, 8, 9, 10],
-            [0, 1, 2, 3, 4, 5, 6, 7, 8, 9, 10, 11, 12, 13, 14, 15, 16, 17, 18, 19, 20],
-            [0, 1, 2],
-        ]
+        histograms = ValidationHistograms()
+        for df1, df2 in zip(EPC, SHAPE):
+            histograms.add(df1, df2)
 
-        constraints = ["ACCOM_AGE", "FLOOR_AREA", "GAS"]
-        xlabels = ["Accommodation age", "Floor area", "Gas Availability"]
+        zip_png_name = os.path.join("data/output/", "SHAPE_distribution-images.zip")
+        histograms.save_figures(zip_png_name, workers)
 
-        colours = sns.color_palette()
+    @staticmethod
+    def spawn_rngs(rng, n) -> list:
+        """Return independent random number generators derived from `rng`.
 
-        save_dir = "data/output/"
-        if not (os.path.exists(save_dir)):
-            os.makedirs(save_dir)
+        :param rng: random number generator
+        :type rng: numpy.random.Generator
+        :param n: number of generators
+        :type n: int
+        :rtype: list
+        """
+        seed_sequence = np.random.SeedSequence(rng.integers(2**32, size=4).tolist())
+        return [np.random.default_rng(child) for child in seed_sequence.spawn(n)]
 
-        zip_png_name = os.path.join(save_dir, "SHAPE_distribution-images.zip")
-        with zipfile.ZipFile(zip_png_name, "w") as png_zip:
-            for i in range(len(SHAPE)):
-                df1 = EPC[i]
-                df2 = SHAPE[i]
-
-                j = 0
-                sns.set(color_codes=True)
-                fig, ax = plt.subplots(nrows=3, ncols=2, figsize=(16, 15))
-                for constraint in constraints:
-
-                    y_epc = (
-                        df1[constraint]
-                        .value_counts(bins=bins1[j], normalize=True)
-                        .sort_index()
-                    )
-                    y_msm = (
-                        df2[constraint]
-                        .value_counts(bins=bins1[j], normalize=True)
-                        .sort_index()
-                    )
-
-                    sns.barplot(ax=ax[j][0], x=bins1[j][1:], y=y_epc, color=colours[0])
-                    sns.barplot(ax=ax[j][1], x=bins1[j][1:], y=y_msm, color=colours[3])
-
-                    for k in range(2):
-                        ax[j][k].set_xlabel(xlabels[j])
-                        ax[j][k].set_ylabel("Frequency")
-
-                    j = j + 1
-
-                ax[0][0].set_title("EPC")
-                ax[0][1].set_title("SHAPE")
-                fig.tight_layout(pad=3.0)
-                buf = io.BytesIO()
-                plt.savefig(buf)
-                plt.close()
-
-                lad_name = df2.LADNM[0]
-                lad_code = df2.LADCD[0]
-                fig_name = "_".join([lad_code, lad_name, "distribution.png"])
-                png_zip.writestr(fig_name, buf.getvalue())
-
-    def step(self, df0, df1):
+    def step(self, df0, df1, rng=None, n_realisations=None):
         """Enriching population main step.
 
         In this step the EPC data and the SPENSER data are combined to generate
@@ -300,25 +547,64 @@ class EnrichingPopulation:
         :type psm_fig: bool, optional
         :param validation_fig: Boolean to save the internal validation image, defaults to True.
         :type validation_fig: bool, optional
-        :return: Enriched synthetic population
+        :param rng: Seed or random number generator used in the matching; if
+            `None`, the class generator (configured `seed`) is used, defaults
+            to None.
+        :type rng: int or numpy.random.Generator, optional
+        :param n_realisations: Number of matchings drawn from the same
+            propensity scores and neighbors; if `None`, the configured
+            `n_realisations` is used, defaults to None.
+        :type n_realisations: int, optional
+        :return: Enriched synthetic population (first realisation). With more
+            than one realisation, the "EPCid_<k>" columns give the EPC row
+            (position in the processed EPC data) matched in realisation k.
         :rtype: pandas.DataFrame
         """
+        if n_realisations is None:
+            n_realisations = self.n_realisations
+
         df0, df1 = self.set_treatment(df0, df1)
         dataset = pd.concat([df0, df1], ignore_index=True, sort=False)
         dataset = self.set_area_factor(dataset)
-        dataset["ps"] = self.get_propensity_score(dataset, self.overlap_columns)
+        dataset["ps"] = self.get_propensity_score(
+            dataset, self.overlap_columns, self.estimator
+        )
 
         # Separating EPC data from MSM data
         df0 = dataset.loc[dataset.Treatment == 0].reset_index(drop=True)
         df1 = dataset.loc[dataset.Treatment == 1].reset_index(drop=True)
         del dataset
 
-        # Get neighbors and matched pairs
-        distances, indices = self.get_neighbors(df0, df1, self.n_neighbors)
-        pairs = self.get_matches(distances, indices, self.n_neighbors)
+        # Get neighbors (per SPENSER row or per cell) and matched pairs
+        cells = None
+        if self.match_cells:
+            distances, indices, cells = self.get_cell_neighbors(
+                df0, df1, self.n_neighbors, self.neighbors_backend
+            )
+        else:
+            distances, indices = self.get_neighbors(
+                df0, df1, self.n_neighbors, self.neighbors_backend
+            )
+        rng = self.rng if rng is None else rng
+        rng = np.random.default_rng(rng)
+        pairs = self.get_matches(distances, indices, self.n_neighbors, rng, cells=cells)
+
+        # Other realisations: only the random draw changes (one independent
+        # stream each), the EPC rows are stored as one column per realisation
+        epc_ids = {}
+        if n_realisations > 1:
+            epc_ids["EPCid_0"] = pairs[:, 1]
+            rngs = self.spawn_rngs(rng, n_realisations - 1)
+            for k, realisation_rng in enumerate(rngs, start=1):
+                matches = self.get_matches(
+                    distances, indices, self.n_neighbors, realisation_rng, cells=cells
+                )
+                epc_ids[f"EPCid_{k}"] = matches[:, 1]
         del distances, indices
 
         # Get enriched population
         rich_df = self.get_enriched_pop(pairs, df0, df1, self.matches_columns)
+        for column, values in epc_ids.items():
+            rich_df[column] = values.astype(np.int32)
 
         return rich_df
@@ -0,0 +1,409 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+SHAPE: geographic lookup store
+Created on Sunday October 18 2026
+@author: patricia-ternes
+"""
+from collections.abc import Mapping
+import numpy as np
+import pandas as pd
+
+try:
+    from .cache import cache_key, zip_fingerprint
+except ImportError:
+    from cache import cache_key, zip_fingerprint
+
+
+def normalise_postcodes(postcodes) -> pd.Series:
+    """Return the postcodes in upper case and without spaces.
+
+    :param postcodes: postcodes
+    :type postcodes: array-like
+    :return: normalised postcodes
+    :rtype: pandas.Series
+    """
+    postcodes = pd.Series(postcodes, dtype=object).astype(str)
+    return postcodes.str.upper().str.replace(" ", "", regex=False)
+
+
+def search(keys, values, normalise=False) -> np.ndarray:
+    """Return the position of each value in the sorted keys (-1 if missing).
+
+    Each distinct value is searched only once (binary search).
+
+    :param keys: sorted keys
+    :type keys: numpy.ndarray (bytes)
+    :param values: values to search
+    :type values: array-like
+    :param normalise: Normalise the values as postcodes, defaults to False.
+    :type normalise: bool, optional
+    :return: positions
+    :rtype: numpy.ndarray
+    """
+    if isinstance(values, pd.Series) and isinstance(values.dtype, pd.CategoricalDtype):
+        # categorical values are already factorized
+        codes, uniques = values.cat.codes.to_numpy(), values.cat.categories
+    else:
+        codes, uniques = pd.factorize(pd.Series(values, dtype=object))
+    uniques = pd.Series(uniques, dtype=object).astype(str)
+    if normalise:
+        uniques = normalise_postcodes(uniques)
+
+    found = np.full(len(uniques) + 1, -1, dtype=np.int64)
+    if len(keys) and len(uniques):
+        uniques = uniques.to_numpy(dtype=str)
+        # longer values would be truncated by the conversion to the key dtype
+        valid = np.char.str_len(uniques) <= keys.dtype.itemsize
+        try:
+            encoded = uniques.astype(keys.dtype)
+        except UnicodeEncodeError:
+            encoded = np.char.encode(uniques, "ascii", "replace").astype(keys.dtype)
+        position = np.searchsorted(keys, encoded).clip(max=len(keys) - 1)
+        match = valid & (keys[position] == encoded)
+        found[:-1] = np.where(match, position, -1)
+
+    # missing values (code -1) take the last (-1) position
+    return found[codes]
+
+
+def encode(strings) -> np.ndarray:
+    """Return a fixed width bytes array (memory-mappable).
+
+    :param strings: strings
+    :type strings: array-like
+    :rtype: numpy.ndarray
+    """
+    encoded = [str(string).encode("utf-8") for string in strings]
+    return np.array(encoded, dtype=f"S{max(map(len, encoded), default=1)}")
+
+
+class GeoLookupStore:
+    """Compact store of the geographic lookups.
+
+    The three lookups (postcode to Output Area, Output Area to Local
+    Authority name and Output Area to Local Authority code) are stored as
+    arrays:
+
+    - "postcodes": sorted normalised postcodes (see `normalise_postcodes`),
+      with their Output Area id in "postcode_oa".
+    - "oas": sorted Output Area codes (the Output Area id is the position),
+      with their Local Authority id in "oa_lad" (-1 if unknown).
+    - "lad_codes" and "lad_names": Local Authority codes and names, in order
+      of first appearance in the lookup file.
+
+    All lookups are vectorized binary searches over these arrays. The arrays
+    are saved as `.npy` files and memory-mapped when they are loaded, so the
+    lookup file is parsed only once. The `oacd`, `ladnm` and `ladcd`
+    attributes are read-only dictionary views of the lookups, see
+    `StoreLookup`.
+    """
+
+    ARRAYS = ["postcodes", "postcode_oa", "oas", "oa_lad", "lad_codes", "lad_names"]
+
+    def __init__(self, arrays) -> None:
+        """Initialise a GeoLookupStore class.
+
+        :param arrays: store arrays (see `ARRAYS`)
+        :type arrays: dict
+        """
+        for name in self.ARRAYS:
+            setattr(self, name, arrays[name])
+
+        # Decoded versions of the (small) Output Area and Local Authority
+        # arrays, with an extra `None` value for missing positions (-1)
+        self._oas = np.append(self.oas.astype(str).astype(object), None)
+        self._lad_codes = np.append(self.lad_codes.astype(str).astype(object), None)
+        self._lad_names = np.append(
+            np.char.decode(self.lad_names, "utf-8").astype(object), None
+        )
+
+        # Categorical types of the Output Area and Local Authority columns
+        self._dtypes = {}
+
+        self.oacd = StoreLookup(self, "oacd")
+        self.ladnm = StoreLookup(self, "ladnm")
+        self.ladcd = StoreLookup(self, "ladcd")
+
+    @property
+    def arrays(self) -> dict:
+        """Store arrays.
+
+        :rtype: dict
+        """
+        return {name: getattr(self, name) for name in self.ARRAYS}
+
+    @classmethod
+    def build(cls, oas, oa_ladcd, oa_ladnm, postcodes, postcode_oas, lads=None):
+        """Build the store arrays.
+
+        Duplicated Output Areas and postcodes keep the last value, as in a
+        dictionary.
+
+        :param oas: Output Area codes
+        :type oas: array-like
+        :param oa_ladcd: Local Authority code of each Output Area
+        :type oa_ladcd: array-like
+        :param oa_ladnm: Local Authority name of each Output Area
+        :type oa_ladnm: array-like
+        :param postcodes: postcodes
+        :type postcodes: array-like
+        :param postcode_oas: Output Area code of each postcode
+        :type postcode_oas: array-like
+        :param lads: Local Authority codes order, defaults to the order of
+            first appearance in `oa_ladcd`.
+        :type lads: array-like, optional
+        :return: the store
+        :rtype: GeoLookupStore
+        """
+        oa_df = pd.DataFrame({"oa": oas, "ladcd": oa_ladcd, "ladnm": oa_ladnm})
+        oa_df = oa_df.dropna(subset=["oa"]).drop_duplicates("oa", keep="last")
+        oa_df = oa_df.astype({"oa": str}).sort_values("oa")
+
+        if lads is None:
+            lads = oa_df.ladcd.dropna().unique()
+        lad_index = pd.Index(lads)
+        oa_lad = lad_index.get_indexer(oa_df.ladcd)
+        lad_names = oa_df.ladnm.groupby(oa_lad).last().reindex(range(len(lads)))
+
+        postcode_df = pd.DataFrame(
+            {"postcode": normalise_postcodes(postcodes), "oa": postcode_oas}
+        )
+        postcode_df = postcode_df[pd.notna(np.asarray(postcode_oas))]
+        postcode_df = postcode_df.drop_duplicates("postcode", keep="last")
+        postcode_df = postcode_df.sort_values("postcode")
+
+        store_oas = encode(oa_df.oa)
+        postcode_oa = search(store_oas, postcode_df.oa)
+        known = postcode_oa >= 0
+
+        return cls(
+            {
+                "postcodes": encode(postcode_df.postcode[known]),
+                "postcode_oa": postcode_oa[known].astype(np.int32),
+                "oas": store_oas,
+                "oa_lad": oa_lad.astype(np.int32),
+                "lad_codes": encode(lad_index),
+                "lad_names": encode(lad_names.fillna("")),
+            }
+        )
+
+    @classmethod
+    def from_lookups(cls, ladnm_lookup, ladcd_lookup, oacd_lookup=None):
+        """Return the store of the given lookups.
+
+        :param ladnm_lookup: lookup from  Output Area to Local Authority name
+        :type ladnm_lookup: dict
+        :param ladcd_lookup: lookup from  Output Area to Local Authority code
+        :type ladcd_lookup: dict
+        :param oacd_lookup: lookup from postcode to Output Area, defaults to
+            None.
+        :type oacd_lookup: dict, optional
+        :return: the store (the original one for `StoreLookup` views)
+        :rtype: GeoLookupStore
+        """
+        if isinstance(ladcd_lookup, StoreLookup):
+            return ladcd_lookup.store
+
+        oas = list(ladcd_lookup)
+        oacd_lookup = oacd_lookup or {}
+        return cls.build(
+            oas,
+            [ladcd_lookup[oa] for oa in oas],
+            [ladnm_lookup.get(oa) for oa in oas],
+            list(oacd_lookup),
+            list(oacd_lookup.values()),
+        )
+
+    @classmethod
+    def from_file(cls, path, cache=None):
+        """Return the store of the ONS postcode lookup file (England only).
+
+        :param path: zipped postcode lookup file location
+        :type path: string
+        :param cache: cache where the store arrays are saved, defaults to None.
+        :type cache: cache.DataCache, optional
+        :return: the store
+        :rtype: GeoLookupStore
+        """
+        key = cache_key(zip_fingerprint(path)) if cache is not None else None
+        if key is not None:
+            arrays = cache.load_arrays("geo", key)
+            if arrays is not None:
+                return cls(arrays)
+
+        # Open file as Pandas DataFrame
+        area_lookup = pd.read_csv(
+            path,
+            compression="zip",
+            usecols=["ladnm", "ladcd", "oa11cd", "pcds"],
+            encoding="unicode_escape",
+            dtype=str,
+        )
+
+        # Clean empty and non-England areas
+        area_lookup.dropna(subset=["ladcd"], inplace=True)
+        discard = ["S", "W", "N", "L", "M"]
+        area_lookup = area_lookup[~area_lookup.ladcd.str.contains("|".join(discard))]
+
+        store = cls.build(
+            area_lookup.oa11cd,
+            area_lookup.ladcd,
+            area_lookup.ladnm,
+            area_lookup.pcds,
+            area_lookup.oa11cd,
+            lads=area_lookup.ladcd.unique(),
+        )
+        if key is not None:
+            cache.save_arrays("geo", key, store.arrays)
+
+        return store
+
+    def lads(self) -> np.ndarray:
+        """Return the Local Authority codes.
+
+        :rtype: numpy.ndarray
+        """
+        return self._lad_codes[:-1].copy()
+
+    def postcode_positions(self, postcodes) -> np.ndarray:
+        """Return the Output Area id of each postcode (-1 if unknown).
+
+        :param postcodes: postcodes (normalised before the search)
+        :type postcodes: array-like
+        :return: Output Area ids
+        :rtype: numpy.ndarray
+        """
+        position = search(self.postcodes, postcodes, normalise=True)
+        return np.where(position < 0, -1, self.postcode_oa[position])
+
+    def oa_positions(self, oas) -> np.ndarray:
+        """Return the id of each Output Area (-1 if unknown).
+
+        :param oas: Output Area codes
+        :type oas: array-like
+        :return: Output Area ids
+        :rtype: numpy.ndarray
+        """
+        return search(self.oas, oas)
+
+    def take_oa(self, position) -> np.ndarray:
+        """Return the Output Area codes of the given ids.
+
+        :param position: Output Area ids (-1 for missing values)
+        :type position: numpy.ndarray
+        :return: Output Area codes (`None` for missing values)
+        :rtype: numpy.ndarray
+        """
+        return self._oas.take(position)
+
+    def lad_positions(self, position) -> np.ndarray:
+        """Return the Local Authority id of the given Output Area ids.
+
+        :param position: Output Area ids (-1 for missing values)
+        :type position: numpy.ndarray
+        :return: Local Authority ids (-1 for missing values)
+        :rtype: numpy.ndarray
+        """
+        return np.where(position < 0, -1, self.oa_lad[position])
+
+    def take_ladcd(self, position) -> np.ndarray:
+        """Return the Local Authority codes of the given Output Area ids.
+
+        :param position: Output Area ids (-1 for missing values)
+        :type position: numpy.ndarray
+        :return: Local Authority codes (`None` for missing values)
+        :rtype: numpy.ndarray
+        """
+        return self._lad_codes.take(self.lad_positions(position))
+
+    def take_ladnm(self, position) -> np.ndarray:
+        """Return the Local Authority names of the given Output Area ids.
+
+        :param position: Output Area ids (-1 for missing values)
+        :type position: numpy.ndarray
+        :return: Local Authority names (`None` for missing values)
+        :rtype: numpy.ndarray
+        """
+        return self._lad_names.take(self.lad_positions(position))
+
+    def categorical(self, position, level) -> pd.Categorical:
+        """Return the Output Area, Local Authority code or name of the given
+        Output Area ids, as a categorical.
+
+        The categories are all the values of the store, so a column holds one
+        small integer per row instead of one string, and the columns built by
+        the same store can be concatenated without copying any string.
+
+        :param position: Output Area ids (-1 for missing values)
+        :type position: numpy.ndarray
+        :param level: "oa", "ladcd" or "ladnm"
+        :type level: string
+        :return: Output Area codes, or Local Authority codes or names (`NaN`
+            for missing values)
+        :rtype: pandas.Categorical
+        """
+        if level not in self._dtypes:
+            values = {"oa": self._oas, "ladcd": self._lad_codes}.get(
+                level, self._lad_names
+            )[:-1]
+            # Local Authority names are not necessarily unique
+            codes, categories = pd.factorize(values)
+            self._dtypes[level] = (
+                pd.CategoricalDtype(categories),
+                np.append(codes, -1).astype(np.int32),
+            )
+
+        dtype, codes = self._dtypes[level]
+        if level != "oa":
+            position = self.lad_positions(position)
+        return pd.Categorical.from_codes(codes.take(position), dtype=dtype)
+
+
+class StoreLookup(Mapping):
+    """Read-only dictionary view of a `GeoLookupStore` lookup.
+
+    It can be used wherever the original lookup dictionaries were used
+    ("oacd": postcode to Output Area, "ladnm" and "ladcd": Output Area to
+    Local Authority name and code). Postcode keys are normalised (see
+    `normalise_postcodes`). Use `map` to translate a whole column.
+    """
+
+    def __init__(self, store, name) -> None:
+        """Initialise a StoreLookup class.
+
+        :param store: geographic lookup store
+        :type store: GeoLookupStore
+        :param name: "oacd", "ladnm" or "ladcd"
+        :type name: string
+        """
+        self.store = store
+        self.name = name
+
+    def map(self, keys) -> np.ndarray:
+        """Translate the keys using the lookup.
+
+        :param keys: dictionary keys
+        :type keys: array-like
+        :return: dictionary values (`None` for missing keys)
+        :rtype: numpy.ndarray
+        """
+        if self.name == "oacd":
+            return self.store.take_oa(self.store.postcode_positions(keys))
+        take = getattr(self.store, f"take_{self.name}")
+        return take(self.store.oa_positions(keys))
+
+    def _keys(self) -> np.ndarray:
+        return self.store.postcodes if self.name == "oacd" else self.store.oas
+
+    def __getitem__(self, key):
+        value = self.map([key])[0]
+        if value is None:
+            raise KeyError(key)
+        return value
+
+    def __iter__(self):
+        return (key.decode() for key in self._keys())
+
+    def __len__(self) -> int:
+        return len(self._keys())
@@ -0,0 +1,258 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+SHAPE: per stage instrumentation and run report
+Created on Sunday October 18 2026
+@author: patricia-ternes
+"""
+from contextlib import contextmanager
+import cProfile
+import functools
+import json
+import os
+import sys
+import threading
+import time
+import numpy as np
+import pandas as pd
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+# Stage records of the Local Authority running in the current thread
+_local = threading.local()
+
+# Stages profiled with cProfile (see `set_profile`)
+_profile = {"stages": set(), "directory": "data/output/profiles/"}
+
+
+def set_profile(stages, directory="data/output/profiles/"):
+    """Profile some stages with cProfile.
+
+    One `<LAD code>_<stage>.prof` file (see `pstats`) is saved for each
+    profiled stage call. Call this function before the worker processes
+    are started.
+
+    :param stages: Stage names ("all" for every stage).
+    :type stages: list
+    :param directory: Folder of the profile files, defaults to
+        "data/output/profiles/".
+    :type directory: string, optional
+    """
+    _profile["stages"] = set(stages)
+    _profile["directory"] = directory
+
+
+def peak_rss() -> float:
+    """Return the peak resident set size of the process, in MB.
+
+    :return: peak RSS (`None` if unknown)
+    :rtype: float
+    """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak / 2**20 if sys.platform == "darwin" else peak / 2**10
+
+
+def count_rows(value):
+    """Return the number of rows of a stage input or output.
+
+    :param value: dataframe, array or tuple (its first element is counted)
+    :type value: Any
+    :return: number of rows (`None` for other values)
+    :rtype: int
+    """
+    if isinstance(value, tuple) and value:
+        value = value[0]
+    if isinstance(value, (pd.DataFrame, pd.Series, np.ndarray)):
+        return len(value)
+    return None
+
+
+@contextmanager
+def collect(lad_code):
+    """Collect the stage records of a Local Authority (current thread).
+
+    :param lad_code: Local authority district code.
+    :type lad_code: string
+    :return: stage records, filled while the context is active
+    :rtype: list
+    """
+    previous = getattr(_local, "records", None), getattr(_local, "lad_code", None)
+    _local.records, _local.lad_code = [], lad_code
+    try:
+        yield _local.records
+    finally:
+        _local.records, _local.lad_code = previous
+
+
+@contextmanager
+def measure(name, rows_in=None, records=None):
+    """Measure a stage: wall time, peak RSS increase and rows.
+
+    :param name: stage name
+    :type name: string
+    :param rows_in: number of input rows, defaults to None.
+    :type rows_in: int, optional
+    :param records: list where the record is appended, defaults to the
+        records of the current `collect` context (nothing is measured
+        outside it).
+    :type records: list, optional
+    :return: the stage record (set its "rows_out" inside the context)
+    :rtype: dict
+    """
+    if records is None:
+        records = getattr(_local, "records", None)
+    record = {"stage": name, "rows_in": rows_in, "rows_out": None}
+    if records is None:
+        yield record
+        return
+
+    profiler = None
+    if name in _profile["stages"] or "all" in _profile["stages"]:
+        profiler = cProfile.Profile()
+
+    rss = peak_rss()
+    start = time.perf_counter()
+    if profiler is not None:
+        profiler.enable()
+    try:
+        yield record
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            os.makedirs(_profile["directory"], exist_ok=True)
+            lad_code = getattr(_local, "lad_code", None) or "run"
+            profiler.dump_stats(
+                os.path.join(_profile["directory"], f"{lad_code}_{name}.prof")
+            )
+        record["seconds"] = time.perf_counter() - start
+        record["peak_rss_delta_mb"] = None if rss is None else peak_rss() - rss
+        records.append(record)
+
+
+def instrumented(name):
+    """Decorator: measure every call of a stage function (see `measure`).
+
+    The input rows are the rows of the first dataframe or array argument.
+    The output rows are the rows of the returned dataframe or array, or of
+    the input if the function works in place.
+
+    :param name: stage name
+    :type name: string
+    :return: decorator
+    :rtype: callable
+    """
+
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if getattr(_local, "records", None) is None:
+                return function(*args, **kwargs)
+
+            data = next(
+                (arg for arg in args if count_rows(arg) is not None), None
+            )
+            with measure(name, count_rows(data)) as record:
+                result = function(*args, **kwargs)
+                rows_out = count_rows(result)
+                record["rows_out"] = count_rows(data) if rows_out is None else rows_out
+            return result
+
+        return wrapper
+
+    return decorator
+
+
+class RunReport:
+    """Machine-readable report of a run.
+
+    For each Local Authority: status ("done", "resumed" or "failed"), total
+    time, the stage records (see `measure`) and, for the failed ones, the
+    exception type, message and traceback. The same information is given in
+    "checkpoint_error" when the result could not be saved in the checkpoint.
+    The state of the checkpoint ("enabled", "disabled", or `None` without
+    checkpoint) is also reported.
+    """
+
+    COLUMNS = [
+        "LADCD",
+        "stage",
+        "seconds",
+        "peak_rss_delta_mb",
+        "rows_in",
+        "rows_out",
+    ]
+
+    def __init__(self) -> None:
+        """Initialise a RunReport class."""
+        self.lads = {}
+        self.checkpoint = None
+        self.lock = threading.Lock()
+
+    def add(self, lad_code, telemetry):
+        """Add the telemetry of a Local Authority.
+
+        :param lad_code: Local authority district code.
+        :type lad_code: string
+        :param telemetry: "status", "seconds", "stages" and "error" (`None`
+            if the Local Authority did not fail), and "checkpoint_error" if
+            its result could not be saved.
+        :type telemetry: dict
+        """
+        with self.lock:
+            entry = self.lads.setdefault(lad_code, {"stages": []})
+            stages = entry["stages"] + list(telemetry.get("stages", []))
+            entry.update(telemetry)
+            entry["stages"] = stages
+
+    def add_stage(self, lad_code, record):
+        """Add a stage record measured outside the Local Authority task.
+
+        :param lad_code: Local authority district code.
+        :type lad_code: string
+        :param record: stage record
+        :type record: dict
+        """
+        self.add(lad_code, {"stages": [record]})
+
+    @property
+    def table(self) -> pd.DataFrame:
+        """Stage records table (one row per Local Authority and stage).
+
+        :rtype: pandas.DataFrame
+        """
+        rows = [
+            {"LADCD": lad_code, **record}
+            for lad_code, entry in self.lads.items()
+            for record in entry["stages"]
+        ]
+        return pd.DataFrame(rows, columns=self.COLUMNS)
+
+    def save(self, json_path, csv_path=None):
+        """Save the report as a JSON file and the stage table as a CSV file.
+
+        :param json_path: JSON file location
+        :type json_path: string
+        :param csv_path: CSV file location, defaults to None (no CSV file).
+        :type csv_path: string, optional
+        """
+        failed = [lad for lad, entry in self.lads.items() if entry.get("error")]
+        unsaved = [
+            lad for lad, entry in self.lads.items() if entry.get("checkpoint_error")
+        ]
+        report = {
+            "checkpoint": self.checkpoint,
+            "failed": failed,
+            "checkpoint_failed": unsaved,
+            "lads": self.lads,
+        }
+        with open(json_path, "w") as outfile:
+            json.dump(report, outfile, indent=1)
+
+        if csv_path is not None:
+            self.table.to_csv(csv_path, index=False)
@@ -0,0 +1,354 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+SHAPE: streaming output writer
+Created on Sunday October 18 2026
+@author: patricia-ternes
+"""
+import io
+import os
+import queue
+import shutil
+import threading
+import zipfile
+import numpy as np
+import pandas as pd
+
+try:
+    from .instrumentation import measure
+    from .settings import COMPRESSION, load_config
+except ImportError:
+    from instrumentation import measure
+    from settings import COMPRESSION, load_config
+
+
+class OutputArchive:
+    """Per Local Authority output, written as soon as each LAD is ready.
+
+    Each Local Authority is appended as a `<LAD code>_<suffix>` CSV member of
+    `<save_dir>/<name>.zip`, so the complete national output is never held in
+    memory. The CSV serialisation and the member compression run on a
+    background thread, while the main loop moves on to the next Local
+    Authority; at most `queue_size` Local Authorities wait to be written.
+
+    Optionally (`output_parquet`), each Local Authority is also written as
+    a partition of the `<save_dir>/<name>/` Parquet dataset
+    (`LADCD=<LAD code>/part-0.parquet`). With an `index_column` (e.g. "OA"),
+    the rows of each partition are sorted by that column and written in row
+    groups of `output_row_group_size` rows, and the `_index.parquet` file of
+    the dataset gives the rows of each Local Authority and area, so a few
+    areas are read without reading whole Local Authorities (see
+    `OutputDataset`).
+
+    The compression is configured in "config/config.yaml".
+    """
+
+    def __init__(
+        self,
+        name,
+        suffix,
+        save_dir="data/output/",
+        queue_size=4,
+        report=None,
+        index_column=None,
+    ) -> None:
+        """Initialise an OutputArchive class.
+
+        :param name: archive name (e.g. "SHAPE_England")
+        :type name: string
+        :param suffix: CSV member suffix (e.g. "_SHAPE.csv")
+        :type suffix: string
+        :param save_dir: output folder, defaults to "data/output/".
+        :type save_dir: string, optional
+        :param queue_size: Maximum number of Local Authorities waiting to be
+            written, defaults to 4.
+        :type queue_size: int, optional
+        :param report: Run report where the writing time of each Local
+            Authority is added, defaults to None.
+        :type report: instrumentation.RunReport, optional
+        :param index_column: Column indexing the Parquet dataset, defaults to
+            None (the rows keep their order and there is no index).
+        :type index_column: string, optional
+        """
+        # Configure output related parameters from "config/config.yaml"
+        parsed_output = load_config()
+        compression = parsed_output.get("output_compression", "stored")
+        self.compression_level = parsed_output.get("output_compression_level")
+        self.parquet = parsed_output.get("output_parquet", False)
+        self.row_group_size = parsed_output.get("output_row_group_size", 8192)
+
+        self.compression = COMPRESSION.get(compression)
+        if self.compression is None:
+            raise ValueError(f"Unsupported output compression: {compression}")
+
+        self.name = name
+        self.suffix = suffix
+        self.report = report
+        self.index_column = index_column
+        self.index = []
+        if not (os.path.exists(save_dir)):
+            os.makedirs(save_dir)
+        self.path = os.path.join(save_dir, f"{name}.zip")
+        self.zip = zipfile.ZipFile(
+            self.path,
+            "w",
+            compression=self.compression,
+            compresslevel=self.compression_level,
+        )
+        self.parquet_dir = os.path.join(save_dir, name)
+        if self.parquet and os.path.exists(self.parquet_dir):
+            shutil.rmtree(self.parquet_dir)
+
+        # Background writer
+        self.error = None
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def write(self, lad_code, df):
+        """Queue the output of a Local Authority.
+
+        :param lad_code: Local authority district code.
+        :type lad_code: string
+        :param df: Local Authority output
+        :type df: pandas.DataFrame
+        """
+        self._raise_error()
+        self.queue.put((lad_code, df))
+
+    def close(self):
+        """Write the queued Local Authorities and close the archive."""
+        if self.thread.is_alive():
+            self.queue.put(None)
+            self.thread.join()
+        self.zip.close()
+        self._raise_error()
+        if self.parquet and self.index_column is not None:
+            self._write_index()
+
+    def _write_index(self):
+        """Write the `_index.parquet` file of the Parquet dataset."""
+        if self.index:
+            index = pd.concat(self.index, ignore_index=True)
+        else:
+            index = pd.DataFrame(columns=OutputDataset.INDEX_COLUMNS)
+        os.makedirs(self.parquet_dir, exist_ok=True)
+        path = os.path.join(self.parquet_dir, "_index.parquet")
+        index.to_parquet(path, index=False)
+
+    def _raise_error(self):
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise error
+
+    def _run(self):
+        """Background thread: write the queued Local Authorities."""
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+            if self.error is not None:
+                continue  # keep draining the queue, the error is raised later
+            try:
+                self._write(*item)
+            except Exception as error:
+                self.error = error
+
+    def _write(self, lad_code, df):
+        """Write the output of a Local Authority.
+
+        :param lad_code: Local authority district code.
+        :type lad_code: string
+        :param df: Local Authority output
+        :type df: pandas.DataFrame
+        """
+        records = []
+        with measure(f"write_{self.name}", len(df), records) as record:
+            self._write_files(lad_code, df)
+            record["rows_out"] = len(df)
+        if self.report is not None:
+            self.report.add_stage(lad_code, records[0])
+
+    def _write_files(self, lad_code, df):
+        """Write the zip member (and Parquet partition) of a Local Authority.
+
+        :param lad_code: Local authority district code.
+        :type lad_code: string
+        :param df: Local Authority output
+        :type df: pandas.DataFrame
+        """
+        # the member is compressed with the method and level of the archive
+        name = "_".join([lad_code, self.suffix])
+        with self.zip.open(name, "w", force_zip64=True) as member:
+            with io.TextIOWrapper(member, encoding="utf-8", newline="") as csv_file:
+                df.to_csv(csv_file, index=False, header=True)
+
+        if self.parquet:
+            partition = os.path.join(self.parquet_dir, f"LADCD={lad_code}")
+            os.makedirs(partition, exist_ok=True)
+            # the partition column is stored in the folder name
+            df = df.drop(columns="LADCD", errors="ignore")
+            if self.index_column is not None:
+                areas = df[self.index_column].astype(str)
+                df = df.iloc[np.argsort(areas.to_numpy(), kind="stable")]
+                self.index.append(area_ranges(lad_code, df[self.index_column]))
+            df.to_parquet(
+                os.path.join(partition, "part-0.parquet"),
+                index=False,
+                compression="zstd",
+                row_group_size=self.row_group_size,
+            )
+
+
+def area_ranges(lad_code, areas) -> pd.DataFrame:
+    """Return the rows of each area of a Local Authority.
+
+    :param lad_code: Local authority district code.
+    :type lad_code: string
+    :param areas: area of each row, sorted
+    :type areas: pandas.Series
+    :return: "LADCD", "OA", "start" and "stop" (rows of each area)
+    :rtype: pandas.DataFrame
+    """
+    values = areas.astype(str).to_numpy()
+    starts = np.flatnonzero(np.r_[True, values[1:] != values[:-1]])
+    return pd.DataFrame(
+        {
+            "LADCD": lad_code,
+            "OA": values[starts],
+            "start": starts,
+            "stop": np.r_[starts[1:], len(values)],
+        },
+        columns=OutputDataset.INDEX_COLUMNS,
+    )
+
+
+class OutputDataset:
+    """Random access to an indexed Parquet output (see `OutputArchive`).
+
+    The Parquet files are memory mapped, and only the row groups holding
+    the requested Local Authorities or Output Areas (and only the requested
+    columns) are decompressed.
+
+    Example:
+
+        >>> households = OutputDataset("data/output/SHAPE_England")
+        >>> df = households.read(oas=["E00000001"], columns=["HID", "FLOOR_AREA"])
+    """
+
+    INDEX_COLUMNS = ["LADCD", "OA", "start", "stop"]
+
+    def __init__(self, path) -> None:
+        """Initialise an OutputDataset class.
+
+        :param path: dataset folder (e.g. "data/output/SHAPE_England")
+        :type path: string
+        """
+        self.path = path
+        self.index = pd.read_parquet(os.path.join(path, "_index.parquet"))
+        self.files = {}
+
+    def lads(self) -> list:
+        """Return the Local Authority codes of the dataset.
+
+        :rtype: list
+        """
+        return self.index.LADCD.unique().tolist()
+
+    def oas(self, lad_codes=None) -> list:
+        """Return the Output Area codes of the dataset.
+
+        :param lad_codes: Only the Output Areas of these Local Authorities,
+            defaults to None (all).
+        :type lad_codes: list, optional
+        :rtype: list
+        """
+        index = self.index
+        if lad_codes is not None:
+            index = index[index.LADCD.isin(lad_codes)]
+        return index.OA.tolist()
+
+    def get_file(self, lad_code):
+        """Return the (memory mapped) Parquet file of a Local Authority.
+
+        :param lad_code: Local authority district code.
+        :type lad_code: string
+        :rtype: pyarrow.parquet.ParquetFile
+        """
+        if lad_code not in self.files:
+            import pyarrow.parquet as pq
+
+            path = os.path.join(self.path, f"LADCD={lad_code}", "part-0.parquet")
+            self.files[lad_code] = pq.ParquetFile(path, memory_map=True)
+        return self.files[lad_code]
+
+    def read(self, lads=None, oas=None, columns=None) -> pd.DataFrame:
+        """Read the rows of some Local Authorities and Output Areas.
+
+        The rows are returned by Local Authority and sorted by Output Area;
+        "LADCD" (stored in the folder names) is the first column.
+
+        :param lads: Local authority district codes, defaults to None.
+        :type lads: list, optional
+        :param oas: Output Area codes, defaults to None.
+        :type oas: list, optional
+        :param columns: Columns to read, defaults to None (all columns).
+        :type columns: list, optional
+        :return: rows of the given Local Authorities and Output Areas (all
+            the rows if both are None)
+        :rtype: pandas.DataFrame
+        """
+        if lads is None and oas is None:
+            selected = np.ones(len(self.index), dtype=bool)
+        else:
+            selected = self.index.LADCD.isin(lads or []).to_numpy()
+            selected |= self.index.OA.isin(oas or []).to_numpy()
+
+        file_columns = None
+        if columns is not None:
+            file_columns = [column for column in columns if column != "LADCD"]
+
+        dfs = []
+        for lad_code, ranges in self.index[selected].groupby("LADCD", sort=False):
+            df = self.read_rows(lad_code, ranges, file_columns)
+            df.insert(0, "LADCD", lad_code)
+            dfs.append(df)
+        if not dfs:
+            return pd.DataFrame(columns=columns)
+        df = pd.concat(dfs, ignore_index=True)
+        return df if columns is None else df[columns]
+
+    def read_rows(self, lad_code, ranges, columns=None) -> pd.DataFrame:
+        """Read some row ranges of a Local Authority.
+
+        :param lad_code: Local authority district code.
+        :type lad_code: string
+        :param ranges: row ranges ("start" and "stop" columns)
+        :type ranges: pandas.DataFrame
+        :param columns: Columns to read, defaults to None (all columns).
+        :type columns: list, optional
+        :rtype: pandas.DataFrame
+        """
+        file = self.get_file(lad_code)
+        metadata = file.metadata
+        sizes = [metadata.row_group(i).num_rows for i in range(metadata.num_row_groups)]
+        bounds = np.cumsum([0] + sizes)
+        rows = np.concatenate(
+            [np.arange(start, stop) for start, stop in zip(ranges.start, ranges.stop)]
+        )
+
+        # Only the row groups of the rows are read, then the rows are taken
+        # from them
+        row_groups = np.searchsorted(bounds, rows, side="right") - 1
+        groups = np.unique(row_groups)
+        table = file.read_row_groups(groups.tolist(), columns=columns)
+        read_sizes = bounds[groups + 1] - bounds[groups]
+        offsets = np.cumsum(read_sizes) - read_sizes
+        offsets = offsets[np.searchsorted(groups, row_groups)]
+        return table.take(rows - bounds[row_groups] + offsets).to_pandas()
@@ -0,0 +1,344 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+SHAPE: per Local Authority pipeline
+Created on Sunday October 18 2026
+@author: patricia-ternes
+"""
+from collections import Counter, deque
+import multiprocessing
+import time
+import traceback
+import warnings
+import pandas as pd
+
+try:
+    from .instrumentation import collect
+except ImportError:
+    from instrumentation import collect
+
+# Objects shared with the worker processes.
+# They are set once per worker by `_init_worker`. With the "fork" start method
+# the pool initializer arguments are inherited by the child processes instead
+# of being pickled, so the national EPC and SPENSER frames are shared
+# copy-on-write and only the LAD code travels with each task (plus the LAD
+# EPC partition when the certificates are streamed).
+_shared = {}
+
+
+def _init_worker(epc, spenser, psm, checkpoint=None):
+    """Store the pipeline objects in the worker process.
+
+    :param epc: EPC data and related methods.
+    :type epc: data_preparation.Epc
+    :param spenser: SPENSER data and related methods.
+    :type spenser: data_preparation.Spenser
+    :param psm: Propensity Score Matching methods.
+    :type psm: enriching_population.EnrichingPopulation
+    :param checkpoint: Saved results of the completed Local Authorities,
+        defaults to None.
+    :type checkpoint: checkpoint.Checkpoint, optional
+    """
+    _shared["epc"] = epc
+    _shared["spenser"] = spenser
+    _shared["psm"] = psm
+    _shared["checkpoint"] = checkpoint
+
+
+def get_lad_inputs(lad_code, epc, spenser, epc_lad_df=None):
+    """Return the raw EPC and SPENSER data of a Local Authority.
+
+    :param lad_code: Local authority district code.
+    :type lad_code: string
+    :param epc: EPC data and related methods.
+    :type epc: data_preparation.Epc
+    :param spenser: SPENSER data and related methods.
+    :type spenser: data_preparation.Spenser
+    :param epc_lad_df: Raw EPC data of the Local Authority; if `None`, it is
+        taken from `epc.get_lad_dataframe`, defaults to None.
+    :type epc_lad_df: pandas.DataFrame, optional
+    :return: EPC and SPENSER data of the Local Authority
+    :rtype: pandas.DataFrame, pandas.DataFrame
+    """
+    # The national frames are not modified: `reset_index` copies the Local
+    # Authority rows
+    if epc_lad_df is None:
+        epc_lad_df = epc.get_lad_dataframe(lad_code)
+    epc_lad_df = drop_unused_categories(epc_lad_df.reset_index(drop=True))
+    spenser_lad_df = spenser.get_lad_dataframe(lad_code).reset_index(drop=True)
+    spenser_lad_df = drop_unused_categories(spenser_lad_df)
+
+    return epc_lad_df, spenser_lad_df
+
+
+def drop_unused_categories(df) -> pd.DataFrame:
+    """Keep only the categories used by a Local Authority (in place).
+
+    The categorical columns of the national frames have the categories of
+    the whole country (e.g. every Output Area).
+
+    :param df: Local Authority data
+    :type df: pandas.DataFrame
+    :return: the same dataframe
+    :rtype: pandas.DataFrame
+    """
+    for column in df.select_dtypes("category").columns:
+        df[column] = df[column].cat.remove_unused_categories()
+    return df
+
+
+def process_lad(lad_code, epc, spenser, psm, epc_lad_df=None, spenser_lad_df=None):
+    """Enrich the SPENSER population of a single Local Authority.
+
+    :param lad_code: Local authority district code.
+    :type lad_code: string
+    :param epc: EPC data and related methods.
+    :type epc: data_preparation.Epc
+    :param spenser: SPENSER data and related methods.
+    :type spenser: data_preparation.Spenser
+    :param psm: Propensity Score Matching methods.
+    :type psm: enriching_population.EnrichingPopulation
+    :param epc_lad_df: Raw EPC data of the Local Authority; if `None`, it is
+        taken from `epc.get_lad_dataframe`, defaults to None.
+    :type epc_lad_df: pandas.DataFrame, optional
+    :param spenser_lad_df: Raw SPENSER data of the Local Authority, already
+        returned by `get_lad_inputs` with `epc_lad_df`, defaults to None.
+    :type spenser_lad_df: pandas.DataFrame, optional
+    :return: Enriched population and processed EPC data
+    :rtype: pandas.DataFrame, pandas.DataFrame
+    """
+    # SPENSER and EPC per Local Authority
+    if spenser_lad_df is None:
+        epc_lad_df, spenser_lad_df = get_lad_inputs(
+            lad_code, epc, spenser, epc_lad_df
+        )
+
+    # SPENSER and EPC data preparation main steps.
+    epc_lad_df = epc.step(epc_lad_df)
+    spenser_lad_df = spenser.step(spenser_lad_df)
+
+    # Combine SPENSER and EPC to get an Enriched Population
+    # (each Local Authority has its own random stream, see `get_rng`)
+    rich_df = psm.step(spenser_lad_df, epc_lad_df, psm.get_rng(lad_code))
+
+    return rich_df, epc_lad_df
+
+
+def _process_lad_task(task):
+    """Pool task: run `process_lad` with the worker shared objects.
+
+    :param task: LAD code and raw EPC data of the Local Authority (`None` to
+        take it from the shared EPC dataframe).
+    :type task: tuple
+    :return: LAD code, results (`None` if the Local Authority failed, see
+        `run_lads`) and telemetry (see `instrumentation.RunReport.add`)
+    :rtype: string, dict, dict
+    """
+    lad_code, epc_lad_df = task
+    start = time.perf_counter()
+    with collect(lad_code) as stages:
+        try:
+            result = _run_lad(lad_code, epc_lad_df)
+            error = None
+        except Exception as exception:
+            result = None
+            error = _format_error(exception)
+
+    if result is None:
+        status = "failed"
+    else:
+        status = "resumed" if result["resumed"] else "done"
+    telemetry = {
+        "status": status,
+        "seconds": time.perf_counter() - start,
+        "stages": stages,
+        "error": error,
+    }
+    if result is not None and "checkpoint_error" in result:
+        telemetry["checkpoint_error"] = result.pop("checkpoint_error")
+    return lad_code, result, telemetry
+
+
+def _format_error(exception) -> dict:
+    """Return the run report entry of an exception being handled.
+
+    :param exception: handled exception
+    :type exception: Exception
+    :return: exception type, message and traceback
+    :rtype: dict
+    """
+    return {
+        "type": type(exception).__name__,
+        "message": str(exception),
+        "traceback": traceback.format_exc(),
+    }
+
+
+def _run_lad(lad_code, epc_lad_df):
+    """Run (or load from the checkpoint) a Local Authority.
+
+    :param lad_code: Local authority district code.
+    :type lad_code: string
+    :param epc_lad_df: Raw EPC data of the Local Authority (`None` to take it
+        from the shared EPC dataframe).
+    :type epc_lad_df: pandas.DataFrame
+    :return: results, see `run_lads`
+    :rtype: dict
+    """
+    epc = _shared["epc"]
+    spenser = _shared["spenser"]
+    checkpoint = _shared.get("checkpoint")
+    lookup_misses = Counter(epc.lookup_misses)
+
+    epc_lad_df, spenser_lad_df = get_lad_inputs(lad_code, epc, spenser, epc_lad_df)
+
+    # Saved result of a previous run, if the inputs did not change
+    key = None
+    if checkpoint is not None:
+        key = checkpoint.get_key(epc_lad_df, spenser_lad_df)
+        result = checkpoint.load(lad_code, key)
+        if result is not None:
+            return result
+
+    rich_df, epc_lad_df = process_lad(
+        lad_code, epc, spenser, _shared["psm"], epc_lad_df, spenser_lad_df
+    )
+
+    # rows discarded by the EPC lookups of this Local Authority
+    lookup_misses = Counter(epc.lookup_misses) - lookup_misses
+
+    result = {
+        "shape": rich_df,
+        "epc": epc_lad_df,
+        "lookup_misses": dict(lookup_misses),
+        "resumed": False,
+    }
+    if checkpoint is not None:
+        try:
+            checkpoint.save(lad_code, result)
+            result["key"] = key
+        except Exception as exception:
+            # the Local Authority will run again next time (the error is
+            # added to the run report, see `_process_lad_task`)
+            result["checkpoint_error"] = _format_error(exception)
+
+    return result
+
+
+def run_lads(
+    lad_codes,
+    epc,
+    spenser,
+    psm,
+    workers=1,
+    epc_lads=None,
+    checkpoint=None,
+    report=None,
+):
+    """Run the pipeline for a list of Local Authorities.
+
+    With `workers` > 1, the Local Authorities are sent to a process pool.
+    Results are always yielded in the task order, whatever the order in which
+    the workers finish, and at most two tasks per worker are queued at a time.
+
+    :param lad_codes: Local authority district codes.
+    :type lad_codes: list
+    :param epc: EPC data and related methods.
+    :type epc: data_preparation.Epc
+    :param spenser: SPENSER data and related methods.
+    :type spenser: data_preparation.Spenser
+    :param psm: Propensity Score Matching methods.
+    :type psm: enriching_population.EnrichingPopulation
+    :param workers: Number of worker processes, defaults to 1.
+    :type workers: int, optional
+    :param epc_lads: (LAD code, raw EPC data) pairs, e.g. from
+        `Epc.iter_lad_dataframes`. If given, the Local Authorities are run in
+        this order, and the `lad_codes` missing from it are reported as failed
+        at the end, defaults to None.
+    :type epc_lads: iterable, optional
+    :param checkpoint: Saved results: the Local Authorities whose inputs did
+        not change are loaded instead of run, and the new results are saved
+        (see `checkpoint.Checkpoint.record` to complete them), defaults to
+        None.
+    :type checkpoint: checkpoint.Checkpoint, optional
+    :param report: Run report where the telemetry of each Local Authority
+        (stages, errors, checkpoint save errors) is added, with the state of
+        the checkpoint ("enabled" or "disabled"), defaults to None. A
+        checkpoint save error is also issued as a warning, and a disabled
+        checkpoint is printed.
+    :type report: instrumentation.RunReport, optional
+    :return: For each LAD code, the LAD code and its results (`None` if the
+        Local Authority failed): a dict with the enriched population
+        ("shape"), the processed EPC data ("epc") and the number of EPC rows
+        discarded by each lookup ("lookup_misses"), whether it was loaded
+        from the checkpoint ("resumed") and its checkpoint key ("key", only
+        if it was saved).
+    :rtype: generator
+    """
+    if epc_lads is None:
+        tasks = ((lad_code, None) for lad_code in lad_codes)
+    else:
+        requested = set(lad_codes)
+        tasks = (task for task in epc_lads if task[0] in requested)
+
+    if checkpoint is not None:
+        if report is not None:
+            report.checkpoint = "enabled" if checkpoint.enabled else "disabled"
+        if not checkpoint.enabled:
+            print(
+                "Checkpoint disabled (pyarrow is not installed): the Local "
+                "Authorities are not saved and will run again next time"
+            )
+
+    done = set()
+    shared = (epc, spenser, psm, checkpoint)
+    for lad_code, result, telemetry in _run_tasks(tasks, shared, workers):
+        done.add(lad_code)
+        if report is not None:
+            report.add(lad_code, telemetry)
+        if telemetry.get("checkpoint_error"):
+            error = telemetry["checkpoint_error"]
+            warnings.warn(
+                f"Checkpoint not saved for {lad_code}: "
+                f"{error['type']}: {error['message']}"
+            )
+        yield lad_code, result
+
+    for lad_code in lad_codes:
+        if lad_code not in done:
+            if report is not None:
+                error = {"type": "MissingData", "message": "no EPC data"}
+                report.add(lad_code, {"status": "failed", "error": error})
+            yield lad_code, None
+
+
+def _run_tasks(tasks, shared, workers):
+    """Run `_process_lad_task` on all tasks, keeping the tasks order.
+
+    :param tasks: (LAD code, raw EPC data) pairs.
+    :type tasks: iterable
+    :param shared: `_init_worker` arguments (EPC, SPENSER, Propensity Score
+        Matching and checkpoint objects).
+    :type shared: tuple
+    :param workers: Number of worker processes.
+    :type workers: int
+    :return: `_process_lad_task` results
+    :rtype: generator
+    """
+    if workers <= 1:
+        _init_worker(*shared)
+        for task in tasks:
+            yield _process_lad_task(task)
+        return
+
+    context = multiprocessing.get_context("fork")
+    with context.Pool(workers, initializer=_init_worker, initargs=shared) as pool:
+        # Bounded submission: `Pool.imap` would consume (and read) all the
+        # streamed EPC partitions up front.
+        queue = deque()
+        for task in tasks:
+            queue.append(pool.apply_async(_process_lad_task, (task,)))
+            if len(queue) >= 2 * workers:
+                yield queue.popleft().get()
+        while queue:
+            yield queue.popleft().get()
@@ -0,0 +1,321 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+SHAPE: propensity score estimators
+Created on Sunday October 18 2026
+@author: patricia-ternes
+"""
+from itertools import combinations_with_replacement
+import numpy as np
+
+
+class CausalModelPropensity:
+    """Propensity score estimated with `causalinference.CausalModel`.
+
+    The logistic regression terms are selected with the algorithm suggested
+    by Imbens & Rubin (`CausalModel.est_propensity_s`).
+    """
+
+    @staticmethod
+    def fit_predict(df, overlap_columns, treatment="Treatment") -> np.ndarray:
+        """Return the propensity score values.
+
+        :param df: complete dataframe
+        :type df: pandas.DataFrame
+        :param overlap_columns: list of columns names that are present in both
+            datasets (EPC and SPENSER).
+        :type overlap_columns: list
+        :param treatment: Treatment column name, defaults to "Treatment".
+        :type treatment: string, optional
+        :return: propensity score for all rows.
+        :rtype: numpy.ndarray
+        """
+        from causalinference import CausalModel
+
+        ## Isolate the Y, X and the covariates
+        Y = df[treatment].copy()  # 1-Dimension outcome - arbitrary values
+        X = df[treatment].copy()  # 1-Dimension treatment
+        C = df[overlap_columns].copy()  # n-Dimension covariates
+
+        # Transform pandas dataframe into numpy.ndarray (CausalModel requisite)
+        Y = Y.values
+        X = X.values
+        C = C.values
+        if C.dtype.kind in "iu":
+            # compact integer codes could overflow in the quadratic terms
+            C = C.astype(np.int64)
+
+        # Create the Causal Model
+        model = CausalModel(Y, X, C)
+
+        # Propensity score calculation
+        model.est_propensity_s()
+        return model.propensity["fitted"]
+
+
+class LogitPropensity:
+    """Propensity score estimated with a vectorized logistic regression.
+
+    The covariates are small discrete codes, so the rows are first collapsed
+    into unique covariate cells, with the number of treated and control rows
+    of each cell as weights. The regression is then fitted on the cells by
+    Newton-Raphson, which gives the same maximum likelihood estimate as a
+    fit on the rows.
+
+    By default the regression terms are selected as in `CausalModelPropensity`
+    (Imbens & Rubin likelihood ratio tests on linear and quadratic terms).
+    Columns listed in `categorical` are instead included as one-hot
+    categories (stored as a sparse matrix), together with the other columns
+    as linear terms and without term selection.
+    """
+
+    def __init__(
+        self, select=True, categorical=None, C_lin=1, C_qua=2.71, max_iter=100
+    ) -> None:
+        """Initialise a LogitPropensity class.
+
+        :param select: Select the linear and quadratic terms by likelihood
+            ratio tests (otherwise, all columns are included linearly),
+            defaults to True.
+        :type select: bool, optional
+        :param categorical: Columns included as one-hot categories, defaults
+            to None.
+        :type categorical: list, optional
+        :param C_lin: Critical value of the linear terms tests, defaults to 1.
+        :type C_lin: float, optional
+        :param C_qua: Critical value of the quadratic terms tests, defaults
+            to 2.71.
+        :type C_qua: float, optional
+        :param max_iter: Maximum number of Newton-Raphson iterations, defaults
+            to 100.
+        :type max_iter: int, optional
+        """
+        self.select = select
+        self.categorical = list(categorical or [])
+        self.C_lin = C_lin
+        self.C_qua = C_qua
+        self.max_iter = max_iter
+
+    @staticmethod
+    def get_cells(columns, treated):
+        """Collapse the rows into unique covariate cells.
+
+        The covariate columns are read one at a time (no covariate matrix is
+        built for the rows).
+
+        :param columns: covariate arrays, one per column
+        :type columns: list
+        :param treated: treatment array (0 or 1)
+        :type treated: numpy.ndarray
+        :return: cell of each row, covariate values of each cell (one array
+            per column), number of treated rows and number of rows per cell
+        :rtype: numpy.ndarray, list, numpy.ndarray, numpy.ndarray
+        """
+        key = np.zeros(len(treated), dtype=np.int64)
+        for column in columns:
+            uniques, codes = np.unique(column, return_inverse=True)
+            key = key * len(uniques) + codes
+
+        _, first, cell = np.unique(key, return_index=True, return_inverse=True)
+        n_treated = np.bincount(cell, weights=treated, minlength=len(first))
+        n_rows = np.bincount(cell, minlength=len(first)).astype(float)
+        values = [np.asarray(column)[first] for column in columns]
+
+        return cell, values, n_treated, n_rows
+
+    @staticmethod
+    def form_matrix(values, lin, qua) -> np.ndarray:
+        """Return the design matrix: constant, linear and quadratic terms.
+
+        :param values: covariate values, one array per column
+        :type values: list
+        :param lin: columns included linearly
+        :type lin: list
+        :param qua: pairs of columns included as products
+        :type qua: list
+        :return: design matrix
+        :rtype: numpy.ndarray
+        """
+        terms = [np.ones(len(values[0]))]
+        terms += [values[i].astype(float) for i in lin]
+        terms += [values[i] * values[j].astype(float) for i, j in qua]
+        return np.column_stack(terms)
+
+    def fit(self, Z, n_treated, n_rows):
+        """Fit the logistic regression on weighted cells (Newton-Raphson).
+
+        :param Z: design matrix (dense or sparse) of the cells
+        :type Z: numpy.ndarray or scipy.sparse.spmatrix
+        :param n_treated: number of treated rows per cell
+        :type n_treated: numpy.ndarray
+        :param n_rows: number of rows per cell
+        :type n_rows: numpy.ndarray
+        :return: coefficients and maximized log-likelihood
+        :rtype: numpy.ndarray, float
+        """
+        n_control = n_rows - n_treated
+
+        def loglike(beta):
+            eta = Z @ beta
+            return -(
+                n_treated @ np.logaddexp(0, -eta) + n_control @ np.logaddexp(0, eta)
+            )
+
+        beta = np.zeros(Z.shape[1])
+        current = loglike(beta)
+        for _ in range(self.max_iter):
+            fitted = sigmoid(Z @ beta)
+            gradient = Z.T @ (n_treated - n_rows * fitted)
+            weight = (n_rows * fitted * (1 - fitted))[:, None]
+            if hasattr(Z, "toarray"):
+                hessian = (Z.T @ Z.multiply(weight)).toarray()
+            else:
+                hessian = Z.T @ (Z * weight)
+            # small ridge: separated cells have infinite coefficients
+            hessian[np.diag_indices_from(hessian)] += 1e-9
+            step = np.linalg.solve(hessian, gradient)
+
+            # step halving
+            for _ in range(30):
+                candidate = loglike(beta + step)
+                if candidate >= current:
+                    break
+                step /= 2
+            else:
+                break
+            beta = beta + step
+            improvement = candidate - current
+            current = candidate
+            if improvement < 1e-10 * (1 + abs(current)):
+                break
+
+        return beta, current
+
+    def select_terms(self, values, n_treated, n_rows):
+        """Select the linear and quadratic terms by likelihood ratio tests.
+
+        Same algorithm as `causalinference.CausalModel.est_propensity_s`.
+
+        :param values: covariate values of the cells, one array per column
+        :type values: list
+        :param n_treated: number of treated rows per cell
+        :type n_treated: numpy.ndarray
+        :param n_rows: number of rows per cell
+        :type n_rows: numpy.ndarray
+        :return: linear terms and quadratic terms
+        :rtype: list, list
+        """
+
+        def loglike(lin, qua):
+            return self.fit(self.form_matrix(values, lin, qua), n_treated, n_rows)[1]
+
+        def extend(candidates, critical, test):
+            chosen = []
+            null = test(chosen)
+            while True:
+                excluded = [term for term in candidates if term not in chosen]
+                if not excluded:
+                    return chosen
+                alternatives = [test(chosen + [term]) for term in excluded]
+                best = int(np.argmax(alternatives))
+                if 2 * (alternatives[best] - null) < critical:
+                    return chosen
+                chosen.append(excluded[best])
+                null = alternatives[best]
+
+        lin = extend(
+            range(len(values)), self.C_lin, lambda terms: loglike(terms, [])
+        )
+        qua = extend(
+            list(combinations_with_replacement(lin, 2)),
+            self.C_qua,
+            lambda terms: loglike(lin, terms),
+        )
+        return lin, qua
+
+    def fit_predict(self, df, overlap_columns, treatment="Treatment") -> np.ndarray:
+        """Return the propensity score values.
+
+        :param df: complete dataframe
+        :type df: pandas.DataFrame
+        :param overlap_columns: list of columns names that are present in both
+            datasets (EPC and SPENSER).
+        :type overlap_columns: list
+        :param treatment: Treatment column name, defaults to "Treatment".
+        :type treatment: string, optional
+        :return: propensity score for all rows.
+        :rtype: numpy.ndarray
+        """
+        columns = [df[column].to_numpy() for column in overlap_columns]
+        treated = df[treatment].to_numpy()
+        cell, values, n_treated, n_rows = self.get_cells(columns, treated)
+
+        if self.categorical:
+            Z = self.form_sparse_matrix(values, overlap_columns)
+        elif self.select:
+            Z = self.form_matrix(values, *self.select_terms(values, n_treated, n_rows))
+        else:
+            Z = self.form_matrix(values, list(range(len(values))), [])
+
+        beta, _ = self.fit(Z, n_treated, n_rows)
+        return sigmoid(Z @ beta)[cell]
+
+    def form_sparse_matrix(self, values, overlap_columns):
+        """Return the design matrix with one-hot categorical columns.
+
+        :param values: covariate values of the cells, one array per column
+        :type values: list
+        :param overlap_columns: covariate column names
+        :type overlap_columns: list
+        :return: sparse design matrix
+        :rtype: scipy.sparse.csr_matrix
+        """
+        from scipy import sparse
+
+        lin = [
+            i for i, column in enumerate(overlap_columns)
+            if column not in self.categorical
+        ]
+        blocks = [sparse.csr_matrix(self.form_matrix(values, lin, []))]
+        for i, column in enumerate(overlap_columns):
+            if column not in self.categorical:
+                continue
+            # one column per category, except the first one (reference)
+            _, codes = np.unique(values[i], return_inverse=True)
+            n_levels = codes.max() + 1
+            one_hot = sparse.csr_matrix(
+                (np.ones(len(codes)), (np.arange(len(codes)), codes)),
+                shape=(len(codes), n_levels),
+            )
+            blocks.append(one_hot[:, 1:])
+
+        return sparse.hstack(blocks, format="csr")
+
+
+def sigmoid(x) -> np.ndarray:
+    """Numerically stable logistic function.
+
+    :param x: linear predictor
+    :type x: numpy.ndarray
+    :return: probabilities
+    :rtype: numpy.ndarray
+    """
+    return 0.5 * (1 + np.tanh(0.5 * np.asarray(x)))
+
+
+def get_estimator(name, categorical=None):
+    """Return a propensity score estimator.
+
+    :param name: "causalinference" or "logit".
+    :type name: string
+    :param categorical: Columns included as one-hot categories ("logit"
+        only), defaults to None.
+    :type categorical: list, optional
+    :return: estimator with a `fit_predict(df, overlap_columns)` method
+    :rtype: CausalModelPropensity or LogitPropensity
+    """
+    if name == "causalinference":
+        return CausalModelPropensity()
+    if name == "logit":
+        return LogitPropensity(categorical=categorical)
+    raise ValueError(f"Unknown propensity score estimator: {name}")
@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+SHAPE: configuration
+Created on Sunday October 18 2026
+@author: patricia-ternes
+"""
+from importlib.util import find_spec
+import os
+from types import MappingProxyType
+import zipfile
+import yaml
+
+# Keys of "config/config.yaml": accepted types and whether the key is required
+# (the defaults of the optional keys are set where they are used)
+SCHEMA = {
+    "cache_dir": ((str,), False),
+    "checkpoint_dir": ((str,), False),
+    "lad_cache_size": ((int,), False),
+    "read_workers": ((int, type(None)), False),
+    "output_compression": ((str,), False),
+    "output_compression_level": ((int, type(None)), False),
+    "output_parquet": ((bool,), False),
+    "output_row_group_size": ((int,), False),
+    "epc_path": ((str,), True),
+    "epc_headers": ((list,), True),
+    "spenser_path": ((str,), True),
+    "drop_list": ((list,), True),
+    "n_neighbors": ((int,), True),
+    "propensity_estimator": ((str,), False),
+    "propensity_categorical": ((list, type(None)), False),
+    "neighbors_backend": ((str,), False),
+    "match_cells": ((bool,), False),
+    "seed": ((int, type(None)), False),
+    "n_realisations": ((int,), False),
+    "overlap_columns": ((list,), True),
+    "matches_columns": ((list,), True),
+}
+
+# Zip member compression methods of the outputs
+COMPRESSION = {
+    "stored": zipfile.ZIP_STORED,
+    "deflate": zipfile.ZIP_DEFLATED,
+    "bzip2": zipfile.ZIP_BZIP2,
+    "lzma": zipfile.ZIP_LZMA,
+}
+# Zstandard zip members need Python >= 3.14
+if hasattr(zipfile, "ZIP_ZSTANDARD"):
+    COMPRESSION["zstd"] = zipfile.ZIP_ZSTANDARD
+
+# Accepted values of the string keys
+CHOICES = {
+    "neighbors_backend": ["sklearn", "sorted"],
+    "output_compression": list(COMPRESSION),
+    "propensity_estimator": ["causalinference", "logit"],
+}
+
+# Parsed files, by path (reparsed when the file changes)
+_parsed = {}
+_validated = {}
+
+
+def read_yaml(path) -> MappingProxyType:
+    """Return a parsed YAML file, parsing it only once.
+
+    The file is parsed again if it changed (modification time or size).
+
+    :param path: YAML file location
+    :type path: string
+    :return: parsed file (read-only, shared: do not modify its values)
+    :rtype: types.MappingProxyType
+    """
+    stat = os.stat(path)
+    key = os.path.abspath(path)
+    version = (stat.st_mtime_ns, stat.st_size)
+    if key not in _parsed or _parsed[key][0] != version:
+        with open(path) as yaml_file:
+            parsed = yaml.load(yaml_file, Loader=yaml.FullLoader) or {}
+        _parsed[key] = (version, MappingProxyType(parsed))
+    return _parsed[key][1]
+
+
+def validate_config(parsed) -> None:
+    """Check the keys, types and values of a parsed "config/config.yaml" file.
+
+    :param parsed: parsed configuration
+    :type parsed: Mapping
+    :raises ValueError: unknown or missing keys, values of the wrong type or
+        not accepted (see `CHOICES`), "propensity_categorical" columns
+        missing from "overlap_columns", or "output_parquet" without pyarrow
+    """
+    errors = [f"unknown key {key!r}" for key in parsed if key not in SCHEMA]
+    for key, (types, required) in SCHEMA.items():
+        if key not in parsed:
+            if required:
+                errors.append(f"missing key {key!r}")
+            continue
+        value = parsed[key]
+        # booleans are integers in Python
+        if not isinstance(value, types) or (
+            isinstance(value, bool) and bool not in types
+        ):
+            names = " or ".join(
+                "null" if kind is type(None) else kind.__name__ for kind in types
+            )
+            errors.append(f"{key!r} must be {names}, not {value!r}")
+            continue
+
+        choices = CHOICES.get(key)
+        if choices is not None and value not in choices:
+            names = ", ".join(repr(choice) for choice in choices)
+            errors.append(f"{key!r} must be one of {names}, not {value!r}")
+
+    categorical = parsed.get("propensity_categorical") or []
+    overlap_columns = parsed.get("overlap_columns")
+    if isinstance(categorical, list) and isinstance(overlap_columns, list):
+        missing = [column for column in categorical if column not in overlap_columns]
+        if missing:
+            errors.append(
+                f"'propensity_categorical' columns {missing!r} are not in "
+                "'overlap_columns'"
+            )
+    # otherwise the run fails at the first Parquet write, after the matching
+    # (pyarrow is looked up without importing it)
+    if parsed.get("output_parquet") is True and find_spec("pyarrow") is None:
+        errors.append("'output_parquet' needs pyarrow, which is not installed")
+    if errors:
+        raise ValueError("Invalid configuration: " + "; ".join(errors))
+
+
+def load_config(path="config/config.yaml") -> MappingProxyType:
+    """Return the validated configuration, shared by all the SHAPE classes.
+
+    The file is parsed and validated once (again only if it changes).
+
+    :param path: configuration file, defaults to "config/config.yaml".
+    :type path: string, optional
+    :return: configuration (read-only, shared: do not modify its values)
+    :rtype: types.MappingProxyType
+    :raises ValueError: invalid configuration (see `validate_config`)
+    """
+    parsed = read_yaml(path)
+    key = os.path.abspath(path)
+    if _validated.get(key) is not parsed:
+        validate_config(parsed)
+        _validated[key] = parsed
+    return parsed
+
+
+def load_lookups(path="config/lookups.yaml") -> MappingProxyType:
+    """Return the parsed lookups file, shared by all the SHAPE classes.
+
+    :param path: lookups file, defaults to "config/lookups.yaml".
+    :type path: string, optional
+    :return: lookups (read-only, shared: do not modify its values)
+    :rtype: types.MappingProxyType
+    """
+    return read_yaml(path)
@@ -0,0 +1,395 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+SHAPE: synthetic input data
+Created on Sunday October 18 2026
+@author: patricia-ternes
+
+Write fake (but structurally realistic) SHAPE inputs, so the pipeline can
+be tested and benchmarked offline:
+
+- `all-domestic-certificates.zip`: one `domestic-<LAD code>-<LAD name>`
+  folder per Local Authority, an unknown local authority folder and a
+  Welsh folder (discarded by SHAPE);
+- `msm_england.zip`: one household and one person file per Local Authority;
+- `PCD_OA_LSOA_MSOA_LAD_FEB22_UK_LU.zip`: postcode lookup, with a Scottish
+  postcode (discarded by SHAPE).
+
+Usage (from the repository root):
+
+    $ python shape/synthetic.py --scale region --directory /tmp/shape/data/input/
+"""
+from argparse import ArgumentParser
+import io
+import os
+import time
+import zipfile
+import numpy as np
+import pandas as pd
+
+# Input sizes: "lad" is a small Local Authority, "national" is close to the
+# size of England (~170,000 OAs, ~24 million households and certificates)
+SCALES = {
+    "lad": {
+        "n_lads": 1,
+        "oas_per_lad": 20,
+        "postcodes_per_oa": 5,
+        "households_per_oa": 60,
+        "certificates_per_oa": 50,
+    },
+    "region": {
+        "n_lads": 30,
+        "oas_per_lad": 550,
+        "postcodes_per_oa": 9,
+        "households_per_oa": 140,
+        "certificates_per_oa": 140,
+    },
+    "national": {
+        "n_lads": 309,
+        "oas_per_lad": 550,
+        "postcodes_per_oa": 9,
+        "households_per_oa": 140,
+        "certificates_per_oa": 140,
+    },
+}
+
+# EPC values, as found in the certificates (including invalid ones)
+PROPERTY_TYPES = ["House", "Bungalow", "Flat", "Maisonette", "Park home"]
+BUILT_FORMS = {
+    "Detached": 0.25,
+    "Semi-Detached": 0.3,
+    "Mid-Terrace": 0.2,
+    "End-Terrace": 0.15,
+    "Enclosed Mid-Terrace": 0.05,
+    "NO DATA!": 0.05,
+}
+AGE_BANDS = {
+    "England and Wales: before 1900": 0.15,
+    "England and Wales: 1900-1929": 0.1,
+    "England and Wales: 1930-1949": 0.15,
+    "England and Wales: 1950-1966": 0.15,
+    "England and Wales: 1967-1975": 0.1,
+    "England and Wales: 1983-1990": 0.1,
+    "England and Wales: 2007 onwards": 0.1,
+    "NO DATA!": 0.05,
+    "INVALID!": 0.05,
+    "1995": 0.05,
+}
+TENURES = {
+    "Owner-occupied": 0.45,
+    "owner-occupied": 0.05,
+    "rental (social)": 0.2,
+    "Rented (private)": 0.2,
+    "unknown": 0.05,
+    "NO DATA!": 0.05,
+}
+GAS_FLAGS = {"Y": 0.8, "N": 0.15, None: 0.05}
+
+# SPENSER household file columns
+SPENSER_COLUMNS = [
+    "HID",
+    "Area",
+    "LC4402_C_TYPACCOM",
+    "QS420_CELL",
+    "LC4402_C_TENHUK11",
+    "LC4408_C_AHTHUK11",
+    "CommunalSize",
+    "LC4404_C_SIZHUK11",
+    "LC4404_C_ROOMS",
+    "LC4405EW_C_BEDROOMS",
+    "LC4408EW_C_PPBROOMHEW11",
+    "LC4402_C_CENHEATHUK11",
+    "LC4605_C_NSSEC",
+    "LC4202_C_ETHHUK11",
+    "LC4202_C_CARSNO",
+    "HRPID",
+    "FILLED",
+]
+
+
+def letters(number, length=2) -> str:
+    """Return a fixed length upper case code of a number (0 is "AA...A").
+
+    :param number: non-negative number, below `26 ** length`
+    :type number: int
+    :param length: code length, defaults to 2.
+    :type length: int, optional
+    :rtype: string
+    """
+    code = ""
+    for _ in range(length):
+        number, remainder = divmod(number, 26)
+        code = chr(65 + remainder) + code
+    return code
+
+
+def choice(rng, options, n):
+    """Draw `n` values from a list (uniform) or a dict (value: probability).
+
+    :param rng: random number generator
+    :type rng: numpy.random.Generator
+    :param options: values, or values and probabilities
+    :type options: list or dict
+    :param n: number of values
+    :type n: int
+    :rtype: numpy.ndarray
+    """
+    if isinstance(options, dict):
+        values = np.array(list(options), dtype=object)
+        p = np.array(list(options.values()), dtype=float)
+        return values[rng.choice(len(values), n, p=p / p.sum())]
+    return np.array(options, dtype=object)[rng.integers(0, len(options), n)]
+
+
+def write_csv(zip_file, name, df):
+    """Write a dataframe as a CSV member of a zip file.
+
+    :param zip_file: zip file (write mode)
+    :type zip_file: zipfile.ZipFile
+    :param name: member name
+    :type name: string
+    :param df: dataframe
+    :type df: pandas.DataFrame
+    """
+    info = zipfile.ZipInfo(name, date_time=time.localtime()[:6])
+    info.compress_type = zip_file.compression
+    with zip_file.open(info, "w", force_zip64=True) as member:
+        with io.TextIOWrapper(member, encoding="utf-8", newline="") as csv_file:
+            df.to_csv(csv_file, index=False)
+
+
+def get_lads(n_lads) -> pd.DataFrame:
+    """Return the synthetic Local Authorities codes and names.
+
+    :param n_lads: number of Local Authorities (at most 676)
+    :type n_lads: int
+    :rtype: pandas.DataFrame
+    """
+    return pd.DataFrame(
+        {
+            "ladcd": [f"E06{i + 1:06d}" for i in range(n_lads)],
+            "ladnm": [f"Synthetic LAD {i + 1}" for i in range(n_lads)],
+        }
+    )
+
+
+def get_area_lookup(lads, oas_per_lad, postcodes_per_oa) -> pd.DataFrame:
+    """Return the postcode lookup of the synthetic Local Authorities.
+
+    Postcodes look like "AB12 3CD": the area is given by the Local
+    Authority, the district and sector by the Output Area and the unit by
+    the postcode number.
+
+    :param lads: Local Authorities (see `get_lads`)
+    :type lads: pandas.DataFrame
+    :param oas_per_lad: Output Areas per Local Authority (at most 1000)
+    :type oas_per_lad: int
+    :param postcodes_per_oa: postcodes per Output Area (at most 676)
+    :type postcodes_per_oa: int
+    :return: "pcds", "oa11cd", "lsoa11cd", "msoa11cd", "ladcd" and "ladnm"
+    :rtype: pandas.DataFrame
+    """
+    n_oas = len(lads) * oas_per_lad
+    lad = np.repeat(np.arange(len(lads)), oas_per_lad * postcodes_per_oa)
+    oa = np.repeat(np.arange(n_oas) % oas_per_lad, postcodes_per_oa)
+    unit = np.tile(np.arange(postcodes_per_oa), n_oas)
+
+    areas = np.array([letters(i) for i in range(len(lads))], dtype=object)
+    units = np.array([letters(i) for i in range(postcodes_per_oa)], dtype=object)
+    pcds = (
+        areas[lad]
+        + (oa // 10).astype(str).astype(object)
+        + " "
+        + (oa % 10).astype(str).astype(object)
+        + units[unit]
+    )
+    oa11cd = pd.Series(lad * 1000 + oa).map("E00{:06d}".format)
+    return pd.DataFrame(
+        {
+            "pcds": pcds,
+            "oa11cd": oa11cd,
+            "lsoa11cd": pd.Series(lad * 1000 + oa // 5).map("E01{:06d}".format),
+            "msoa11cd": pd.Series(lad * 1000 + oa // 25).map("E02{:06d}".format),
+            "ladcd": lads.ladcd.to_numpy()[lad],
+            "ladnm": lads.ladnm.to_numpy()[lad],
+        }
+    )
+
+
+def get_certificates(postcodes, n, first_brn, rng) -> pd.DataFrame:
+    """Return synthetic EPC certificates.
+
+    As in the real data, many buildings have more than one certificate
+    (see `Epc.remove_duplicates`).
+
+    :param postcodes: postcodes of the certificates
+    :type postcodes: numpy.ndarray
+    :param n: number of certificates
+    :type n: int
+    :param first_brn: first building reference number
+    :type first_brn: int
+    :param rng: random number generator
+    :type rng: numpy.random.Generator
+    :rtype: pandas.DataFrame
+    """
+    dates = pd.to_datetime(rng.integers(1.2e9, 1.65e9, n), unit="s")
+    return pd.DataFrame(
+        {
+            "LMK_KEY": first_brn + np.arange(n),
+            "ADDRESS1": "1 Synthetic Street",
+            "POSTCODE": postcodes[rng.integers(0, len(postcodes), n)],
+            "CURRENT_ENERGY_RATING": choice(rng, list("ABCDEFG"), n),
+            "PROPERTY_TYPE": choice(rng, PROPERTY_TYPES, n),
+            "BUILT_FORM": choice(rng, BUILT_FORMS, n),
+            "INSPECTION_DATE": dates.strftime("%Y-%m-%d"),
+            "CONSTRUCTION_AGE_BAND": choice(rng, AGE_BANDS, n),
+            "TENURE": choice(rng, TENURES, n),
+            "TOTAL_FLOOR_AREA": np.round(rng.gamma(4, 25, n), 2),
+            "MAINS_GAS_FLAG": choice(rng, GAS_FLAGS, n),
+            "BUILDING_REFERENCE_NUMBER": first_brn
+            + rng.integers(0, max(int(n * 0.9), 1), n),
+            "LODGEMENT_DATETIME": dates.strftime("%Y-%m-%d %H:%M:%S"),
+        }
+    )
+
+
+def get_households(oas, households_per_oa, rng) -> pd.DataFrame:
+    """Return a synthetic SPENSER household file.
+
+    :param oas: Output Areas of the Local Authority
+    :type oas: numpy.ndarray
+    :param households_per_oa: households per Output Area
+    :type households_per_oa: int
+    :param rng: random number generator
+    :type rng: numpy.random.Generator
+    :rtype: pandas.DataFrame
+    """
+    n = len(oas) * households_per_oa
+    df = pd.DataFrame({column: rng.integers(1, 5, n) for column in SPENSER_COLUMNS})
+    df["HID"] = np.arange(n)
+    df["Area"] = np.repeat(oas, households_per_oa)
+    df["LC4402_C_TYPACCOM"] = choice(
+        rng, {-1: 0.02, 2: 0.3, 3: 0.3, 4: 0.2, 5: 0.18}, n
+    ).astype(int)
+    df["LC4402_C_TENHUK11"] = choice(
+        rng, {-1: 0.02, 2: 0.3, 3: 0.3, 5: 0.2, 6: 0.18}, n
+    ).astype(int)
+    return df
+
+
+def generate(
+    directory="data/input/",
+    n_lads=1,
+    oas_per_lad=20,
+    postcodes_per_oa=5,
+    households_per_oa=60,
+    certificates_per_oa=50,
+    seed=0,
+    verbose=False,
+):
+    """Write the synthetic EPC, SPENSER and postcode lookup zip files.
+
+    The Local Authorities are generated (and written) one at a time, so the
+    memory used does not depend on the number of Local Authorities.
+
+    :param directory: output folder, defaults to "data/input/".
+    :type directory: string, optional
+    :param n_lads: number of Local Authorities, defaults to 1.
+    :type n_lads: int, optional
+    :param oas_per_lad: Output Areas per Local Authority, defaults to 20.
+    :type oas_per_lad: int, optional
+    :param postcodes_per_oa: postcodes per Output Area, defaults to 5.
+    :type postcodes_per_oa: int, optional
+    :param households_per_oa: SPENSER households per Output Area, defaults
+        to 60.
+    :type households_per_oa: int, optional
+    :param certificates_per_oa: EPC certificates per Output Area, defaults
+        to 50.
+    :type certificates_per_oa: int, optional
+    :param seed: random seed, defaults to 0.
+    :type seed: int, optional
+    :param verbose: print the progress, defaults to False.
+    :type verbose: bool, optional
+    :return: location of the EPC, SPENSER and postcode lookup files
+    :rtype: dict
+    """
+    rng = np.random.default_rng(seed)
+    os.makedirs(directory, exist_ok=True)
+    paths = {
+        "epc_path": os.path.join(directory, "all-domestic-certificates.zip"),
+        "spenser_path": os.path.join(directory, "msm_england.zip"),
+        "area_path": os.path.join(directory, "PCD_OA_LSOA_MSOA_LAD_FEB22_UK_LU.zip"),
+    }
+
+    lads = get_lads(n_lads)
+    area_lookup = get_area_lookup(lads, oas_per_lad, postcodes_per_oa)
+    scotland = pd.DataFrame(
+        [["AB1 0AA", "S00088956", "S01006514", "S02001236", "S12000033", "Aberdeen"]],
+        columns=area_lookup.columns,
+    )
+    with zipfile.ZipFile(paths["area_path"], "w", zipfile.ZIP_DEFLATED, 1) as zip_file:
+        write_csv(
+            zip_file,
+            "PCD_OA_LSOA_MSOA_LAD_FEB22_UK_LU.csv",
+            pd.concat([area_lookup, scotland]),
+        )
+
+    postcodes = area_lookup.groupby("ladcd", sort=False).pcds
+    oas = area_lookup.groupby("ladcd", sort=False).oa11cd
+    n_certificates = oas_per_lad * certificates_per_oa
+    with zipfile.ZipFile(
+        paths["epc_path"], "w", zipfile.ZIP_DEFLATED, 1
+    ) as epc_zip, zipfile.ZipFile(
+        paths["spenser_path"], "w", zipfile.ZIP_DEFLATED, 1
+    ) as spenser_zip:
+        epc_zip.writestr("LICENCE.txt", "Synthetic data, for testing only.")
+        for i, (lad_code, lad_name) in enumerate(zip(lads.ladcd, lads.ladnm)):
+            if verbose:
+                print(f"Writing {lad_code} ({i + 1}/{n_lads})")
+            folder = f"domestic-{lad_code}-{lad_name}"
+            certificates = get_certificates(
+                postcodes.get_group(lad_code).to_numpy(),
+                n_certificates,
+                i * 10**8,
+                rng,
+            )
+            write_csv(epc_zip, f"{folder}/certificates.csv", certificates)
+            epc_zip.writestr(f"{folder}/recommendations.csv", "LMK_KEY\n")
+
+            households = get_households(
+                oas.get_group(lad_code).unique(), households_per_oa, rng
+            )
+            write_csv(
+                spenser_zip, f"msm_england/ass_hh_{lad_code}_OA11_2020.csv", households
+            )
+            spenser_zip.writestr(
+                f"msm_england/ass_{lad_code}_MSOA11_2020.csv", "PID,Area\n"
+            )
+
+        # Certificates without (or with a non-England) Local Authority
+        unknown = get_certificates(
+            area_lookup.pcds.to_numpy(), max(n_lads * 10, 10), 10**12, rng
+        )
+        write_csv(
+            epc_zip, "domestic-_unknown_local_authority_/certificates.csv", unknown
+        )
+        wales = get_certificates(np.array(["CF10 1AA"]), 10, 2 * 10**12, rng)
+        write_csv(epc_zip, "domestic-W06000015-Cardiff/certificates.csv", wales)
+
+    return paths
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description=__doc__.split("\n\n")[1])
+    parser.add_argument("--directory", default="data/input/")
+    parser.add_argument("--scale", choices=list(SCALES), default="lad")
+    for name in SCALES["lad"]:
+        parser.add_argument("--" + name.replace("_", "-"), type=int)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    sizes = {
+        name: value if getattr(args, name) is None else getattr(args, name)
+        for name, value in SCALES[args.scale].items()
+    }
+    generate(args.directory, **sizes, seed=args.seed, verbose=True)
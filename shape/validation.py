@@ -0,0 +1,363 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+SHAPE: internal validation
+Created on Sunday October 18 2026
+@author: patricia-ternes
+"""
+import io
+import multiprocessing
+import os
+import zipfile
+import numpy as np
+import pandas as pd
+
+# Histogram bin edges of the validation variables. As in
+# `pandas.Series.value_counts(bins=...)`, bins are right-closed intervals
+# and the first bin also includes its lower edge.
+BINS = {
+    "ACCOM_AGE": list(range(11)),
+    "FLOOR_AREA": list(range(21)),
+    "GAS": [0, 1, 2],
+}
+XLABELS = {
+    "ACCOM_AGE": "Accommodation age",
+    "FLOOR_AREA": "Floor area",
+    "GAS": "Gas Availability",
+}
+DATASETS = ["EPC", "SHAPE"]
+# Distribution metrics (see `distribution_metrics`)
+METRICS = ["r", "tae", "re", "rmse", "nrmse"]
+
+
+def bin_positions(values, edges) -> np.ndarray:
+    """Return the bin of each value.
+
+    :param values: numerical values
+    :type values: array-like
+    :param edges: bin edges
+    :type edges: list
+    :return: bin of each value (-1 or `len(edges) - 1` outside the bins and
+        for missing values)
+    :rtype: numpy.ndarray
+    """
+    values = np.asarray(values, dtype=float)
+    position = np.searchsorted(edges, values, side="left") - 1
+    position[values == edges[0]] = 0
+    return position
+
+
+def histogram(values, edges) -> np.ndarray:
+    """Count the values in each bin.
+
+    Values outside the bins (and missing values) are not counted.
+
+    :param values: numerical values
+    :type values: array-like
+    :param edges: bin edges
+    :type edges: list
+    :return: number of values per bin
+    :rtype: numpy.ndarray
+    """
+    position = bin_positions(values, edges)
+    inside = (position >= 0) & (position < len(edges) - 1)
+    return np.bincount(position[inside], minlength=len(edges) - 1)
+
+
+def area_histograms(values, areas, n_areas, edges) -> np.ndarray:
+    """Count the values in each bin, for several areas at once.
+
+    :param values: numerical values
+    :type values: array-like
+    :param areas: area of each value (from 0 to `n_areas` - 1, or -1 for
+        values without area, which are not counted)
+    :type areas: numpy.ndarray
+    :param n_areas: number of areas
+    :type n_areas: int
+    :param edges: bin edges
+    :type edges: list
+    :return: number of values per area (rows) and bin (columns)
+    :rtype: numpy.ndarray
+    """
+    n_bins = len(edges) - 1
+    position = bin_positions(values, edges)
+    inside = (position >= 0) & (position < n_bins) & (areas >= 0)
+    counts = np.bincount(
+        areas[inside] * n_bins + position[inside], minlength=n_areas * n_bins
+    )
+    return counts.reshape(n_areas, n_bins)
+
+
+def distribution_metrics(observed, simulated) -> dict:
+    """Compare the observed and simulated distributions of several areas.
+
+    Each row of counts is normalised into frequencies, and the errors
+    between the observed (EPC) and simulated (SHAPE) frequencies of each
+    area are summarised as in the `data/analysis` notebooks:
+
+    - "r": Pearson's correlation
+    - "tae": total absolute error
+    - "re": relative error (`tae` per bin)
+    - "rmse": root mean squared error
+    - "nrmse": `rmse` normalised by the range of the observed frequencies
+
+    Areas without observed or simulated values get missing metrics.
+
+    :param observed: observed counts per area (rows) and bin (columns)
+    :type observed: numpy.ndarray
+    :param simulated: simulated counts per area (rows) and bin (columns)
+    :type simulated: numpy.ndarray
+    :return: one array (one value per area) per metric
+    :rtype: dict
+    """
+    with np.errstate(divide="ignore", invalid="ignore"):
+        obs = observed / observed.sum(axis=1, keepdims=True)
+        sim = simulated / simulated.sum(axis=1, keepdims=True)
+        errors = obs - sim
+        n_bins = errors.shape[1]
+
+        obs_centred = obs - obs.mean(axis=1, keepdims=True)
+        sim_centred = sim - sim.mean(axis=1, keepdims=True)
+        r = (obs_centred * sim_centred).sum(axis=1) / np.sqrt(
+            (obs_centred**2).sum(axis=1) * (sim_centred**2).sum(axis=1)
+        )
+        tae = np.abs(errors).sum(axis=1)
+        rmse = np.sqrt((errors**2).sum(axis=1) / n_bins)
+        nrmse = rmse / (obs.max(axis=1) - obs.min(axis=1))
+
+    return {"r": r, "tae": tae, "re": tae / n_bins, "rmse": rmse, "nrmse": nrmse}
+
+
+class ValidationHistograms:
+    """Distributions of the validation variables per Local Authority.
+
+    The EPC and SHAPE histograms of "ACCOM_AGE", "FLOOR_AREA" and "GAS" are
+    counted as each Local Authority is ready, so no dataframe is kept until
+    the end of the run. They are stored as a small table (one row per Local
+    Authority, dataset, variable and bin), from which the validation images
+    are rendered.
+    """
+
+    COLUMNS = ["LADCD", "LADNM", "dataset", "variable", "bin", "count"]
+
+    def __init__(self, table=None) -> None:
+        """Initialise a ValidationHistograms class.
+
+        :param table: histograms table, defaults to None (empty).
+        :type table: pandas.DataFrame, optional
+        """
+        self.tables = [] if table is None else [table]
+
+    def add(self, epc_df, shape_df):
+        """Count the histograms of a Local Authority.
+
+        :param epc_df: processed EPC data of the Local Authority.
+        :type epc_df: pandas.DataFrame
+        :param shape_df: Enriched population of the Local Authority.
+        :type shape_df: pandas.DataFrame
+        """
+        lad_code = shape_df.LADCD.iloc[0]
+        lad_name = shape_df.LADNM.iloc[0]
+
+        rows = []
+        for dataset, df in zip(DATASETS, [epc_df, shape_df]):
+            for variable, edges in BINS.items():
+                counts = histogram(df[variable], edges)
+                rows.append(
+                    pd.DataFrame(
+                        {
+                            "dataset": dataset,
+                            "variable": variable,
+                            "bin": edges[1:],
+                            "count": counts,
+                        }
+                    )
+                )
+        table = pd.concat(rows, ignore_index=True)
+        table.insert(0, "LADNM", lad_name)
+        table.insert(0, "LADCD", lad_code)
+        self.tables.append(table)
+
+    @property
+    def table(self) -> pd.DataFrame:
+        """Histograms table.
+
+        :rtype: pandas.DataFrame
+        """
+        if not self.tables:
+            return pd.DataFrame(columns=self.COLUMNS)
+        if len(self.tables) > 1:
+            self.tables = [pd.concat(self.tables, ignore_index=True)]
+        return self.tables[0]
+
+    def save(self, path):
+        """Save the histograms table as a `.csv` file.
+
+        :param path: file location
+        :type path: string
+        """
+        self.table.to_csv(path, index=False)
+
+    @classmethod
+    def load(cls, path):
+        """Load a histograms table saved with `save`.
+
+        :param path: file location
+        :type path: string
+        :return: the histograms
+        :rtype: ValidationHistograms
+        """
+        return cls(pd.read_csv(path, dtype={"LADCD": str, "LADNM": str}))
+
+    def save_figures(self, zip_path, workers=1):
+        """Render the validation images of all Local Authorities.
+
+        Each image is rendered from the histograms table (with `workers`
+        processes) and saved in a zip file.
+
+        :param zip_path: zip file location
+        :type zip_path: string
+        :param workers: Number of worker processes, defaults to 1.
+        :type workers: int, optional
+        """
+        save_dir = os.path.dirname(zip_path)
+        if save_dir and not (os.path.exists(save_dir)):
+            os.makedirs(save_dir)
+
+        lads = [lad_table for _, lad_table in self.table.groupby("LADCD", sort=False)]
+        with zipfile.ZipFile(zip_path, "w") as png_zip:
+            if workers <= 1:
+                figures = map(render_figure, lads)
+                for fig_name, png in figures:
+                    png_zip.writestr(fig_name, png)
+                return
+
+            context = multiprocessing.get_context("fork")
+            with context.Pool(workers) as pool:
+                for fig_name, png in pool.imap(render_figure, lads):
+                    png_zip.writestr(fig_name, png)
+
+
+class ValidationMetrics:
+    """Validation metrics per Local Authority and per Output Area.
+
+    The EPC and SHAPE distributions of "ACCOM_AGE", "FLOOR_AREA" and "GAS"
+    (binned as in `ValidationHistograms`) are compared as each Local
+    Authority is ready (see `distribution_metrics`), for the whole Local
+    Authority and for each of its Output Areas at once, so the outputs are
+    never read again to check the quality of the matching.
+
+    The metrics are stored as a compact table: one row per Local Authority
+    (empty "OA") and per Output Area, with the number of households
+    (SHAPE rows) and certificates (EPC rows) and one
+    `<variable>_<metric>` column per variable and metric.
+    """
+
+    COLUMNS = ["LADCD", "LADNM", "OA", "households", "certificates"] + [
+        f"{variable}_{metric}" for variable in BINS for metric in METRICS
+    ]
+
+    def __init__(self) -> None:
+        """Initialise a ValidationMetrics class."""
+        self.tables = []
+
+    def add(self, epc_df, shape_df):
+        """Compute the metrics of a Local Authority and of its Output Areas.
+
+        :param epc_df: processed EPC data of the Local Authority.
+        :type epc_df: pandas.DataFrame
+        :param shape_df: Enriched population of the Local Authority.
+        :type shape_df: pandas.DataFrame
+        """
+        lad_code = shape_df.LADCD.iloc[0]
+        lad_name = shape_df.LADNM.iloc[0]
+        dfs = [epc_df, shape_df]
+
+        # Output Area id of each row
+        oas = pd.Index(epc_df.OA.dropna().unique()).union(
+            pd.Index(shape_df.OA.dropna().unique())
+        )
+        areas = [oas.get_indexer(df.OA) for df in dfs]
+
+        # Local Authority first (empty "OA"), then its Output Areas
+        table = {"LADCD": lad_code, "LADNM": lad_name, "OA": [None, *oas]}
+        for column, df, area in zip(["certificates", "households"], dfs, areas):
+            counts = np.bincount(area[area >= 0], minlength=len(oas))
+            table[column] = np.append(len(df), counts)
+        for variable, edges in BINS.items():
+            counts = [
+                np.vstack(
+                    [
+                        histogram(df[variable], edges),
+                        area_histograms(df[variable], area, len(oas), edges),
+                    ]
+                )
+                for df, area in zip(dfs, areas)
+            ]
+            for metric, values in distribution_metrics(*counts).items():
+                table[f"{variable}_{metric}"] = values
+        self.tables.append(pd.DataFrame(table, columns=self.COLUMNS))
+
+    @property
+    def table(self) -> pd.DataFrame:
+        """Metrics table.
+
+        :rtype: pandas.DataFrame
+        """
+        if not self.tables:
+            return pd.DataFrame(columns=self.COLUMNS)
+        if len(self.tables) > 1:
+            self.tables = [pd.concat(self.tables, ignore_index=True)]
+        return self.tables[0]
+
+    def save(self, path):
+        """Save the metrics table as a `.csv` file.
+
+        :param path: file location
+        :type path: string
+        """
+        self.table.to_csv(path, index=False, float_format="%.6g")
+
+
+def render_figure(lad_table):
+    """Render the validation image of a Local Authority.
+
+    Floor Area distribution and Accommodation age codes distribution
+    comparison between original EPC data and SHAPE population.
+
+    :param lad_table: histograms table of the Local Authority.
+    :type lad_table: pandas.DataFrame
+    :return: image name and PNG image
+    :rtype: string, bytes
+    """
+    import matplotlib.pyplot as plt
+    import seaborn as sns
+
+    colours = sns.color_palette()
+    sns.set(color_codes=True)
+    fig, ax = plt.subplots(nrows=3, ncols=2, figsize=(16, 15))
+    for j, (variable, edges) in enumerate(BINS.items()):
+        for k, dataset in enumerate(DATASETS):
+            counts = lad_table.loc[
+                (lad_table.dataset == dataset) & (lad_table.variable == variable),
+                "count",
+            ].to_numpy(dtype=float)
+            frequency = counts / counts.sum()
+
+            sns.barplot(
+                ax=ax[j][k], x=edges[1:], y=frequency, color=colours[3 * k]
+            )
+            ax[j][k].set_xlabel(XLABELS[variable])
+            ax[j][k].set_ylabel("Frequency")
+
+    ax[0][0].set_title("EPC")
+    ax[0][1].set_title("SHAPE")
+    fig.tight_layout(pad=3.0)
+    buf = io.BytesIO()
+    plt.savefig(buf)
+    plt.close()
+
+    lad_code = lad_table.LADCD.iloc[0]
+    lad_name = lad_table.LADNM.iloc[0]
+    fig_name = "_".join([lad_code, lad_name, "distribution.png"])
+    return fig_name, buf.getvalue()
@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+SHAPE: parallel reader of the zipped CSV inputs
+Created on Sunday October 18 2026
+@author: patricia-ternes
+"""
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import csv
+import io
+import os
+import threading
+import zipfile
+import pandas as pd
+
+try:
+    from .settings import load_config
+except ImportError:
+    from settings import load_config
+
+
+def has_arrow_csv() -> bool:
+    """Return True if the Arrow CSV reader (pyarrow) is available.
+
+    :rtype: bool
+    """
+    try:
+        import pyarrow.csv  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+class ZipCsvReader:
+    """CSV members of a zip file, decompressed and parsed on a thread pool.
+
+    zlib and the CSV parsers release the GIL, so several members are read
+    at the same time by threads (each thread has its own zip file handle).
+    The column selection and the column types are given to the parser: only
+    the selected columns are converted, and they are not inferred.
+
+    Members are parsed with the Arrow CSV reader when pyarrow is installed,
+    and with the pandas C parser otherwise. Both return the same dataframe:
+    columns in the file order, empty values as missing values and sorted
+    categories.
+    """
+
+    def __init__(self, path, workers=None) -> None:
+        """Initialise a ZipCsvReader class.
+
+        :param path: zip file location
+        :type path: string
+        :param workers: Number of threads, defaults to `read_workers` in
+            "config/config.yaml" (if not set: up to 4, one per CPU).
+        :type workers: int, optional
+        """
+        if workers is None:
+            parsed_config = load_config()
+            workers = parsed_config.get("read_workers")
+        if workers is None:
+            workers = min(4, os.cpu_count() or 1)
+
+        self.path = path
+        self.workers = max(1, workers)
+        self.arrow = has_arrow_csv()
+        self._local = threading.local()
+
+    @property
+    def zip_file(self) -> zipfile.ZipFile:
+        """Zip file handle of the current thread.
+
+        :rtype: zipfile.ZipFile
+        """
+        if not hasattr(self._local, "zip_file"):
+            self._local.zip_file = zipfile.ZipFile(self.path)
+        return self._local.zip_file
+
+    def get_header(self, file) -> list:
+        """Return the column names of a member.
+
+        :param file: member name/path
+        :type file: string
+        :rtype: list
+        """
+        with self.zip_file.open(file) as member:
+            line = io.TextIOWrapper(member, encoding="utf-8-sig").readline()
+        return next(csv.reader([line]))
+
+    def read(self, file, columns=None, dtype=None) -> pd.DataFrame:
+        """Read a member.
+
+        :param file: member name/path
+        :type file: string
+        :param columns: Columns to read (list, or function returning True for
+            the columns to read), defaults to None (all columns).
+        :type columns: list or callable, optional
+        :param dtype: Type of some columns: "category", `str` or `float`
+            (the other columns are inferred), defaults to None.
+        :type dtype: dict, optional
+        :return: member data
+        :rtype: pandas.DataFrame
+        """
+        header = self.get_header(file)
+        if columns is None:
+            columns = header
+        elif callable(columns):
+            columns = [column for column in header if columns(column)]
+        else:
+            missing = set(columns) - set(header)
+            if missing:
+                raise ValueError(f"Columns not found in {file}: {sorted(missing)}")
+            columns = [column for column in header if column in columns]
+        dtype = {
+            column: kind for column, kind in (dtype or {}).items() if column in columns
+        }
+
+        with self.zip_file.open(file) as member:
+            if self.arrow:
+                df = self._read_arrow(member, columns, dtype)
+            else:
+                df = pd.read_csv(member, usecols=columns, dtype=dtype, low_memory=False)
+
+        for column in df.select_dtypes("category").columns:
+            categories = df[column].cat.categories
+            if not categories.is_monotonic_increasing:
+                df[column] = df[column].cat.set_categories(categories.sort_values())
+        return df
+
+    @staticmethod
+    def _read_arrow(member, columns, dtype) -> pd.DataFrame:
+        """Parse a member with the Arrow CSV reader (see `read`).
+
+        :param member: open zip member
+        :type member: zipfile.ZipExtFile
+        :param columns: columns to read, in the file order
+        :type columns: list
+        :param dtype: type of some columns
+        :type dtype: dict
+        :rtype: pandas.DataFrame
+        """
+        import pyarrow as pa
+        import pyarrow.csv
+
+        types = {
+            "category": pa.dictionary(pa.int32(), pa.string()),
+            str: pa.string(),
+            float: pa.float64(),
+        }
+        # the default (mimalloc or jemalloc) pool keeps the freed memory
+        pool = pa.system_memory_pool()
+        table = pyarrow.csv.read_csv(
+            member,
+            read_options=pyarrow.csv.ReadOptions(use_threads=False),
+            parse_options=pyarrow.csv.ParseOptions(newlines_in_values=True),
+            convert_options=pyarrow.csv.ConvertOptions(
+                include_columns=columns,
+                column_types={column: types[dtype[column]] for column in dtype},
+                strings_can_be_null=True,
+            ),
+            memory_pool=pool,
+        )
+        # empty columns are float in pandas
+        for i, field in enumerate(table.schema):
+            if pa.types.is_null(field.type):
+                table = table.set_column(i, field.name, table[i].cast(pa.float64()))
+        return table.to_pandas(split_blocks=True, self_destruct=True, memory_pool=pool)
+
+    def map(self, function, files):
+        """Apply a function to several members on the thread pool.
+
+        At most two members per thread are read ahead of the consumer, so
+        the memory used does not grow with the number of members.
+
+        :param function: function of a member name/path (e.g. calling `read`)
+        :type function: callable
+        :param files: member names/paths
+        :type files: iterable
+        :return: function results, in the order of `files`
+        :rtype: generator
+        """
+        if self.workers <= 1:
+            for file in files:
+                yield function(file)
+            return
+
+        with ThreadPoolExecutor(self.workers) as pool:
+            queue = deque()
+            for file in files:
+                queue.append(pool.submit(function, file))
+                if len(queue) >= 2 * self.workers:
+                    yield queue.popleft().result()
+            while queue:
+                yield queue.popleft().result()
@@ -1,5 +1,37 @@
+import json
+import shutil
+import subprocess
+import sys
+import warnings
+import zipfile
+import numpy as np
+import pandas as pd
+import yaml
 from shape import __version__
-from shape.data_preparation import Epc
+from shape.api import LadLoader
+from shape.cache import DataCache, cache_key
+from shape.checkpoint import Checkpoint
+from shape.data_preparation import (
+    BandLookup,
+    CategoricalLookup,
+    Epc,
+    LadPartition,
+    Spenser,
+    augment,
+    compact_codes,
+    concat_categorical,
+    geo_lookup,
+)
+from shape.enriching_population import EnrichingPopulation
+from shape.geography import GeoLookupStore
+from shape.instrumentation import RunReport, collect, instrumented
+from shape.output import OutputArchive, OutputDataset
+from shape.pipeline import run_lads
+from shape.propensity import CausalModelPropensity, LogitPropensity, get_estimator
+from shape.settings import load_config
+from shape.synthetic import generate
+from shape.validation import BINS, ValidationHistograms, ValidationMetrics, histogram
+from shape.zip_reader import ZipCsvReader, has_arrow_csv
 
 import requests
 import pytest
@@ -15,6 +47,14 @@ def epc():
     return epc
 
 
+@pytest.fixture
+def synthetic_inputs(tmp_path, monkeypatch):
+    """Run in `tmp_path` with the configuration and 3 synthetic LADs (paths)."""
+    shutil.copytree("config", tmp_path / "config")
+    monkeypatch.chdir(tmp_path)
+    return generate(n_lads=3)
+
+
 def test_lookup_type(epc):
     assert type(epc.accommodation_lookup) is dict
     assert type(epc.age_categorical_lookup) is dict
@@ -46,3 +86,649 @@ def test_epc_connection(epc):
 # test if gas has the right values
 # test if tenure has the right values
 # test if accommodation type has the right values
+
+
+class _FakeData:
+    """Minimal stand-in for the Epc, Spenser and EnrichingPopulation objects."""
+
+    def __init__(self, df=None):
+        self.df = df
+        self.lookup_misses = {}
+
+    def get_lad_dataframe(self, lad_code):
+        return self.df.loc[self.df.LADCD == lad_code]
+
+    @staticmethod
+    def get_rng(lad_code):
+        return None
+
+    @staticmethod
+    def step(df0, df1=None, rng=None):
+        if df0.empty:
+            raise ValueError("empty Local Authority")
+        return df0
+
+
+def test_run_lads_order_and_errors():
+    df = pd.DataFrame({"LADCD": ["E1", "E2", "E2", "E3"], "x": [1, 2, 3, 4]})
+    data = _FakeData(df)
+    lad_codes = ["E3", "E9", "E1", "E2"]
+
+    for workers in [1, 2]:
+        results = list(run_lads(lad_codes, data, data, data, workers=workers))
+        assert [r[0] for r in results] == lad_codes
+        assert results[1][1] is None
+        assert list(results[3][1]["shape"].x) == [2, 3]
+
+
+def test_compiled_lookups():
+    with open("config/lookups.yaml") as lookup_yaml:
+        parsed_lookup = yaml.load(lookup_yaml, Loader=yaml.FullLoader)
+
+    tenure = parsed_lookup["tenure"]
+    values = pd.Series([*tenure, "typo", None, np.nan])
+    expected = values.apply(lambda x: augment(x, tenure)).astype(float)
+    assert np.array_equal(
+        CategoricalLookup(tenure).map(values), expected.to_numpy(), equal_nan=True
+    )
+
+    floor_area = parsed_lookup["floor_area"]
+    values = pd.Series([-1.0, 0.0, 0.5, 25.0, 25.1, 499.9, 500.0, 600.0, np.nan])
+    expected = values.copy()
+    for band in floor_area:
+        expected.loc[(values > band[1]) & (values <= band[2])] = band[0]
+    assert np.array_equal(
+        BandLookup(floor_area).map(values), expected.to_numpy(), equal_nan=True
+    )
+
+
+def test_get_matches():
+    distances = np.array([[0.0, 0.0, 0.1, 0.2], [0.0, 0.0, 0.0, 0.0]])
+    indices = np.array([[7, 3, 5, 1], [2, 4, 6, 8]])
+    distances = np.repeat(distances, 20000, axis=0)
+    indices = np.repeat(indices, 20000, axis=0)
+
+    pairs = EnrichingPopulation.get_matches(distances, indices, 4, rng=1)
+    assert np.array_equal(pairs[:, 0], np.arange(40000))
+    assert np.array_equal(
+        pairs, EnrichingPopulation.get_matches(distances, indices, 4, rng=1)
+    )
+
+    # step weights (100, 100, 52.5, 5) and uniform weights for zero distances
+    weighted = np.bincount(pairs[:20000, 1], minlength=9)[[7, 3, 5, 1]] / 20000
+    assert np.allclose(weighted, np.array([100, 100, 52.5, 5]) / 257.5, atol=0.015)
+    uniform = np.bincount(pairs[20000:, 1], minlength=9)[[2, 4, 6, 8]] / 20000
+    assert np.allclose(uniform, 0.25, atol=0.015)
+
+
+def test_sorted_neighbors():
+    rng = np.random.default_rng(0)
+    # no ties, ties and heavy ties (one propensity score per covariate cell)
+    for values, n_neighbors in [
+        (rng.random(2000), 20),
+        (rng.choice(rng.random(50), 2000), 20),
+        (rng.choice(rng.random(6), 2000), 200),
+    ]:
+        df1 = pd.DataFrame({"ps": rng.choice(values, 500)})
+        df2 = pd.DataFrame({"ps": values})
+        sklearn = EnrichingPopulation.get_neighbors(df1, df2, n_neighbors, "sklearn")
+        distances, indices = EnrichingPopulation.get_neighbors(df1, df2, n_neighbors)
+
+        # the rows sorted by distance and then by index
+        query = df1.ps.to_numpy()[:, None]
+        expected = np.lexsort(
+            (
+                np.broadcast_to(np.arange(len(values)), (len(query), len(values))),
+                np.abs(values - query),
+            ),
+            axis=1,
+        )[:, :n_neighbors]
+        assert np.array_equal(indices, expected)
+        assert np.array_equal(indices, sklearn[1])
+        assert np.array_equal(distances, sklearn[0])
+        assert np.array_equal(np.abs(values[indices] - query), distances)
+
+    assert EnrichingPopulation().neighbors_backend == "sorted"
+
+
+def test_logit_propensity():
+    rng = np.random.default_rng(0)
+    n_rows = 4000
+    df = pd.DataFrame(
+        {
+            "LC4402_C_TYPACCOM": rng.integers(2, 6, n_rows),
+            "tenure": rng.choice([1, 5, 6], n_rows),
+            "Area_factor": rng.integers(0, 30, n_rows),
+        }
+    )
+    logit = 0.4 * df.LC4402_C_TYPACCOM - 0.2 * df.tenure + 0.02 * df.Area_factor
+    df["Treatment"] = (rng.random(n_rows) < 1 / (1 + np.exp(-logit + 1))).astype(int)
+    columns = ["LC4402_C_TYPACCOM", "tenure", "Area_factor"]
+
+    expected = CausalModelPropensity.fit_predict(df, columns)
+    assert np.allclose(LogitPropensity().fit_predict(df, columns), expected, atol=1e-6)
+
+    categorical = LogitPropensity(categorical=["Area_factor"]).fit_predict(df, columns)
+    assert np.isclose(categorical.mean(), df.Treatment.mean())
+
+
+def test_data_cache(tmp_path, monkeypatch):
+    cache = DataCache(str(tmp_path))
+    df = pd.DataFrame({"BRN": [1, 2], "POSTCODE": ["A 1", None]})
+    key = cache_key("input", ["POSTCODE"])
+
+    built, metadata = cache.load_or_build("epc", key, lambda: (df, {"n": 1}))
+    cached, metadata = cache.load("epc", key)
+    pd.testing.assert_frame_equal(cached, df)
+    assert metadata["n"] == 1
+
+    # a new key invalidates (and replaces) the stale entry
+    new_key = cache_key("input", ["POSTCODE", "LODGEMENT_DATE"])
+    assert cache.load("epc", new_key) == (None, None)
+    cache.save("epc", new_key, df)
+    assert cache.load("epc", key) == (None, None)
+    assert len(list(tmp_path.iterdir())) == 2
+
+    # without pyarrow the cache is disabled, with a warning
+    monkeypatch.setattr("shape.cache.has_parquet", lambda: False)
+    with pytest.warns(UserWarning, match="pyarrow is not installed"):
+        cache = DataCache(str(tmp_path))
+    assert cache.load("epc", new_key) == (None, None)
+
+
+def test_geo_lookup_store(tmp_path):
+    ladcd_lookup = {"E001": "E06000001", "E002": "E06000002", "E003": "E06000001"}
+    ladnm_lookup = {"E001": "Lad1", "E002": "Lad2", "E003": "Lad1"}
+    oacd_lookup = {"AB1 2CD": "E002", "ab1 3cd": "E001", "ZZ9 9ZZ": "E999"}
+    store = GeoLookupStore.from_lookups(ladnm_lookup, ladcd_lookup, oacd_lookup)
+
+    cache = DataCache(str(tmp_path))
+    cache.save_arrays("geo", "key", store.arrays)
+    store = GeoLookupStore(cache.load_arrays("geo", "key"))
+    assert isinstance(store.postcodes, np.memmap)
+
+    assert list(store.lads()) == ["E06000001", "E06000002"]
+    assert dict(store.ladcd) == ladcd_lookup
+    assert dict(store.ladnm) == ladnm_lookup
+    assert store.oacd["AB12CD"] == "E002"
+    assert "ZZ9 9ZZ" not in store.oacd
+
+    oa = store.oacd.map(["AB1 3CD", "AB1  2CD", "ZZ9 9ZZ", None])
+    assert list(oa) == ["E001", "E002", None, None]
+    assert list(store.ladnm.map(["E003", "E004"])) == ["Lad1", None]
+
+
+def test_output_archive(tmp_path):
+    dfs = {
+        lad_code: pd.DataFrame({"LADCD": [lad_code] * 3, "FLOOR_AREA": [1, 2, i]})
+        for i, lad_code in enumerate(["E06000001", "E06000002"])
+    }
+    with OutputArchive("SHAPE_England", "_SHAPE.csv", str(tmp_path)) as output:
+        for lad_code, df in dfs.items():
+            output.write(lad_code, df)
+
+    with zipfile.ZipFile(tmp_path / "SHAPE_England.zip") as csv_zip:
+        assert csv_zip.namelist() == ["E06000001__SHAPE.csv", "E06000002__SHAPE.csv"]
+        for lad_code, df in dfs.items():
+            csv = csv_zip.read(f"{lad_code}__SHAPE.csv").decode()
+            assert csv == df.to_csv(index=False, header=True)
+            info = csv_zip.getinfo(f"{lad_code}__SHAPE.csv")
+            assert info.compress_type == zipfile.ZIP_DEFLATED  # config.yaml
+
+
+def test_output_dataset(tmp_path, synthetic_inputs):
+    config = (tmp_path / "config" / "config.yaml").read_text()
+    config = config.replace("output_parquet: false", "output_parquet: true")
+    config = config.replace("output_row_group_size: 8192", "output_row_group_size: 4")
+    (tmp_path / "config" / "config.yaml").write_text(config)
+
+    rng = np.random.default_rng(0)
+    dfs = {
+        lad_code: pd.DataFrame(
+            {
+                "HID": range(20),
+                "LADCD": lad_code,
+                "OA": rng.choice([f"{lad_code}-{i}" for i in range(5)], 20),
+                "FLOOR_AREA": rng.integers(1, 21, 20),
+            }
+        )
+        for lad_code in ["E06000001", "E06000002"]
+    }
+    with OutputArchive("SHAPE_England", "_SHAPE.csv", index_column="OA") as output:
+        for lad_code, df in dfs.items():
+            output.write(lad_code, df)
+
+    # rows of a few Output Areas (sorted by Output Area, row groups of 4 rows)
+    dataset = OutputDataset("data/output/SHAPE_England")
+    assert dataset.lads() == list(dfs)
+    oas = dataset.oas(["E06000002"])[1:3] + dataset.oas(["E06000001"])[:1]
+    df = dataset.read(oas=oas, columns=["OA", "HID", "LADCD"])
+    expected = pd.concat(dfs.values())
+    expected = expected[expected.OA.isin(oas)]
+    expected = expected.sort_values(["LADCD", "OA"], kind="stable")
+    pd.testing.assert_frame_equal(
+        df, expected[["OA", "HID", "LADCD"]].reset_index(drop=True), check_dtype=False
+    )
+    assert len(dataset.read(lads=["E06000001"])) == 20
+
+
+def test_validation_histograms(tmp_path):
+    rng = np.random.default_rng(0)
+    for edges in BINS.values():
+        values = np.r_[rng.integers(-1, 23, 500), rng.random(500) * 22, np.nan]
+        expected = pd.Series(values).value_counts(bins=edges).sort_index()
+        assert np.array_equal(histogram(values, edges), expected.to_numpy())
+
+    df = pd.DataFrame({variable: rng.integers(0, 3, 10) for variable in BINS})
+    histograms = ValidationHistograms()
+    histograms.add(df, df.assign(LADCD="E06000001", LADNM="Lad"))
+    histograms.save(tmp_path / "histograms.csv")
+    table = ValidationHistograms.load(tmp_path / "histograms.csv").table
+    pd.testing.assert_frame_equal(table, histograms.table)
+    assert (table.groupby(["dataset", "variable"])["count"].sum() == 10).all()
+
+
+def test_validation_metrics():
+    rng = np.random.default_rng(0)
+    epc_df = pd.DataFrame({variable: rng.integers(1, 3, 40) for variable in BINS})
+    epc_df["OA"] = rng.choice(["E1", "E2"], 40)
+    shape_df = epc_df.sample(30, random_state=0, replace=True)
+    shape_df = shape_df.assign(LADCD="E06000001", LADNM="Lad", OA="E1")
+
+    metrics = ValidationMetrics()
+    metrics.add(epc_df, shape_df)
+    table = metrics.table
+    assert table.OA.tolist() == [None, "E1", "E2"]
+    assert table.households.tolist() == [30, 30, 0]
+    assert table.certificates.tolist() == [40, *epc_df.OA.value_counts().sort_index()]
+
+    # root mean squared error of the frequencies (as in `data/analysis`)
+    obs = epc_df.GAS.value_counts(normalize=True).sort_index()
+    sim = shape_df.GAS.value_counts(normalize=True).sort_index()
+    assert np.isclose(table.GAS_rmse[0], np.sqrt(((obs - sim) ** 2).mean()))
+    assert np.isnan(table.GAS_rmse[2])  # no households in "E2"
+
+
+def test_lad_partition():
+    df = pd.DataFrame({"LADCD": ["E2", "E1", None, "E2", "E1"], "x": range(5)})
+    sorted_df, partition = LadPartition.sort(df)
+    for lad_code in ["E1", "E2", "E9"]:
+        expected = df.loc[df.LADCD == lad_code].reset_index(drop=True)
+        lad_df = partition.get(sorted_df, lad_code).reset_index(drop=True)
+        pd.testing.assert_frame_equal(lad_df, expected)
+
+    # an already sorted dataframe is not copied
+    assert LadPartition.sort(sorted_df)[0] is sorted_df
+
+
+def test_checkpoint(tmp_path):
+    epc_df = pd.DataFrame({"LADCD": ["E1", "E1"], "BRN": [1, 2]})
+    spenser_df = pd.DataFrame({"LADCD": ["E1"], "HID": [7]})
+    result = {"shape": spenser_df, "epc": epc_df, "lookup_misses": {"gas": 1}}
+
+    checkpoint = Checkpoint(str(tmp_path))
+    key = checkpoint.get_key(epc_df, spenser_df)
+    checkpoint.save("E1", result)
+    assert checkpoint.load("E1", key) is None  # not recorded yet
+    checkpoint.record("E1", {**result, "key": key})
+
+    # a new run resumes the Local Authority only if its inputs did not change
+    checkpoint = Checkpoint(str(tmp_path))
+    resumed = checkpoint.load("E1", key)
+    pd.testing.assert_frame_equal(resumed["epc"], epc_df)
+    assert resumed["lookup_misses"] == {"gas": 1}
+    assert checkpoint.load("E1", checkpoint.get_key(epc_df.head(1), spenser_df)) is None
+
+    assert Checkpoint(str(tmp_path), restart=True).load("E1", key) is None
+
+
+def test_run_report(tmp_path, capsys):
+    stage = instrumented("head")(lambda df: df.head(2))
+    with collect("E1") as records:
+        stage(pd.DataFrame({"x": range(5)}))
+    assert (records[0]["stage"], records[0]["rows_in"], records[0]["rows_out"]) == (
+        "head",
+        5,
+        2,
+    )
+
+    df = pd.DataFrame({"LADCD": ["E1", "E2"], "x": [1, 2]})
+    data = _FakeData(df)
+    report = RunReport()
+    list(run_lads(["E1", "E2", "E9"], data, data, data, report=report))
+    report.save(tmp_path / "report.json", tmp_path / "stages.csv")
+
+    saved = json.load(open(tmp_path / "report.json"))
+    assert saved["failed"] == ["E9"]
+    assert saved["lads"]["E9"]["error"]["type"] == "ValueError"
+    assert "empty Local Authority" in saved["lads"]["E9"]["error"]["traceback"]
+    assert saved["lads"]["E1"]["status"] == "done"
+
+    # results that could not be saved in the checkpoint are reported
+    class _BrokenCheckpoint:
+        enabled = True
+        get_key = staticmethod(lambda epc_df, spenser_df: "key")
+        load = staticmethod(lambda lad_code, key: None)
+
+        @staticmethod
+        def save(lad_code, result):
+            raise OSError("No space left on device")
+
+    report = RunReport()
+    with pytest.warns(UserWarning, match="Checkpoint not saved for E1"):
+        checkpoint = _BrokenCheckpoint()
+        results = dict(
+            run_lads(["E1"], data, data, data, checkpoint=checkpoint, report=report)
+        )
+    assert results["E1"] is not None and "key" not in results["E1"]
+    report.save(tmp_path / "report.json")
+    saved = json.load(open(tmp_path / "report.json"))
+    assert saved["failed"] == [] and saved["checkpoint_failed"] == ["E1"]
+    assert saved["lads"]["E1"]["checkpoint_error"]["type"] == "OSError"
+    assert saved["checkpoint"] == "enabled"
+
+    # without pyarrow, the disabled checkpoint is reported
+    checkpoint = _BrokenCheckpoint()
+    checkpoint.enabled = False
+    checkpoint.save = lambda lad_code, result: None
+    report = RunReport()
+    dict(run_lads(["E1"], data, data, data, checkpoint=checkpoint, report=report))
+    assert "Checkpoint disabled" in capsys.readouterr().out
+    assert report.checkpoint == "disabled"
+
+
+def test_synthetic_pipeline(synthetic_inputs):
+    lad_codes, ladnm, ladcd, oacd = geo_lookup(use_cache=False)
+    assert list(lad_codes) == ["E06000001", "E06000002", "E06000003"]
+    spenser = Spenser(ladnm, ladcd, use_cache=False)
+    epc = Epc(oacd, ladnm, ladcd, use_cache=False)
+    results = dict(run_lads(lad_codes, epc, spenser, EnrichingPopulation()))
+    for lad_code, result in results.items():
+        assert set(result["shape"].LADCD) == {lad_code}
+        assert result["shape"].FLOOR_AREA.notna().all()
+
+
+def test_streamed_certificates(synthetic_inputs):
+    lad_codes, ladnm, ladcd, oacd = geo_lookup(use_cache=False)
+    spenser = Spenser(ladnm, ladcd, use_cache=False)
+    national = Epc(oacd, ladnm, ladcd, use_cache=False)
+    certificates = national.get_certificates(use_cache=False).drop(columns="FILE")
+    psm = EnrichingPopulation()
+    psm.seed = 0
+
+    with warnings.catch_warnings():
+        warnings.simplefilter("error")
+        epc = Epc(oacd, ladnm, ladcd, stream=True, use_cache=False)
+        streamed = list(epc.iter_lad_dataframes())
+
+        # same certificates as the per-LAD de-duplication of the national read
+        assert sorted(lad_code for lad_code, _ in streamed) == sorted(lad_codes)
+        for lad_code, lad_df in streamed:
+            lad_certificates = certificates[certificates.LADCD == lad_code]
+            pd.testing.assert_frame_equal(
+                Epc.remove_duplicates(lad_df).astype(str),
+                Epc.remove_duplicates(lad_certificates).astype(str),
+                check_categorical=False,
+            )
+
+        results = dict(run_lads(lad_codes, epc, spenser, psm, epc_lads=streamed))
+
+    # same results as the Local Authorities of the national read
+    national_lads = [
+        (lad_code, certificates[certificates.LADCD == lad_code])
+        for lad_code, _ in streamed
+    ]
+    expected = dict(run_lads(lad_codes, national, spenser, psm, epc_lads=national_lads))
+    assert list(results) == [lad_code for lad_code, _ in streamed]
+    for lad_code, result in results.items():
+        pd.testing.assert_frame_equal(result["epc"], expected[lad_code]["epc"])
+        pd.testing.assert_frame_equal(result["shape"], expected[lad_code]["shape"])
+
+
+def test_compact_dtypes():
+    df = pd.DataFrame({"a": [1.0, 2.0, 3.0], "b": [1, 300, 2]})
+    compact_codes(df, ["a", "b"])
+    assert list(df.dtypes) == [np.int8, np.int16]
+    assert list(df.a) == [1, 2, 3]
+
+    parts = [
+        pd.DataFrame({"x": pd.Categorical(["Y", "N"])}),
+        pd.DataFrame({"x": pd.Categorical(["N", None])}),
+    ]
+    df = concat_categorical(parts)
+    assert isinstance(df.x.dtype, pd.CategoricalDtype)
+    assert list(df.x.astype(object).fillna("")) == ["Y", "N", "N", ""]
+
+
+def test_remove_duplicates():
+    df = pd.DataFrame(
+        {
+            "BUILDING_REFERENCE_NUMBER": [7, 8, 7, 9, 7, 8, 6, 6],
+            "LODGEMENT_DATETIME": [
+                "2015-01-01 10:00:00",
+                "2012-05-01 00:00:00",
+                "2020-03-01 09:30:00",
+                "2011-01-01 00:00:00",
+                "2018-01-01 00:00:00",
+                "2012-05-01 00:00:00",
+                None,
+                "2019-01-01 00:00:00",
+            ],
+            "row": list("abcdefgh"),
+        }
+    )
+    # latest certificate of each building (ties keep the last certificate,
+    # certificates without date are sorted last), in the original row order
+    result = Epc.remove_duplicates(df)
+    assert list(result.columns) == ["row"]
+    assert list(result.row) == ["c", "d", "f", "g"]
+    assert len(Epc.remove_duplicates(df.iloc[:0])) == 0
+
+    # dates in another format
+    dates = df.LODGEMENT_DATETIME.str[:10]
+    result = Epc.remove_duplicates(df.assign(LODGEMENT_DATETIME=dates))
+    assert list(result.row) == ["c", "d", "f", "g"]
+
+
+def test_incremental_certificates(tmp_path, synthetic_inputs):
+    paths = synthetic_inputs
+    lad_codes, ladnm, ladcd, oacd = geo_lookup(use_cache=False)
+    Epc(oacd, ladnm, ladcd)
+
+    # new release: the certificates of one Local Authority are lodged again
+    old_path = tmp_path / "old.zip"
+    shutil.move(paths["epc_path"], old_path)
+    with zipfile.ZipFile(old_path) as old, zipfile.ZipFile(
+        paths["epc_path"], "w"
+    ) as new:
+        for name in old.namelist():
+            data = old.read(name)
+            if name.startswith("domestic-E06000002") and "certificates" in name:
+                df = pd.read_csv(old.open(name))
+                df["LODGEMENT_DATETIME"] = "2023-01-01 00:00:00"
+                data = df.to_csv(index=False)
+            new.writestr(name, data)
+
+    epc = Epc(oacd, ladnm, ladcd)
+    assert (epc.files_read, epc.files_reused) == (1, 3)
+    full = Epc(oacd, ladnm, ladcd, use_cache=False)
+    pd.testing.assert_frame_equal(
+        epc.df.astype(str), full.df.astype(str), check_categorical=False
+    )
+    assert epc.lookup_misses == full.lookup_misses
+
+
+def test_realisations():
+    rng = np.random.default_rng(0)
+
+    def population(n, **columns):
+        df = pd.DataFrame(
+            {
+                "OA": rng.choice(["E1", "E2", "E3"], n),
+                "LC4402_C_TYPACCOM": rng.integers(2, 6, n),
+                "tenure": rng.choice([1, 5, 6], n),
+            }
+        )
+        return df.assign(**{name: rng.integers(1, 9, n) for name in columns})
+
+    spenser = population(300, HID=None)
+    epc = population(100, FLOOR_AREA=None, GAS=None, ACCOM_AGE=None)
+    psm = EnrichingPopulation()
+    psm.n_neighbors = 10
+    psm.estimator = get_estimator("logit")
+
+    single = psm.step(spenser.copy(), epc.copy(), rng=5, n_realisations=1)
+    ensemble = psm.step(spenser.copy(), epc.copy(), rng=5, n_realisations=3)
+
+    # the first realisation is the single one, the others are EPC row ids
+    pd.testing.assert_frame_equal(ensemble[single.columns], single)
+    ids = ["EPCid_0", "EPCid_1", "EPCid_2"]
+    assert list(ensemble.columns[-3:]) == ids
+    matched = epc.loc[ensemble.EPCid_0, ["FLOOR_AREA", "GAS", "ACCOM_AGE"]]
+    assert (matched.to_numpy() == single[matched.columns].to_numpy()).all()
+    assert (ensemble.EPCid_1 != ensemble.EPCid_2).any()
+
+
+def test_lad_loader(synthetic_inputs):
+    lad_codes, ladnm, ladcd, oacd = geo_lookup(use_cache=False)
+    epc = Epc(oacd, ladnm, ladcd, use_cache=False)
+    spenser = Spenser(ladnm, ladcd, use_cache=False)
+
+    # same rows (and row order) as the national dataframes
+    loader = LadLoader(maxsize=1)
+    frames = loader.get(["E06000002"])
+    for lad_df, national in zip(frames["E06000002"], [epc, spenser]):
+        expected = national.get_lad_dataframe("E06000002").reset_index(drop=True)
+        pd.testing.assert_frame_equal(
+            lad_df.astype(str), expected.astype(str), check_categorical=False
+        )
+    assert LadLoader(maxsize=1).get_index()["epc_files"] == loader.index["epc_files"]
+
+    # the Household files are found by name
+    assert spenser.get_household_lads(
+        ["msm/ass_hh_E06000002_OA11_2020.csv", "ass_hh_E07000004_OA11_2020.csv"]
+    ) == ["E06000002", None]
+    subset = Spenser(ladnm, ladcd, lad_codes=["E06000002"])
+    pd.testing.assert_frame_equal(
+        subset.df.astype(str), frames["E06000002"][1].astype(str)
+    )
+
+    # least recently used Local Authorities are dropped
+    loader.get(["E06000003"])
+    assert list(loader.frames) == ["E06000003"]
+    with pytest.raises(ValueError):
+        loader.get(["E09999999"])
+
+
+def test_match_cells():
+    rng = np.random.default_rng(1)
+    spenser = pd.DataFrame({"ps": rng.choice([0.2, 0.5, 0.7], 500)})
+    epc = pd.DataFrame({"ps": rng.choice([0.1, 0.2, 0.5, 0.6, 0.9], 80)})
+
+    # the candidate pools of the cells give the same matches as the
+    # neighbors of each row
+    distances, indices = EnrichingPopulation.get_neighbors(spenser, epc, 10)
+    rows = EnrichingPopulation.get_matches(distances, indices, 10, rng=4)
+    distances, indices, cells = EnrichingPopulation.get_cell_neighbors(spenser, epc, 10)
+    assert len(distances) == 3
+    matches = EnrichingPopulation.get_matches(distances, indices, 10, 4, cells=cells)
+    assert (matches == rows).all()
+
+
+def test_zip_csv_reader(tmp_path):
+    path = tmp_path / "input.zip"
+    with zipfile.ZipFile(path, "w") as zip_file:
+        for i in range(3):
+            zip_file.writestr(
+                f"part{i}.csv",
+                "A,B,C,D\n" + "".join(f"x{j % 2},{j},,{j / 2}\n" for j in range(9)),
+            )
+
+    reader = ZipCsvReader(path, workers=2)
+    dtype = {"A": "category", "D": float}
+    files = ["part0.csv", "part1.csv"]
+    dfs = list(
+        reader.map(lambda file: reader.read(file, ["D", "A", "C"], dtype), files)
+    )
+    assert len(dfs) == 2
+    df = dfs[0]
+    assert list(df.columns) == ["A", "C", "D"]  # file order
+    assert list(df.A.cat.categories) == ["x0", "x1"]
+    assert df.C.isna().all()
+    assert df.D.iloc[3] == 1.5
+
+    # both parsers return the same dataframe
+    if has_arrow_csv():
+        reader.arrow = False
+        pd.testing.assert_frame_equal(
+            reader.read("part2.csv", lambda column: column != "B", dtype), df
+        )
+    with pytest.raises(ValueError):
+        reader.read("part0.csv", ["E"])
+
+
+@pytest.mark.skipif(not has_arrow_csv(), reason="pyarrow is not installed")
+def test_certificate_parsers(synthetic_inputs):
+    lad_codes, ladnm, ladcd, oacd = geo_lookup(use_cache=False)
+    epc = Epc(oacd, ladnm, ladcd, use_cache=False)
+    reader = ZipCsvReader(epc.path, workers=1)
+    file = epc.get_certificate_files(reader.zip_file)[0]
+
+    # the Arrow and pandas parsers return the same certificates
+    arrow = epc.read_certificates(reader, file)
+    reader.arrow = False
+    pd.testing.assert_frame_equal(epc.read_certificates(reader, file), arrow)
+    assert arrow["LODGEMENT_DATETIME"].dtype == "datetime64[ns]"
+
+
+def test_load_config(tmp_path, monkeypatch):
+    path = tmp_path / "config.yaml"
+    path.write_text(open("config/config.yaml").read())
+    config = load_config(path)
+    assert config["n_neighbors"] == 200
+    assert load_config(path) is config  # parsed once
+    with pytest.raises(TypeError):
+        config["n_neighbors"] = 1  # shared, read-only
+
+    # the file is parsed again when it changes
+    path.write_text(path.read_text() + "n_neighbour: 3\n")
+    with pytest.raises(ValueError, match="unknown key 'n_neighbour'"):
+        load_config(path)
+    path.write_text(path.read_text().replace("n_neighbour: 3", "seed: yes"))
+    with pytest.raises(ValueError, match="'seed' must be int or null"):
+        load_config(path)
+
+    # values are checked before any stage runs
+    config = path.read_text().replace("seed: yes", "")
+    path.write_text(config.replace('"deflate"', '"zstd"'))
+    if hasattr(zipfile, "ZIP_ZSTANDARD"):
+        assert load_config(path)["output_compression"] == "zstd"
+    else:
+        with pytest.raises(ValueError, match="'output_compression' must be one of"):
+            load_config(path)
+    for old, new, message in [
+        ('backend: "sorted"', 'backend: "sortd"', "not 'sortd'"),
+        ('estimator: "causalinference"', 'estimator: "lgit"', "not 'lgit'"),
+        ('compression: "deflate"', 'compression: "gzip"', "not 'gzip'"),
+        ("categorical: []", "categorical: [TENURE]", r"\['TENURE'\] are not in"),
+    ]:
+        assert old in config
+        path.write_text(config.replace(old, new))
+        with pytest.raises(ValueError, match=message):
+            load_config(path)
+
+    # the configuration is checked without loading the data libraries
+    code = (
+        "import sys; from shape.settings import load_config; "
+        f"load_config({str(path)!r}); "
+        "print(sorted({'numpy', 'pandas'} & set(sys.modules)))"
+    )
+    path.write_text(config)
+    output = subprocess.run([sys.executable, "-c", code], capture_output=True)
+    assert output.stdout.decode().strip() == "[]"
+
+    # the Parquet outputs need pyarrow
+    path.write_text(config.replace("output_parquet: false", "output_parquet: true"))
+    monkeypatch.setattr("shape.settings.find_spec", lambda name: None)
+    with pytest.raises(ValueError, match="'output_parquet' needs pyarrow"):
+        load_config(path)